@@ -0,0 +1,82 @@
+##############################################################################
+############################################################################## 
+# Open Sonar Catalog
+##############################################################################
+##############################################################################
+# Created for the Open Sonar Project by:
+# Graham Christie, Isaac Fuller, Kara Sanford
+# January 2022
+#############################################
+# Version 1.0
+##############################################################################
+##############################################################################
+
+# This program should be used to find config files and logs from past surveys.
+# Capabilities include:
+#     - Indexing every config file, raw log and simple log in a folder tree
+#     - Listing files by survey, vessel, sensor, file type and date
+#     - Summing up surveys with their time spans and ping counts
+# The index is kept in a database, so searches do not open any log and only
+# new or changed files are read when a folder is scanned again.
+
+##############################################################################
+##############################################################################
+
+import time
+
+import osplib
+
+# Introductory text displayed
+osplib.osp_logo()
+print('Welcome to Open Sonar Catalog!')
+print('-----------------------------')
+time.sleep(2)
+print('Please type your responses to the following questions in the terminal.')
+print('Do not use spaces in any response.')
+time.sleep(3)
+
+database = input('Enter catalog database name (leave empty for Output/survey_catalog.sqlite): ')
+catalog = osplib.Survey_Catalog(database or 'Output/survey_catalog.sqlite')
+
+proceed = False
+while not proceed:
+    print('-----------------------------------------')
+    print('Please select one of the following options:')
+    print('    - scan          (Index the files in a folder and its subfolders)')
+    print('    - find          (List files matching filters)')
+    print('    - surveys       (Sum up the catalogued surveys)')
+    print('    - exit          (Close the catalog)')
+    selection = input('Type your selection here: ')
+    
+    if selection == 'scan':
+        folder = input('Enter folder to scan: ')
+        print('Scanning folder. This may take a moment.....')
+        catalog.scan(folder)
+        
+    elif selection == 'find':
+        print('Leave a filter empty to skip it')
+        filters = {}
+        for name in ('filetype', 'survey', 'vessel', 'sensor', 'date_from', 'date_to'):
+            filters[name] = input('Enter '+name+': ')
+        files = catalog.find(**filters)
+        for entry in files:
+            print(entry['path'])
+            print('    '+entry['filetype']+', '+entry['survey']+', '+
+                  entry['vessel']+', '+entry['survey_date']+', '+
+                  str(entry['first_time'])+' to '+str(entry['last_time'])+', '+
+                  str(entry['records'])+' records, '+str(entry['pings'])+' pings')
+        print(f'{len(files)} files found')
+        
+    elif selection == 'surveys':
+        for survey in catalog.surveys():
+            print(survey['survey']+' ('+survey['vessel']+', '+survey['survey_date']+'): '+
+                  str(survey['files'])+' files, '+str(survey['raw_logs'])+' raw logs, '+
+                  str(survey['pings'])+' pings, '+str(survey['first_time'])+' to '+
+                  str(survey['last_time']))
+    
+    elif selection == 'exit':
+        proceed = True
+    else:
+        print('Invalid entry - Please select an option from the list.')
+
+catalog.close()
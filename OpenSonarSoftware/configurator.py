@@ -88,6 +88,127 @@ svp_port = 'COM9'
 svp_baud = 9600
 #-----------------
 
+#-----------------
+# Additional sensors
+    # Add a row for each additional sensor with its name, type (gnss or
+    # sonar), com port, baud rate and waterline offset, for example
+    # ['Sonar_2', 'sonar', 'COM4', 115200, -0.5]. Their records are tagged
+    # with their name in the raw log, and additional sonars always stream.
+additional_sensors = []
+#-----------------
+
+#-----------------
+# Sonar ping mode
+    # Replace the text with triggered to ping on every GNSS position message,
+    # epoch to ping once for each GNSS epoch, rate to ping on the GNSS
+    # messages nearest a fixed ping interval, free to ping on a timer
+    # whatever the GNSS sends, or stream to have the sonar ping continuously
+    # on its own
+    # Replace the number with the time between pings in milliseconds in rate,
+    # free and stream modes
+ping_mode = 'triggered'
+ping_interval = 100
+    # Replace the number with how many milliseconds before it is due a ping
+    # may be taken in rate mode, so it can fall on a GNSS message. Pings
+    # taken later than this after they are due are counted as late.
+ping_jitter = 50
+#-----------------
+
+#-----------------
+# Sonar range control
+    # Replace the text with adaptive to narrow the sonar's scan window and
+    # shorten the time between pings when the depth is steady, going back to
+    # the sonar's auto mode when the bottom is lost, or none to leave the
+    # sonar in auto mode
+range_control = 'none'
+    # Replace the number with the confidence in percent a ping needs for its
+    # depth to be used
+range_confidence = 70
+    # Replace the number with the shortest time between pings in milliseconds
+range_min_interval = 50
+#-----------------
+
+#-----------------
+# Echo capture
+    # Replace the text with yes to save the echo profile of every ping to an
+    # echo file next to the raw log, or no to log only the sonar's bottom pick
+echo_capture = 'no'
+#-----------------
+
+#-----------------
+# Raw log compression
+    # Replace the text with gzip to write the raw log compressed in blocks,
+    # or no to write it as plain text
+log_compression = 'no'
+#-----------------
+
+#-----------------
+# Raw log rotation
+    # Replace the text with size to start new log files every so many MB,
+    # duration to start them every so many minutes, line to start them only
+    # when the operator starts a new survey line, or none to keep one log.
+    # The new survey line key works in every mode except none.
+log_rotation = 'none'
+    # Replace the number with the size in MB or duration in minutes
+rotation_limit = 0
+#-----------------
+
+#-----------------
+# Live processing
+    # Replace the text with yes to extract and grid soundings while they are
+    # recorded, or no to process them only afterwards
+live_processing = 'no'
+    # Replace the number with the size of the coverage grid cells in metres
+grid_cell_size = 5
+    # Replace the text with a sound speed profile file to correct soundings
+    # with while recording, or leave it empty to skip the correction
+live_profile = ''
+#-----------------
+
+#-----------------
+# Uncertainty
+    # Replace the numbers with the uncertainty of the GNSS antenna offset and
+    # the sonar transducer offset in metres, and of the sound speed in m/s,
+    # each as one standard deviation. They are used with the GNSS and sonar
+    # uncertainties to find the total uncertainty of each sounding.
+antenna_offset_uncertainty = 0.02
+transducer_offset_uncertainty = 0.02
+soundspeed_uncertainty = 0.5
+#-----------------
+
+#-----------------
+# Survey line segmentation
+    # Replace the numbers with the limits used to split the track into survey
+    # lines when processing: the highest rate of turn on a line in degrees
+    # per second, the furthest the heading may stray from the line's mean
+    # heading in degrees, the lowest survey speed in knots, and the shortest
+    # line in seconds
+line_max_turn_rate = 3.0
+line_max_heading_change = 20.0
+line_min_speed = 1.0
+line_min_duration = 60.0
+#-----------------
+
+#-----------------
+# Sonar latency
+    # Replace the number with the seconds each ping is made before it is
+    # logged, as found with the latency calibration of the processor. Pings
+    # are positioned at that time when processing.
+sonar_latency = 0.0
+#-----------------
+
+#-----------------
+# Heave filter
+    # Replace the text with gnss to remove heave found from the GNSS antenna
+    # height from the depths of live processing, or none to leave it in. Heave
+    # can also be removed when processing.
+heave_filter = 'none'
+    # Replace the number with the period in seconds, motion faster than which
+    # is taken as heave, and the order of the filter
+heave_period = 20.0
+heave_order = 2
+#-----------------
+
 # End of information to be entered, code to follow
 
 ##############################################################################
@@ -255,6 +376,133 @@ if new_survey == 'yes':
     print('    Enter a number with the baud rate used by the sensor')
     svp_baud = input('SVP baud rate:')
     print('-----------------')
+    
+    print('Additional sensors')
+    print('    Enter the number of additional GNSS receivers and sonars')
+    sensor_count = input('Number of additional sensors: ')
+    additional_sensors = []
+    for number in range(int(sensor_count or 0)):
+        print('    Enter text with a name for the sensor, without spaces')
+        sensor_name = input('Sensor name: ')
+        print('    Enter gnss or sonar')
+        sensor_type = input('Sensor type: ')
+        print('    Enter text with the name of the com port')
+        sensor_port = input('Sensor port: ')
+        print('    Enter a number with the baud rate used by the sensor')
+        sensor_baud = input('Sensor baud rate: ')
+        print('    Enter the waterline offset of the sensor in metres')
+        sensor_offset = input('Sensor waterline offset: ')
+        additional_sensors.append([sensor_name, sensor_type, sensor_port,
+                                   sensor_baud, sensor_offset])
+    print('-----------------')
+    
+    print('Sonar ping mode')
+    proceed = False
+    while not proceed:
+        print('    Enter triggered to ping on every GNSS position message, epoch')
+        print('    to ping once each GNSS epoch, rate to ping on the GNSS messages')
+        print('    nearest a ping interval, free to ping on a timer, or stream to')
+        print('    have the sonar ping continuously on its own')
+        ping_mode = input('Ping mode: ')
+        if ping_mode in ('triggered', 'epoch', 'rate', 'free', 'stream'):
+            proceed = True
+        else:
+            print('    ### Please enter triggered, epoch, rate, free or stream ###')
+    print('    Enter a number with the time between pings in milliseconds')
+    ping_interval = input('Ping interval (ms): ')
+    print('    Enter how many milliseconds early a ping may be taken in rate mode')
+    ping_jitter = input('Ping jitter (ms): ')
+    print('-----------------')
+    
+    print('Sonar range control')
+    proceed = False
+    while not proceed:
+        print('    Enter adaptive to fit the scan window and ping rate to the depth,')
+        print('    or none to leave the sonar in auto mode')
+        range_control = input('Range control: ')
+        if range_control in ('adaptive', 'none'):
+            proceed = True
+        else:
+            print('    ### Please enter adaptive or none ###')
+    range_confidence = 70
+    range_min_interval = 50
+    if range_control == 'adaptive':
+        print('    Enter the confidence in percent a ping needs for its depth to be used')
+        range_confidence = input('Range confidence (%): ')
+        print('    Enter the shortest time between pings in milliseconds')
+        range_min_interval = input('Shortest ping interval (ms): ')
+    print('-----------------')
+    
+    print('Echo capture')
+    print('    Enter yes to save the echo profile of every ping, or no')
+    echo_capture = input('Echo capture: ')
+    print('-----------------')
+    
+    print('Raw log compression')
+    print('    Enter gzip to write the raw log compressed in blocks, or no')
+    log_compression = input('Raw log compression: ')
+    print('-----------------')
+    
+    print('Raw log rotation')
+    proceed = False
+    while not proceed:
+        print('    Enter size or duration to start new log files at a limit, line')
+        print('    to start them only for a new survey line, or none')
+        log_rotation = input('Log rotation: ')
+        if log_rotation in ('size', 'duration', 'line', 'none'):
+            proceed = True
+        else:
+            print('    ### Please enter size, duration, line or none ###')
+    rotation_limit = 0
+    if log_rotation in ('size', 'duration'):
+        print('    Enter the size in MB or duration in minutes of each log')
+        rotation_limit = input('Rotation limit: ')
+    print('-----------------')
+    
+    print('Live processing')
+    print('    Enter yes to extract and grid soundings while recording, or no')
+    live_processing = input('Live processing: ')
+    if live_processing == 'yes':
+        print('    Enter the size of the coverage grid cells in metres')
+        grid_cell_size = input('Grid cell size: ')
+        print('    Enter a sound speed profile file, or leave empty for none')
+        live_profile = input('Sound speed profile: ')
+    print('-----------------')
+    
+    print('Uncertainty')
+    print('    Enter a number with the uncertainty of the GNSS antenna offset in metres')
+    antenna_offset_uncertainty = input('Antenna offset uncertainty: ')
+    print('    Enter a number with the uncertainty of the sonar transducer offset in metres')
+    transducer_offset_uncertainty = input('Transducer offset uncertainty: ')
+    print('    Enter a number with the uncertainty of the sound speed in m/s')
+    soundspeed_uncertainty = input('Sound speed uncertainty: ')
+    print('-----------------')
+    
+    print('Survey line segmentation')
+    print('    Enter a number with the highest rate of turn on a line in degrees per second')
+    line_max_turn_rate = input('Maximum turn rate: ')
+    print('    Enter a number with the furthest the heading may stray on a line in degrees')
+    line_max_heading_change = input('Maximum heading change: ')
+    print('    Enter a number with the lowest survey speed in knots')
+    line_min_speed = input('Minimum speed: ')
+    print('    Enter a number with the shortest survey line in seconds')
+    line_min_duration = input('Minimum line duration: ')
+    print('-----------------')
+    
+    print('Sonar latency')
+    print('    Enter a number with the seconds each ping is made before it is logged,')
+    print('    or 0 if it has not been calibrated')
+    sonar_latency = input('Sonar latency: ')
+    print('-----------------')
+    
+    print('Heave filter')
+    print('    Enter gnss to remove heave found from GNSS heights while recording, or none')
+    heave_filter = input('Heave filter: ')
+    print('    Enter a number with the period in seconds below which motion is heave')
+    heave_period = input('Heave period: ')
+    print('    Enter a whole number with the order of the filter')
+    heave_order = input('Heave filter order: ')
+    print('-----------------')
     time.sleep(2)
 # If the user selects not to configure a new survey, the above entered
 # information is used.
@@ -275,6 +523,20 @@ survey_metadata['SVP'] = [svp_name, svp_type, default_sndspd]
 survey_metadata['GNSS_Com'] = [gnss_name, gnss_port, gnss_baud]
 survey_metadata['Sonar_Com'] = [sonar_name, sonar_port, sonar_baud]
 survey_metadata['SVP_Com'] = [svp_name, svp_port, svp_baud]
+survey_metadata['Sensors'] = additional_sensors
+survey_metadata['Ping_Mode'] = [ping_mode, ping_interval, ping_jitter]
+survey_metadata['Range_Control'] = [range_control, range_confidence, range_min_interval]
+survey_metadata['Echo_Capture'] = [echo_capture]
+survey_metadata['Log_Compression'] = [log_compression]
+survey_metadata['Log_Rotation'] = [log_rotation, rotation_limit]
+survey_metadata['Live_Processing'] = [live_processing, grid_cell_size, live_profile]
+survey_metadata['Uncertainty'] = [antenna_offset_uncertainty,
+                                  transducer_offset_uncertainty,
+                                  soundspeed_uncertainty]
+survey_metadata['Line_Segmentation'] = [line_max_turn_rate, line_max_heading_change,
+                                        line_min_speed, line_min_duration]
+survey_metadata['Latency'] = [sonar_latency]
+survey_metadata['Heave_Filter'] = [heave_filter, heave_period, heave_order]
 
 # This dictionary is then written to a configuration file by an osplib function
 osplib.write_meta_header(survey_filename, survey_metadata)
@@ -0,0 +1,86 @@
+##############################################################################
+##############################################################################
+# Open Sonar Merger
+##############################################################################
+##############################################################################
+# Created for the Open Sonar Project by:
+# Graham Christie, Isaac Fuller, Kara Sanford
+# January 2022
+#############################################
+# Version 1.0
+##############################################################################
+##############################################################################
+
+# This program should be used to join the raw logs of one survey into a
+# single raw log, such as the logs left when Open Sonar Online is restarted
+# during a survey day. Capabilities include:
+#     - Merging any number of raw logs in time order, plain or compressed
+#     - Checking the logs were recorded with the same vessel and sensor setup
+#     - Leaving out lines repeated where logs overlap
+# Logs are read a line at a time, so hundreds of logs can be merged without
+# reading them into memory. The merged log can be opened in the processor.
+
+##############################################################################
+##############################################################################
+
+import glob
+import os
+import time
+
+import osplib
+
+# Introductory text displayed
+osplib.osp_logo()
+print('Welcome to Open Sonar Merger!')
+print('-----------------------------')
+time.sleep(2)
+print('Please type your responses to the following questions in the terminal.')
+print('Do not use spaces in any response.')
+time.sleep(3)
+
+proceed = False
+while not proceed:
+    print('-----------------------------------------')
+    print('Please select how to choose the raw logs to merge:')
+    print('    - files         (Enter the raw log names separated by commas)')
+    print('    - folder        (Merge every raw log of a survey in a folder)')
+    print('    - exit          (Close the merger)')
+    selection = input('Type your selection here: ')
+
+    filenames = []
+    if selection == 'files':
+        filenames = input('Enter raw log names: ').split(',')
+    elif selection == 'folder':
+        folder = input('Enter folder name: ')
+        survey = input('Enter survey name (leave empty for every survey): ')
+        filenames = sorted(glob.glob(os.path.join(folder, (survey or '*')+'_raw_*.csv')) +
+                           glob.glob(os.path.join(folder, (survey or '*')+'_raw_*.csv.gz')))
+    elif selection == 'exit':
+        proceed = True
+        continue
+    else:
+        print('Invalid entry - Please select an option from the list.')
+        continue
+
+    missing = [filename for filename in filenames if not os.path.isfile(filename)]
+    if missing:
+        print('Not found: '+', '.join(missing))
+        continue
+    if len(filenames) < 2:
+        print('At least two raw logs are needed to merge')
+        continue
+    print(f'Checking {len(filenames)} raw logs.....')
+    merger = osplib.Log_Merger(filenames)
+    if not merger.check_headers():
+        print('The raw logs were not recorded with the same setup and are not merged')
+        continue
+    print('Raw logs in time order:')
+    for filename in merger.filenames:
+        print('    '+filename)
+    output = input('Enter merged raw log name, ending in .csv or .csv.gz: ')
+    if output in filenames:
+        print('The merged raw log cannot replace one of the logs merged')
+        continue
+    if osplib.file_check(output, ('.csv', '.csv.gz')):
+        print('Merging raw logs. This may take a moment.....')
+        merger.write(output)
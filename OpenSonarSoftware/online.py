@@ -82,19 +82,33 @@ if not gps_connection or not sonar_connection:
         pass
     sys.exit()
 
+# Connect any additional sensors from the Sensor rows of the configuration
+# file. The GNSS and every streaming sonar are read by one event loop, which
+# also tags the records of the additional sensors for the raw log.
+mux = osplib.Sensor_Mux(metadata)
+gpsdevice.read_with(mux)
+if not mux.connect_sensors(metadata):
+    print('Continuing without the additional sensors that were not found')
+
 # If everything is connected correctly, create simple and raw log files and 
-# write the metadata header to them, then open them for writing data.
-start_time = dt.datetime.now()
-metadata['filetype'] = ['OSP_SIMPLE_LOG']
-simple_log = 'Output/'+metadata['Survey'][0]+'_simple_'+\
-    dt.datetime.strftime(start_time,'%H%M%S')+'.csv'
-osplib.write_meta_header(simple_log, metadata)
-simple_log_writer = open(simple_log, 'a', 1)
-metadata['filetype'] = ['OSP_RAW_LOG']
-raw_log = 'Output/'+metadata['Survey'][0]+'_raw_'+\
-    dt.datetime.strftime(start_time,'%H%M%S')+'.csv'
-osplib.write_meta_header(raw_log, metadata)
-raw_log_writer = open(raw_log, 'a', 1)
+# write the metadata header to them, then open them for writing data. The
+# rotator starts new log files as set by the Log_Rotation option and lists
+# them in a manifest. With live processing, the logged lines are also sent to
+# a separate process that grids the soundings as they are recorded. It is
+# started first so no other threads are running when it is made.
+live = osplib.Stream_Processor(metadata, metadata['Live_Processing'][2],
+                               metadata['Live_Processing'][1])
+if metadata['Live_Processing'][0] == 'yes':
+    live.start()
+logs = osplib.Log_Rotator(metadata)
+if metadata['Live_Processing'][0] == 'yes':
+    logs.listener = live
+if logs.echo_log is not None:
+    print('Echo profiles will be saved to Output/'+logs.segment['echo_log'])
+for tag, echo_log in logs.segment['sensor_echo_logs'].items():
+    print('Echo profiles of '+tag+' will be saved to Output/'+echo_log)
+if logs.manifest is not None:
+    print('Log segments will be listed in '+logs.manifest)
 
 # Set the sound speed source for the system.
 
@@ -152,8 +166,9 @@ while proceed == False:
         print('---------------')
         print('Exiting Program')
         print('---------------')
-        simple_log_writer.close()
-        raw_log_writer.close()
+        logs.close()
+        live.stop()
+        mux.stop()
         try:
             gpsdevice.disconnect_gnss()
         except:
@@ -167,6 +182,7 @@ while proceed == False:
         print('Invalid entry - Please select from the list.')
         time.sleep(3)
 current_speed = sonardevice.get_sound_speed()
+mux.set_sound_speed(current_speed)
 time.sleep(2)
 
 # Give the user the choice to go online and begin recording or exit
@@ -191,8 +207,9 @@ while proceed == False:
         print('---------------')
         print('Exiting Program')
         print('---------------')
-        simple_log_writer.close()
-        raw_log_writer.close()
+        logs.close()
+        live.stop()
+        mux.stop()
         try:
             gpsdevice.disconnect_gnss()
         except:
@@ -207,15 +224,50 @@ while proceed == False:
         time.sleep(3)
 
 
-# Take a test observation
+# Take observations until stopped with Ctrl+C. The live display is drawn by
+# its own thread so console output does not slow down acquisition. The ping
+# scheduler chooses the GNSS messages that ping the sonar, or pings it on a
+# timer in free mode, and the range controller fits the sonar's scan window
+# and ping rate to the depth when it is switched on.
 obs_numb = 0
-
-while True:
-    obs, speed = osplib.take_observation(metadata, gpsdevice, sonardevice, svpdevice, 
-                                          current_speed, update_speed, obs_numb,
-                                          simple_log_writer, raw_log_writer)
-    obs_numb = obs
-    current_speed = speed
+mux.start()
+scheduler = osplib.Ping_Scheduler(metadata)
+controller = osplib.Range_Controller(metadata, sonardevice, scheduler)
+if metadata['Ping_Mode'][0] == 'stream':
+    sonardevice.start_stream(metadata['Ping_Mode'][1], mux)
+scheduler.start(sonardevice)
+mux.start_streams(metadata['Ping_Mode'][1])
+display = osplib.Live_Display()
+display.update(segment=logs.describe())
+display.start()
+
+try:
+    while True:
+        obs, speed = osplib.take_observation(metadata, gpsdevice, sonardevice, svpdevice, 
+                                              current_speed, update_speed, obs_numb,
+                                              logs.simple_log, logs,
+                                              display, logs.echo_log, mux, scheduler,
+                                              controller, logs.sensor_echo_logs)
+        obs_numb = obs
+        current_speed = speed
+        reason = logs.check(display.take_new_line())
+        if reason is not None:
+            display.update(segment=logs.describe())
+            display.message('New log segment started ('+reason+')')
+        summary = live.poll()
+        if summary is not None:
+            display.update(coverage=live.describe(summary))
+except KeyboardInterrupt:
+    pass
+display.stop()
+scheduler.stop()
+controller.stop()
+mux.stop()
+sonardevice.stop_stream()
+print('Data collection stopped.')
+print('Ping schedule: '+scheduler.describe())
+if controller.enabled:
+    print(f'Sonar range changed {controller.changes} times, last '+controller.describe())
 
 
 
@@ -226,8 +278,10 @@ while True:
 # Close log files and connections to sensors after data collection is finished
 gpsdevice.disconnect_gnss()
 svpdevice.disconnect_speed()
-simple_log_writer.close()
-raw_log_writer.close()
+logs.close()
+summary = live.stop()
+if summary is not None:
+    print('Live processing: '+live.describe(summary))
 
 
 
@@ -0,0 +1,769 @@
+##############################################################################
+############################################################################## 
+# Open Sonar Library - Acquisition
+##############################################################################
+##############################################################################
+# Created for the Open Sonar Project by:
+# Graham Christie, Isaac Fuller, Kara Sanford
+# January 2022
+#############################################
+# Version 5.0
+##############################################################################
+##############################################################################
+
+# The live display, log rotation and live processing used by Open Sonar
+# Online while recording. Live processing loads the processing module in
+# its own process, only when it is switched on.
+
+import os
+import json
+import sys
+import time
+import threading
+import collections
+import math
+import multiprocessing
+import queue
+import datetime as dt
+
+from osp_io import (FIX_QUALITIES, Block_Log_Writer, Echo_Writer, count_main_records,
+                    write_meta_header)
+
+# curses is not part of Python on Windows, the live display falls back to a
+# printed status line without it
+try:
+    import curses
+except ImportError:
+    curses = None
+
+#########################################
+#########################################
+# Online Actions
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+class Live_Display:
+# Class to manage the live status display. Acquisition only records values in
+# shared state, and a separate thread draws them at a fixed refresh rate, so
+# a slow console does not hold up acquisition. A curses panel is drawn when
+# the console supports it, otherwise a status line is printed.
+    def __init__(self, refresh_rate=2):
+        self.refresh_rate = refresh_rate
+        self.lock = threading.Lock()
+        self.state = {}
+        self.pings = 0
+        self.messages = collections.deque(maxlen=5)
+        self.new_line = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        
+    def update(self, **values):
+        # Function to record the latest values from acquisition
+        with self.lock:
+            self.state.update(values)
+            
+    def count_ping(self):
+        # Function to count a ping for the ping rate
+        with self.lock:
+            self.pings += 1
+            
+    def message(self, text):
+        # Function to show a message below the status values
+        with self.lock:
+            self.messages.append(text)
+            
+    def take_new_line(self):
+        # Function to check whether the operator asked for a new survey line
+        # since the last check
+        if self.new_line.is_set():
+            self.new_line.clear()
+            return True
+        return False
+    
+    def read_keys(self):
+        # Function to watch the console for the new survey line key when the
+        # status line is printed, where keys arrive a line at a time
+        for line in sys.stdin:
+            if line.strip().lower() == 'n':
+                self.new_line.set()
+            
+    def start(self):
+        # Function to start drawing the display in its own thread
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        
+    def stop(self):
+        # Function to stop drawing and give the console back
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            
+    def status_lines(self, state, pings, rate):
+        # Function to format the latest values for display
+        def value(name, form, unit=''):
+            if state.get(name) is None:
+                return '-'
+            return format(state[name], form)+unit
+        quality = state.get('fix_quality')
+        try:
+            quality = FIX_QUALITIES.get(int(quality), quality)
+        except (TypeError, ValueError):
+            pass
+        return ['Open Sonar Online - Live Status',
+                'Time:          '+str(state.get('time', '-')),
+                'Depth:         '+value('depth', '.3f', ' m'),
+                'Height:        '+value('height', '.3f', ' m'),
+                'Latitude:      '+value('latitude', '.8f'),
+                'Longitude:     '+value('longitude', '.8f'),
+                'Fix quality:   '+str('-' if quality is None else quality),
+                'Sound speed:   '+value('soundspeed', '.1f', ' m/s'),
+                'Ping rate:     '+format(rate, '.1f')+' Hz ('+str(pings)+' pings)',
+                'Ping schedule: '+str(state.get('schedule', '-')),
+                'Log segment:   '+str(state.get('segment', '-')),
+                'Coverage:      '+str(state.get('coverage', '-'))]
+    
+    def run(self):
+        # Function to redraw the display at the refresh rate until stopped
+        screen = None
+        if curses is not None and sys.stdout.isatty():
+            try:
+                screen = curses.initscr()
+                curses.noecho()
+                curses.cbreak()
+                curses.curs_set(0)
+            except curses.error:
+                if screen is not None:
+                    curses.endwin()
+                screen = None
+        if screen is None:
+            print('Type n and press Enter to start a new survey line')
+            threading.Thread(target=self.read_keys, daemon=True).start()
+        else:
+            screen.nodelay(True)
+        last_time = time.monotonic()
+        last_pings = 0
+        try:
+            while not self.stop_event.wait(1/self.refresh_rate):
+                with self.lock:
+                    state = dict(self.state)
+                    pings = self.pings
+                    messages = list(self.messages)
+                now = time.monotonic()
+                rate = (pings - last_pings)/(now - last_time)
+                last_time = now
+                last_pings = pings
+                lines = self.status_lines(state, pings, rate)
+                if screen is None:
+                    print(' | '.join(line.split(':', 1)[-1].strip()
+                                     for line in lines[1:]))
+                    continue
+                # Clearing repaints the whole screen, removing any text other
+                # code printed over the panel
+                screen.clear()
+                height, width = screen.getmaxyx()
+                for row, line in enumerate(lines + ['Press n to start a new survey line', '']
+                                           + messages):
+                    if row >= height:
+                        break
+                    screen.addnstr(row, 0, line, width-1)
+                screen.refresh()
+                key = screen.getch()
+                while key != -1:
+                    if key in (ord('n'), ord('N')):
+                        self.new_line.set()
+                    key = screen.getch()
+        finally:
+            if screen is not None:
+                curses.endwin()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Ping_Scheduler:
+# Class to decide which GNSS position messages ping the sonar, or to ping it
+# on its own timer. In triggered mode every position message pings, in epoch
+# mode the first of each GNSS epoch, grouped by their UTC time, and in rate
+# mode those nearest a fixed ping interval. A ping in rate mode may be taken
+# up to the jitter in milliseconds before it is due, so it can fall on an
+# epoch, and pings stay on the same spacing when one is late. Once the
+# receiver is seen to send GGA only GGA messages ping, as processing positions
+# each ping by the GGA before it. In free mode a thread pings every ping
+# interval whatever the GNSS sends, queuing the pings like a streaming sonar.
+# The reason for each ping and the rate achieved are counted.
+    def __init__(self, metadata):
+        self.mode, self.interval, self.jitter = metadata['Ping_Mode'][:3]
+        self.free_run = self.mode == 'free'
+        self.reasons = collections.Counter()
+        self.gga_seen = False
+        self.last_epoch = None
+        self.last_seconds = None
+        self.day_seconds = 0
+        self.due = None
+        self.last_ping = None
+        self.gaps = 0
+        self.gap_sum = 0.0
+        self.gap_squares = 0.0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.sonar_device = None
+        
+    def trigger(self, log_time, nmea):
+        # Function to decide whether a position message pings the sonar
+        if self.mode == 'triggered':
+            return self.record('message')
+        if nmea.sentence_type == 'GGA':
+            if not self.gga_seen:
+                # Pings on other messages cannot be positioned by a GGA, so
+                # the epoch of the first GGA pings again
+                self.last_epoch = None
+                self.due = None
+            self.gga_seen = True
+        elif self.gga_seen:
+            return False
+        epoch = getattr(nmea, 'timestamp', None) or log_time
+        if epoch == self.last_epoch:
+            return False
+        if self.mode == 'epoch':
+            self.last_epoch = epoch
+            return self.record('epoch')
+        
+        # Epoch times run on past midnight, so the ping spacing holds
+        seconds = epoch.hour*3600 + epoch.minute*60 + epoch.second + epoch.microsecond/1e6
+        if self.last_seconds is not None and seconds < self.last_seconds - 43200:
+            self.day_seconds += 86400
+        self.last_seconds = seconds
+        seconds += self.day_seconds
+        interval = self.interval/1000
+        jitter = self.jitter/1000
+        if self.due is not None and seconds < self.due - jitter:
+            return False
+        late = self.due is not None and seconds > self.due + jitter
+        if self.due is None or seconds >= self.due + interval:
+            self.due = seconds + interval
+        else:
+            self.due += interval
+        self.last_epoch = epoch
+        return self.record('late' if late else 'rate')
+    
+    def record(self, reason):
+        # Function to count a ping and the time since the last one
+        now = time.monotonic()
+        with self.lock:
+            self.reasons[reason] += 1
+            if self.last_ping is not None:
+                gap = now - self.last_ping
+                self.gaps += 1
+                self.gap_sum += gap
+                self.gap_squares += gap*gap
+            self.last_ping = now
+        return True
+    
+    def start(self, sonar_device):
+        # Function to start pinging the sonar on a timer in free mode
+        if not self.free_run:
+            return
+        self.sonar_device = sonar_device
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        print(f'Sonar free running with {self.interval} ms between pings')
+        
+    def run(self):
+        # Function run by the free run thread. Pings are due on a fixed
+        # spacing, which starts again from the latest ping when the sonar
+        # falls a whole interval behind. The interval may be changed while
+        # running.
+        due = time.monotonic()
+        while not self.stop_event.wait(max(0, due - time.monotonic())):
+            now = time.monotonic()
+            observation = self.sonar_device.send_ping()
+            if observation is None:
+                return
+            self.sonar_device.stream.append(observation)
+            self.record('late' if now > due + self.jitter/1000 else 'free')
+            interval = self.interval/1000
+            if now >= due + interval:
+                due = now + interval
+            else:
+                due += interval
+                
+    def stop(self):
+        # Function to stop the free run thread
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            
+    def describe(self):
+        # Function to describe the ping rate achieved and the reasons for the
+        # pings
+        if self.mode == 'stream':
+            return f'sonar streaming every {self.interval} ms'
+        with self.lock:
+            gaps, gap_sum, gap_squares = self.gaps, self.gap_sum, self.gap_squares
+            reasons = dict(self.reasons)
+        if not gaps:
+            return self.mode+', '+str(sum(reasons.values()))+' pings'
+        mean = gap_sum/gaps
+        spread = max(gap_squares/gaps - mean*mean, 0)**0.5
+        return (f'{self.mode}, {1/mean:.1f} Hz achieved, {mean*1000:.0f} '
+                f'+/- {spread*1000:.0f} ms between pings ('+
+                ', '.join(f'{count} {reason}' for reason, count in
+                          sorted(reasons.items()))+')')
+#-----------------------------------------------------------------------------
+
+# Pings in a row with the confidence required before the scan window is
+# fitted, pings in a row without it before the sonar goes back to auto mode,
+# and pings taken after a change before the next
+RANGE_STEADY_PINGS = 10
+RANGE_LOST_PINGS = 5
+RANGE_HOLD_PINGS = 10
+
+# Margin around the recent depths, as a fraction of the deepest and at least
+# RANGE_MIN_MARGIN metres, and the shortest scan window in metres
+RANGE_MARGIN = 0.25
+RANGE_MIN_MARGIN = 0.5
+RANGE_MIN_LENGTH = 1.0
+
+# Fraction of the window at each edge where a bottom moves the window, and
+# the fraction of the window a new fit must be under to narrow it
+RANGE_EDGE = 0.1
+RANGE_SHRINK = 0.6
+
+# Ping interval as a multiple of the two way travel time to the end of scan
+RANGE_TRAVEL_FACTOR = 3
+
+#-----------------------------------------------------------------------------
+class Range_Controller:
+# Class to fit the sonar's scan window and ping rate to the depth. The sonar
+# starts in auto mode, and once RANGE_STEADY_PINGS pings in a row have the
+# confidence required the scan is narrowed to the recent depths with a
+# margin, and the ping interval shortened to suit the shorter scan. A bottom
+# near the edge of the window moves or widens it, a much shallower one
+# narrows it again, and RANGE_LOST_PINGS pings in a row without the
+# confidence put the sonar back in auto mode at the configured interval. The
+# interval is set on a streaming sonar, and on the Ping_Scheduler given in
+# rate and free modes. Every change is written to the raw log as a $RANGE
+# record after the ping that caused it, with the reason, auto mode, the scan
+# start and length in millimetres and the ping interval in milliseconds.
+    def __init__(self, metadata, sonar_device, scheduler=None):
+        self.enabled = metadata['Range_Control'][0] == 'adaptive'
+        self.confidence, self.min_interval = metadata['Range_Control'][1:3]
+        self.interval = metadata['Ping_Mode'][1]
+        self.soundspeed = metadata['SVP'][2]
+        self.sonar_device = sonar_device
+        self.scheduler = scheduler
+        self.auto = True
+        self.window = None
+        self.ping_interval = self.interval
+        self.depths = collections.deque(maxlen=RANGE_STEADY_PINGS)
+        self.lost = 0
+        self.hold = 0
+        self.changes = 0
+        
+    def add(self, observation, soundspeed, raw_log, display=None):
+        # Function to follow the depth and confidence of a ping, changing the
+        # sonar's settings when they no longer suit
+        if not self.enabled:
+            return
+        ping_time, distance = observation
+        if distance['confidence'] >= self.confidence:
+            self.depths.append(distance['distance'])
+            self.lost = 0
+        else:
+            self.depths.clear()
+            self.lost += 1
+        if self.hold:
+            self.hold -= 1
+            return
+        if not self.auto and self.lost >= RANGE_LOST_PINGS:
+            self.change(ping_time, 'auto', None, soundspeed, raw_log, display)
+            return
+        if len(self.depths) < RANGE_STEADY_PINGS:
+            return
+        
+        window = self.fit_window()
+        if self.auto:
+            reason = 'narrowed'
+        else:
+            start, length = self.window
+            if min(self.depths) < start + RANGE_EDGE*length or \
+                    max(self.depths) > start + (1-RANGE_EDGE)*length:
+                reason = 'widened' if window[1] > length else 'moved'
+            elif window[1] < RANGE_SHRINK*length:
+                reason = 'narrowed'
+            else:
+                return
+        self.change(ping_time, reason, window, soundspeed, raw_log, display)
+        
+    def fit_window(self):
+        # Function to find a scan window in metres around the recent depths,
+        # rounded out to 0.1 m
+        low, high = min(self.depths), max(self.depths)
+        margin = max(RANGE_MIN_MARGIN, RANGE_MARGIN*high)
+        start = math.floor(max(0.0, low - margin)*10)/10
+        length = math.ceil(max(RANGE_MIN_LENGTH, high + margin - start)*10)/10
+        return start, length
+    
+    def change(self, ping_time, reason, window, soundspeed, raw_log, display):
+        # Function to set the sonar to a scan window in metres, or to auto
+        # mode without one, and log the change
+        if window is None:
+            self.sonar_device.set_mode_auto(True)
+            ping_interval = self.interval
+            start = length = ''
+        else:
+            if self.auto:
+                self.sonar_device.set_mode_auto(False)
+            self.sonar_device.set_range(*window)
+            # A failed sound speed reading gives None, and the configured
+            # sound speed is used instead
+            travel = 2*(window[0] + window[1])/(soundspeed or self.soundspeed)
+            ping_interval = math.ceil(RANGE_TRAVEL_FACTOR*travel*1000)
+            ping_interval = min(self.interval, max(self.min_interval, ping_interval))
+            start, length = (round(value*1000) for value in window)
+        if ping_interval != self.ping_interval:
+            if self.sonar_device.streaming:
+                self.sonar_device.set_ping_interval(ping_interval)
+            if self.scheduler is not None and self.scheduler.mode in ('rate', 'free'):
+                self.scheduler.interval = ping_interval
+        self.auto = window is None
+        self.window = window
+        self.ping_interval = ping_interval
+        self.hold = RANGE_HOLD_PINGS
+        self.lost = 0
+        self.changes += 1
+        raw_log.write(f'{ping_time},$RANGE,{reason},{int(self.auto)},{start},'
+                      f'{length},{ping_interval}\n')
+        text = f'Sonar range {reason}: '+self.describe()
+        if display is None:
+            print(text)
+        else:
+            display.message(text)
+            
+    def describe(self):
+        # Function to describe the sonar's settings
+        if self.auto:
+            return f'auto mode, {self.ping_interval} ms between pings'
+        return (f'{self.window[0]:.1f} to {sum(self.window):.1f} m, '
+                f'{self.ping_interval} ms between pings')
+    
+    def stop(self):
+        # Function to leave the sonar in auto mode
+        if self.enabled and not self.auto:
+            self.sonar_device.set_mode_auto(True)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def take_observation(metadata, gnss_device, sonar_device, svp_device, 
+                     current_speed, update_speed, obs_numb, simple_log, raw_log,
+                     display=None, echo_log=None, mux=None, scheduler=None,
+                     controller=None, sensor_echo_logs=None):
+    # Function to log one GNSS message, pinging the sonar on position messages
+    # the Ping_Scheduler given chooses, or on every one without a scheduler.
+    # A streaming or free running sonar is not pinged, the pings it queued are
+    # logged instead and the latest is used for the simple log. With a live
+    # display the latest values go to the display, without one each sounding
+    # is printed. Echo profiles are written to the echo log when one is given,
+    # and those of additional sonars to their echo log in sensor_echo_logs.
+    # Each ping is given to the Range_Controller when there is one. Records of
+    # additional sensors in a Sensor_Mux are logged last, so they never come
+    # between a GGA sentence and the ping it triggered.
+    if update_speed:
+        if obs_numb == 100:
+            if display is None:
+                print('Updating sound speed from sound velocity probe')
+            else:
+                display.message('Updating sound speed from sound velocity probe')
+            current_speed = svp_device.get_surface_sound_speed()
+            sonar_device.set_sound_speed(current_speed)
+            if mux is not None:
+                mux.set_sound_speed(current_speed)
+            
+            obs_numb = 0
+        else:
+            obs_numb += 1
+     
+    time, nmea, ping = gnss_device.get_nmea()
+    queued = sonar_device.streaming or (scheduler is not None and scheduler.free_run)
+    if ping and not queued and scheduler is not None:
+        ping = scheduler.trigger(time, nmea)
+        
+    nmea_message = str(time) + ',' + str(nmea) + '\n'
+    raw_log.write(nmea_message)
+    if queued:
+        for observation in sonar_device.get_stream():
+            raw_log.write(sonar_device.ping_to_string(current_speed, observation))
+            if echo_log is not None:
+                echo_log.write(observation[1], current_speed)
+            if display is not None:
+                display.count_ping()
+            if controller is not None:
+                controller.add(observation, current_speed, raw_log, display)
+        if sonar_device.last_observation is None:
+            ping = False
+    if ping:
+        
+        if queued:
+            time, sonar = sonar_device.last_observation
+        else:
+            time, sonar = sonar_device.send_ping()
+            
+            sonar_message = sonar_device.ping_to_string(current_speed)
+            
+            raw_log.write(sonar_message)
+            if echo_log is not None:
+                echo_log.write(sonar, current_speed)
+            if display is not None:
+                display.count_ping()
+            if controller is not None:
+                controller.add((time, sonar), current_speed, raw_log, display)
+        nmea_message = nmea_message.split(',')
+        if nmea_message[1] == '$GNGGA':
+            waterline = metadata['Sonar'][2]
+            depth = sonar['distance']+waterline
+            depth = round(depth,3)
+            height = float(nmea_message[10])+float(nmea_message[12])-depth-metadata['GNSS'][2]
+            height = round(height,3)
+            simple_message = str(time)+','+str(nmea.latitude)+','+\
+                str(nmea.longitude)+','+str(depth)+','+\
+                str(height)+','+str(current_speed)+'\n'
+            if display is None:
+                print(simple_message)
+            else:
+                display.update(time=time, latitude=nmea.latitude,
+                               longitude=nmea.longitude, depth=depth,
+                               height=height, fix_quality=nmea.gps_qual,
+                               soundspeed=current_speed)
+            simple_log.write(simple_message)
+    if mux is not None:
+        for record in mux.get_records(current_speed, display, sensor_echo_logs):
+            raw_log.write(record)
+    if scheduler is not None and display is not None:
+        display.update(schedule=scheduler.describe())
+    return obs_numb, current_speed
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Log_Rotator:
+# Class to keep the simple, raw and echo logs of an online session, starting a
+# new segment of each when the raw log reaches a size in MB, has been open for
+# a duration in minutes, or the operator starts a new survey line. Every
+# segment has the metadata header, and additional sonars have an echo log of
+# their own named with the sensor. A manifest lists the segments with
+# their time ranges so processing can treat them as one log, and their record
+# counts so the catalog does not need to read them. Pings and positions are
+# counted for the main sensors, the ones processing finds soundings from. The
+# rotator is given to take_observation as the raw log, so it can count what is
+# written.
+    def __init__(self, metadata, folder='Output'):
+        self.metadata = dict(metadata)
+        self.folder = folder
+        self.mode, self.limit = metadata['Log_Rotation']
+        self.segments = []
+        self.survey_line = 1
+        self.manifest = None
+        self.listener = None
+        if self.mode != 'none':
+            self.manifest = folder+'/'+metadata['Survey'][0]+'_manifest_'+\
+                dt.datetime.strftime(dt.datetime.now(),'%H%M%S')+'.json'
+        self.open_segment()
+        
+    def open_segment(self):
+        # Function to write the headers of a new segment and open its logs.
+        # Segments after the first are numbered, as several can start within
+        # a second.
+        stamp = dt.datetime.strftime(dt.datetime.now(),'%H%M%S')
+        if self.segments:
+            stamp += '_'+format(len(self.segments), '03d')
+        name = self.folder+'/'+self.metadata['Survey'][0]
+        metadata = self.metadata
+        metadata['filetype'] = ['OSP_SIMPLE_LOG']
+        simple_log = name+'_simple_'+stamp+'.csv'
+        write_meta_header(simple_log, metadata)
+        self.simple_log = open(simple_log, 'a', 1)
+        metadata['filetype'] = ['OSP_RAW_LOG']
+        raw_log = name+'_raw_'+stamp+'.csv'
+        if metadata['Log_Compression'][0] == 'gzip':
+            raw_log = raw_log+'.gz'
+        write_meta_header(raw_log, metadata)
+        if metadata['Log_Compression'][0] == 'gzip':
+            self.raw_log = Block_Log_Writer(raw_log)
+        else:
+            self.raw_log = open(raw_log, 'a', 1)
+        self.echo_log = None
+        self.sensor_echo_logs = {}
+        echo_log = None
+        if metadata['Echo_Capture'][0] == 'yes':
+            echo_log = name+'_echo_'+stamp+'.bin'
+            self.echo_log = Echo_Writer(echo_log)
+            for tag, kind, port, baud, offset in metadata.get('Sensors', []):
+                if kind == 'sonar':
+                    self.sensor_echo_logs[tag] = Echo_Writer(name+'_echo_'+tag+'_'+stamp+'.bin')
+        self.segment = {'raw_log': os.path.basename(raw_log),
+                        'simple_log': os.path.basename(simple_log),
+                        'echo_log': echo_log and os.path.basename(echo_log),
+                        'sensor_echo_logs': {tag: os.path.basename(writer.filename)
+                                             for tag, writer in self.sensor_echo_logs.items()},
+                        'survey_line': self.survey_line,
+                        'date': dt.datetime.utcnow().strftime('%Y-%m-%d'),
+                        'first_time': None, 'last_time': None,
+                        'records': 0, 'pings': 0, 'positions': 0}
+        self.size = 0
+        self.opened = time.monotonic()
+        self.last_line = None
+        
+    def write(self, text):
+        # Function to write text to the raw log of the current segment
+        if self.segment['first_time'] is None:
+            self.segment['first_time'] = text.split(',', 1)[0]
+        self.last_line = text
+        self.size += len(text)
+        self.segment['records'] += text.count('\n')
+        pings, positions = count_main_records(text)
+        self.segment['pings'] += pings
+        self.segment['positions'] += positions
+        self.raw_log.write(text)
+        if self.listener is not None:
+            self.listener.feed(text)
+        
+    def check(self, new_line=False):
+        # Function to start a new segment if one is due, returning the reason
+        # or None. Rotation by survey line works in every mode except none.
+        if self.mode == 'none' or self.segment['first_time'] is None:
+            return None
+        if new_line:
+            reason = 'line'
+        elif self.mode == 'size' and self.size >= self.limit*1e6:
+            reason = 'size'
+        elif self.mode == 'duration' and time.monotonic()-self.opened >= self.limit*60:
+            reason = 'duration'
+        else:
+            return None
+        self.close_segment(reason)
+        if reason == 'line':
+            self.survey_line += 1
+        self.open_segment()
+        return reason
+        
+    def close_segment(self, reason):
+        # Function to close the logs of the current segment and add it to the
+        # manifest
+        self.simple_log.close()
+        self.raw_log.close()
+        if self.echo_log is not None:
+            self.echo_log.close()
+        for writer in self.sensor_echo_logs.values():
+            writer.close()
+        if self.last_line is not None:
+            self.segment['last_time'] = self.last_line.split(',', 1)[0]
+        self.segment['end'] = reason
+        self.segments.append(self.segment)
+        if self.manifest is not None:
+            with open(self.manifest, 'w') as file:
+                json.dump({'format': 'OSP_MANIFEST', 'version': 1,
+                           'survey': self.metadata['Survey'][0],
+                           'segments': self.segments}, file, indent=1)
+                
+    def describe(self):
+        # Function to name the current segment for the live display
+        return self.segment['raw_log']+' (line '+str(self.survey_line)+')'
+        
+    def close(self):
+        # Function to close the last segment at the end of the session
+        self.close_segment('end')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Stream_Processor:
+# Class to extract, correct and grid soundings while they are recorded. Raw
+# log lines are gathered as they are written and sent in batches to
+# stream_process running in its own process, so processing never holds up
+# acquisition. Workers are only forked, as for process_pool, otherwise the
+# processing runs in a thread.
+    def __init__(self, metadata, profile_filename='', cell_size=5.0,
+                 folder='Output', batch_seconds=0.25):
+        self.metadata = metadata
+        self.profile_filename = profile_filename
+        self.cell_size = cell_size
+        self.batch_seconds = batch_seconds
+        self.grid_file = folder+'/'+metadata['Survey'][0]+'_grid_'+\
+            dt.datetime.strftime(dt.datetime.now(),'%H%M%S')+'.npz'
+        self.batch = []
+        self.sent = time.monotonic()
+        self.summary = None
+        self.worker = None
+        
+    def start(self):
+        # Function to start the processing process, before other threads are
+        # started so none are copied into it mid-task
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+            self.inbox = context.Queue()
+            self.outbox = context.Queue()
+            worker = context.Process
+        else:
+            print('Worker processes are not supported here, live processing runs in a thread')
+            self.inbox = queue.Queue()
+            self.outbox = queue.Queue()
+            worker = threading.Thread
+        # Processing is only loaded once live processing is started
+        from osp_processing import stream_process
+        self.worker = worker(target=stream_process, daemon=True,
+                             args=(self.metadata, self.profile_filename,
+                                   self.cell_size, self.grid_file,
+                                   self.inbox, self.outbox))
+        self.worker.start()
+        
+    def feed(self, text):
+        # Function to gather raw log lines, sending them on every batch_seconds
+        self.batch.append(text)
+        now = time.monotonic()
+        if now - self.sent >= self.batch_seconds:
+            self.inbox.put((''.join(self.batch), time.time()))
+            self.batch = []
+            self.sent = now
+            
+    def poll(self):
+        # Function to take the latest summary from the processing process,
+        # None if there is nothing new
+        latest = None
+        while True:
+            try:
+                summary = self.outbox.get_nowait()
+            except queue.Empty:
+                break
+            if summary is not None:
+                latest = self.summary = summary
+        return latest
+    
+    def describe(self, summary):
+        # Function to format a summary for the live display
+        return (str(summary['soundings'])+' soundings, '+str(summary['cells'])+
+                ' cells ('+format(summary['area'], '.0f')+' m2), mean depth '+
+                format(summary['mean_depth'], '.2f')+' m, '+
+                format(summary['latency'], '.2f')+' s behind')
+    
+    def stop(self):
+        # Function to send the last lines, wait for processing to finish and
+        # save the grid, returning the final summary
+        if self.worker is None:
+            return self.summary
+        if self.batch:
+            self.inbox.put((''.join(self.batch), time.time()))
+            self.batch = []
+        self.inbox.put(None)
+        while True:
+            summary = self.outbox.get()
+            if summary is None:
+                break
+            self.summary = summary
+        self.worker.join()
+        self.worker = None
+        print('Live coverage grid saved to '+self.grid_file)
+        return self.summary
+#-----------------------------------------------------------------------------
+
@@ -0,0 +1,1169 @@
+##############################################################################
+############################################################################## 
+# Open Sonar Library - Files
+##############################################################################
+##############################################################################
+# Created for the Open Sonar Project by:
+# Graham Christie, Isaac Fuller, Kara Sanford
+# January 2022
+#############################################
+# Version 5.0
+##############################################################################
+##############################################################################
+
+# Reading and writing configuration files, logs, echo files and typed
+# columns, and the survey catalog. Every program uses some of these.
+
+import csv
+import os
+import io
+import json
+import itertools
+import time
+import threading
+import collections
+import gzip
+import queue
+import re
+import sqlite3
+import heapq
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import datetime as dt
+
+# GGA fix quality indicators
+FIX_QUALITIES = {0: 'invalid', 1: 'gps', 2: 'dgps', 3: 'pps', 4: 'rtk_fixed',
+                 5: 'rtk_float', 6: 'estimated', 7: 'manual', 8: 'simulation'}
+
+# Length of a day in nanoseconds
+DAY_NS = 86400 * 1000000000
+
+#########################################
+#########################################
+# Readers
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+def generic_reader(filename, delimit, start, end):
+    # Generic reader used to read all files
+    return_list = []        
+    with open_log(filename) as file:
+        csv_reader = csv.reader(file, delimiter=delimit)
+        start_found = False
+        for row in csv_reader:
+            if row[0] != start and start_found == False:
+                pass
+            elif row[0] == start:
+                start_found = True                    
+            elif row[0] == end:                    
+                return return_list
+            else:
+                return_list.append(row) 
+    return return_list    
+#-----------------------------------------------------------------------------
+
+# Types of the name, kind (gnss or sonar), port, baud rate and waterline
+# offset in each Sensor row, one row for every additional sensor
+SENSOR_TYPES = [str, str, str, int, float]
+
+# Optional configuration rows, written after the required rows and found by
+# the name in their first field, with the type of each value and the values
+# used for files written before the row existed, or before later values were
+# added to it
+CONFIG_OPTIONS = {
+    'Ping_Mode': ([str, int, int], ['triggered', 100, 50]),
+    'Range_Control': ([str, float, int], ['none', 70.0, 50]),
+    'Echo_Capture': ([str], ['no']),
+    'Log_Compression': ([str], ['no']),
+    'Log_Rotation': ([str, float], ['none', 0]),
+    'Live_Processing': ([str, float, str], ['no', 5.0, '']),
+    'Uncertainty': ([float, float, float], [0.02, 0.02, 0.5]),
+    'Line_Segmentation': ([float, float, float, float], [3.0, 20.0, 1.0, 60.0]),
+    'Latency': ([float], [0.0]),
+    'Heave_Filter': ([str, float, int], ['none', 20.0, 2]),
+}
+
+# Ping modes where pings are not logged straight after a GNSS message, and are
+# positioned between GGA records by their time
+STREAMED_PING_MODES = ('stream', 'free')
+
+# File types written in the first row of Open Sonar files
+OSP_FILETYPES = ('OSPLIB_CONFIG', 'OSP_RAW_LOG', 'OSP_SIMPLE_LOG')
+
+#-----------------------------------------------------------------------------
+def read_header(filename):
+    # Reader to return the file type and header rows of an Open Sonar file.
+    # Reading stops at Header_End, and straight away for files that are not
+    # Open Sonar files, so the body of a log is never read. The rows are None
+    # if the file has no complete header.
+    with open_log(filename) as file:
+        reader = csv.reader(file)
+        try:
+            filetype = next(reader, [''])[0].strip("[]'")
+        except (IndexError, UnicodeDecodeError, csv.Error):
+            return '', None
+        if filetype not in OSP_FILETYPES:
+            return filetype, None
+        rows = []
+        for row in reader:
+            if row == ['Header_End']:
+                return filetype, rows
+            if row != ['Header_Start']:
+                rows.append(row)
+    return filetype, None
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_config_file(filename):
+    # Controller for the header reader to extract metadata from config file
+    if not file_check(filename, ('.csv', '.csv.gz')):
+        return
+        
+    filetype, read_result = read_header(filename)
+    if read_result is None:
+        print(filename+' has no Open Sonar header')
+        return
+        
+    meta = {}
+    meta['Survey'] = [read_result[0][0],read_result[0][1],read_result[0][2]]
+    meta['Geodetics'] = [float(read_result[1][0]),float(read_result[1][1])]
+    meta['Vessel'] = [read_result[2][0]]
+    meta['GNSS'] = [read_result[3][0],read_result[3][1],float(read_result[3][2]),
+                        float(read_result[3][3]),float(read_result[3][4]),
+                        float(read_result[3][5])]        
+    meta['Sonar'] = [read_result[4][0],read_result[4][1],float(read_result[4][2]),
+                         float(read_result[4][3]),float(read_result[4][4]),
+                         float(read_result[4][5])] 
+    meta['SVP'] = [read_result[5][0],read_result[5][1],float(read_result[5][2])]
+    meta['GNSS_Com'] = [read_result[6][0],read_result[6][1], int(read_result[6][2])]
+    meta['Sonar_Com'] = [read_result[7][0],read_result[7][1], int(read_result[7][2])]
+    meta['SVP_Com'] = [read_result[8][0],read_result[8][1],int(read_result[8][2])]
+    
+    for name, (types, defaults) in CONFIG_OPTIONS.items():
+        meta[name] = list(defaults)
+    meta['Sensors'] = []
+    for row in read_result[9:]:
+        if row and row[0] in CONFIG_OPTIONS:
+            types, defaults = CONFIG_OPTIONS[row[0]]
+            values = [kind(value) for kind, value in zip(types, row[1:])]
+            meta[row[0]] = values + list(defaults[len(values):])
+        elif row and row[0] == 'Sensor':
+            meta['Sensors'].append([kind(value) for kind, value in
+                                    zip(SENSOR_TYPES, row[1:])])
+                
+    return meta
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_log_body(filename, start='Header_End', threads=None):
+    # Reader to return everything in a log after the header as bytes, so the
+    # records can be decoded in bulk rather than row by row. Compressed logs
+    # with a block index have their blocks decompressed on several threads.
+    if is_compressed(filename):
+        blocks = read_block_index(filename)
+        if blocks is not None:
+            return read_log_blocks(filename, blocks, threads)
+        with gzip.open(filename, 'rb') as file:
+            return skip_header(file, start)
+    with open(filename, 'rb') as file:
+        return skip_header(file, start)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def skip_header(file, start):
+    # Function to read a binary log file from the line after start
+    for line in file:
+        if line.rstrip(b'\r\n') == start.encode():
+            break
+    return file.read()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def is_compressed(filename):
+    # Function to check for the gzip signature at the start of a file
+    with open(filename, 'rb') as file:
+        return file.read(2) == b'\x1f\x8b'
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def open_log(filename):
+    # Function to open a plain or compressed log as text
+    if is_compressed(filename):
+        return gzip.open(filename, 'rt', newline='')
+    return open(filename, newline='')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_block_index(filename):
+    # Function to read the block index written next to a compressed log by
+    # Block_Log_Writer, as an array with a row of offset, length, lines, first
+    # and last log time, pings and positions for each block. Indexes written
+    # before pings and positions were counted have -1 for them. None if the
+    # log has no index.
+    index_file = filename+'.idx'
+    if not os.path.exists(index_file):
+        return None
+    with open(index_file) as file:
+        rows = [line.strip().split(',') for line in file if line.strip()]
+    rows = [row + ['-1']*(7 - len(row)) for row in rows]
+    blocks = np.array(rows, dtype=np.int64).reshape(-1, 7)
+    if len(blocks) and blocks[-1, 0] + blocks[-1, 1] != os.path.getsize(filename):
+        print('Data after the last indexed block of '+filename+' was not read')
+    return blocks
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_log_blocks(filename, blocks, threads=None):
+    # Function to decompress blocks of a compressed log, in parallel threads
+    # as zlib works outside the interpreter lock, and join them in order
+    members = []
+    with open(filename, 'rb') as file:
+        for offset, length in blocks[:, :2]:
+            file.seek(offset)
+            members.append(file.read(length))
+    with ThreadPoolExecutor(threads or os.cpu_count() or 1) as pool:
+        return b''.join(pool.map(gzip.decompress, members))
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_log_range(filename, first_time, last_time, threads=None):
+    # Function to return only the blocks of a compressed log that hold lines
+    # logged between two times of day given as HH:MM:SS, decompressing
+    # nothing else. Lines either side of the range in those blocks are kept.
+    blocks = read_block_index(filename)
+    if blocks is None:
+        print(filename+' has no block index, reading all of it')
+        return read_log_body(filename)
+    first_ns = line_time(first_time)
+    last_ns = line_time(last_time)
+    # Blocks spanning midnight end before they start
+    wraps = blocks[:, 4] < blocks[:, 3]
+    selected = wraps | ((blocks[:, 4] >= first_ns) & (blocks[:, 3] <= last_ns))
+    return read_log_blocks(filename, blocks[selected], threads)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_manifest(filename):
+    # Reader to return the raw log segments listed in a manifest written by
+    # Log_Rotator, in order, with paths beside the manifest. Segments that
+    # are missing are reported and left out.
+    with open(filename) as file:
+        manifest = json.load(file)
+    if manifest.get('format') != 'OSP_MANIFEST':
+        print(filename+' is not an Open Sonar manifest')
+        return []
+    folder = os.path.dirname(filename)
+    segments = []
+    for segment in manifest['segments']:
+        path = os.path.join(folder, segment['raw_log'])
+        if os.path.isfile(path):
+            segments.append(path)
+        else:
+            print('Segment '+segment['raw_log']+' not found, leaving it out')
+    return segments
+#-----------------------------------------------------------------------------
+
+# Columns read from raw CTD casts, found in the header row by the start of
+# their name in lower case, including the names Sea-Bird software gives them
+CTD_COLUMNS = {'pressure': ('pres', 'prdm', 'prm', 'prsm'),
+               'temperature': ('temp', 't090', 't190', 'tv290'),
+               'salinity': ('sal',)}
+
+#-----------------------------------------------------------------------------
+def read_ctd_cast(filename):
+    # Reader to return the pressure in dbar, temperature in degrees C and
+    # salinity in PSU of every sample of a raw CTD cast as columns. The
+    # header row is the first row naming all three, and values that are not
+    # numbers are read as NaN.
+    with open(filename) as file:
+        for number, row in enumerate(csv.reader(file)):
+            names = [name.strip().lower() for name in row]
+            found = {column: [index for index, name in enumerate(names)
+                              if name.startswith(start)]
+                     for column, start in CTD_COLUMNS.items()}
+            if all(found.values()):
+                break
+        else:
+            print(filename+' has no pressure, temperature and salinity columns')
+            return None
+    table = np.genfromtxt(filename, delimiter=',', skip_header=number+1,
+                          usecols=[found[column][0] for column in CTD_COLUMNS],
+                          invalid_raise=False, ndmin=2)
+    return {column: table[:, index] for index, column in enumerate(CTD_COLUMNS)}
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_echoes(filename):
+    # Function to memory map an echo file written by Echo_Writer as an array
+    # of ping records. The samples field is a 2-D array of pings by samples,
+    # so echograms can be sliced without reading the whole file.
+    with open(filename, 'rb') as file:
+        header = file.read(ECHO_HEADER_SIZE)
+    if header[:8] != ECHO_MAGIC:
+        print(filename+' is not an echo file')
+        return False
+    dtype = echo_record(int.from_bytes(header[8:12], 'little'))
+    pings = (os.path.getsize(filename) - ECHO_HEADER_SIZE)//dtype.itemsize
+    return np.memmap(filename, dtype=dtype, mode='r', offset=ECHO_HEADER_SIZE,
+                     shape=(pings,))
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_schema(path):
+    # Function to read the schema sidecar of a directory written by
+    # Column_Writer, with the column names and types, row count and attributes
+    with open(os.path.join(path, 'schema.json')) as file:
+        return json.load(file)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_columns(path, names=None):
+    # Function to read the columns of a directory written by Column_Writer.
+    # Columns are memory mapped, so only the selected columns are read and
+    # only the parts of them that are used.
+    schema = read_schema(path)
+    available = [column['name'] for column in schema['columns']]
+    if names is None:
+        names = available
+    for name in names:
+        if name not in available:
+            print('Column '+name+' not found in '+path)
+            return False
+    return {name: np.load(os.path.join(path, name+'.npy'), mmap_mode='r')
+            for name in names}
+#-----------------------------------------------------------------------------
+
+# Columns of the survey catalog, after the path, size and modification time
+CATALOG_FIELDS = ('filetype', 'survey', 'location', 'survey_date', 'vessel',
+                  'gnss', 'gnss_type', 'sonar', 'sonar_type', 'svp', 'svp_type',
+                  'ping_mode', 'compressed', 'first_time', 'last_time',
+                  'records', 'pings', 'positions')
+
+# Bytes of whole lines read at a time when counting the records of a log
+CATALOG_READ_BYTES = 1024 * 1024
+
+#-----------------------------------------------------------------------------
+class Survey_Catalog:
+# Class to keep an index of the config files and logs in a folder tree in a
+# SQLite database, with the survey, vessel, sensors, time span and record
+# counts of each. Queries are answered from the database without opening any
+# file, and a scan only reads files that are new or have changed size or
+# modification time since they were indexed.
+    def __init__(self, database='Output/survey_catalog.sqlite'):
+        self.database = database
+        self.connection = sqlite3.connect(database)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, '
+                'size INTEGER, modified REAL, '+
+                ', '.join(CATALOG_FIELDS)+')')
+            for field in ('survey', 'vessel', 'survey_date'):
+                self.connection.execute('CREATE INDEX IF NOT EXISTS files_'+field+
+                                        ' ON files ('+field+')')
+                
+    def scan(self, folder):
+        # Function to index every Open Sonar file in a folder tree, and to
+        # drop files under the folder that no longer exist
+        known = {row['path']: (row['size'], row['modified']) for row in
+                 self.connection.execute('SELECT path, size, modified FROM files')}
+        folder = os.path.abspath(folder)
+        found = set()
+        added = 0
+        with self.connection:
+            for root, folders, files in os.walk(folder):
+                segments = self.manifest_segments(root, files)
+                for name in sorted(files):
+                    if not name.endswith(('.csv', '.csv.gz')):
+                        continue
+                    path = os.path.join(root, name)
+                    status = os.stat(path)
+                    found.add(path)
+                    if known.get(path) == (status.st_size, status.st_mtime):
+                        continue
+                    entry = self.catalog_file(path, segments.get(name))
+                    if entry is None:
+                        continue
+                    self.connection.execute(
+                        'INSERT OR REPLACE INTO files VALUES ('+
+                        ', '.join('?'*(len(CATALOG_FIELDS)+3))+')',
+                        [path, status.st_size, status.st_mtime]+
+                        [entry[field] for field in CATALOG_FIELDS])
+                    added += 1
+            removed = [path for path in known if path.startswith(folder+os.sep)
+                       and path not in found]
+            self.connection.executemany('DELETE FROM files WHERE path = ?',
+                                        [(path,) for path in removed])
+        print(f'{added} files indexed, {len(removed)} removed from the catalog')
+        
+    def manifest_segments(self, folder, files):
+        # Function to find the segments listed in the manifests of a folder
+        # that have their record counts, by raw log name
+        segments = {}
+        for name in files:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(folder, name)) as file:
+                    manifest = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if not isinstance(manifest, dict) or manifest.get('format') != 'OSP_MANIFEST':
+                continue
+            for segment in manifest.get('segments', []):
+                if segment.get('records') is not None:
+                    segments[segment['raw_log']] = segment
+        return segments
+    
+    def index_counts(self, path):
+        # Function to take the time span and record counts of a compressed
+        # log from its block index, or None if it has no complete index with
+        # the counts
+        blocks = read_block_index(path)
+        if blocks is None or not len(blocks) or (blocks[:, 5:] < 0).any():
+            return None
+        if blocks[-1, 0] + blocks[-1, 1] != os.path.getsize(path):
+            return None
+        return {'records': int(blocks[:, 2].sum()),
+                'first_time': format_line_time(blocks[0, 3]),
+                'last_time': format_line_time(blocks[-1, 4]),
+                'pings': int(blocks[:, 5].sum()),
+                'positions': int(blocks[:, 6].sum())}
+    
+    def body_counts(self, path, raw=True):
+        # Function to count the records of a log by reading its body a block
+        # of lines at a time, keeping only the first and last line. Pings and
+        # positions are those of the main sensors, like the manifest and block
+        # index count them, and every record of a simple log is a position.
+        counts = {'records': 0, 'first_time': None, 'last_time': None,
+                  'pings': 0, 'positions': 0}
+        opener = gzip.open if is_compressed(path) else open
+        with opener(path, 'rb') as file:
+            for line in file:
+                if line.rstrip(b'\r\n') == b'Header_End':
+                    break
+            last = None
+            while True:
+                lines = file.readlines(CATALOG_READ_BYTES)
+                if not lines:
+                    break
+                if last is None:
+                    counts['first_time'] = lines[0].split(b',', 1)[0].decode()
+                last = lines[-1]
+                counts['records'] += len(lines)
+                if raw:
+                    pings, positions = count_main_records(b''.join(lines).decode('latin-1'))
+                    counts['pings'] += pings
+                    counts['positions'] += positions
+            if last is not None:
+                counts['last_time'] = last.split(b',', 1)[0].decode()
+        if not raw:
+            counts['positions'] = counts['records']
+        return counts
+    
+    def catalog_file(self, path, segment=None):
+        # Function to make the catalog entry of one file, or None if it is not
+        # an Open Sonar file. The metadata comes from the header alone. Record
+        # counts of a log come from its segment in a manifest when given, or
+        # from the block index of a compressed log, and otherwise the log is
+        # streamed once to count them.
+        filetype, rows = read_header(path)
+        if rows is None or len(rows) < 9:
+            return None
+        entry = dict.fromkeys(CATALOG_FIELDS)
+        entry['filetype'] = filetype
+        entry['survey'], entry['location'] = rows[0][0], rows[0][1]
+        entry['survey_date'] = rows[0][2][:10]
+        entry['vessel'] = rows[2][0]
+        entry['gnss'], entry['gnss_type'] = rows[3][0], rows[3][1]
+        entry['sonar'], entry['sonar_type'] = rows[4][0], rows[4][1]
+        entry['svp'], entry['svp_type'] = rows[5][0], rows[5][1]
+        entry['ping_mode'] = CONFIG_OPTIONS['Ping_Mode'][1][0]
+        for row in rows[9:]:
+            if row and row[0] == 'Ping_Mode':
+                entry['ping_mode'] = row[1]
+        entry['compressed'] = int(is_compressed(path))
+        counts = None
+        if filetype == 'OSP_RAW_LOG' and segment is not None:
+            counts = {name: segment[name] for name in
+                      ('records', 'first_time', 'last_time', 'pings', 'positions')}
+        elif filetype == 'OSP_RAW_LOG' and entry['compressed']:
+            counts = self.index_counts(path)
+        if counts is not None:
+            entry.update(counts)
+        elif filetype != 'OSPLIB_CONFIG':
+            entry.update(self.body_counts(path, filetype == 'OSP_RAW_LOG'))
+        return entry
+    
+    def find(self, filetype=None, survey=None, vessel=None, sensor=None,
+             date_from=None, date_to=None):
+        # Function to list the catalogued files matching every filter given.
+        # A sensor matches by name or type, dates are given as YYYY-MM-DD.
+        where = []
+        values = []
+        for field, value in (('filetype', filetype), ('survey', survey),
+                             ('vessel', vessel)):
+            if value:
+                where.append(field+' = ?')
+                values.append(value)
+        if sensor:
+            where.append('? IN (gnss, gnss_type, sonar, sonar_type, svp, svp_type)')
+            values.append(sensor)
+        if date_from:
+            where.append('survey_date >= ?')
+            values.append(date_from)
+        if date_to:
+            where.append('survey_date <= ?')
+            values.append(date_to)
+        query = 'SELECT * FROM files'
+        if where:
+            query += ' WHERE '+' AND '.join(where)
+        query += ' ORDER BY survey_date, path'
+        return [dict(row) for row in self.connection.execute(query, values)]
+    
+    def surveys(self):
+        # Function to sum up the catalog by survey, vessel and date
+        return [dict(row) for row in self.connection.execute(
+            'SELECT survey, vessel, survey_date, COUNT(*) AS files, '
+            'SUM(filetype = \'OSP_RAW_LOG\') AS raw_logs, '
+            'MIN(first_time) AS first_time, MAX(last_time) AS last_time, '
+            'SUM(pings) AS pings FROM files '
+            'GROUP BY survey, vessel, survey_date ORDER BY survey_date, survey')]
+    
+    def close(self):
+        # Function to close the catalog database
+        self.connection.close()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def file_check(filename, ending):
+    # Checks if the filename exist and if they end in .csv, or in one of a
+    # tuple of endings
+    if filename.endswith(ending):
+        return True
+    else:
+        endings = ending if isinstance(ending, tuple) else (ending,)
+        print('File does not end in "'+'" or "'.join(endings)+'"')
+        return False
+    filexists = os.path.isfile(filename)
+    if not filexists:
+        print('File not found!')
+        return False
+#-----------------------------------------------------------------------------
+
+#########################################
+#########################################
+# Writers
+#########################################
+#########################################
+
+# Echo files start with a header of the file type and the number of samples
+# in each ping, followed by a fixed size record for every ping
+ECHO_MAGIC = b'OSPECHO1'
+ECHO_HEADER_SIZE = 16
+ECHO_SAMPLES = 200
+
+#-----------------------------------------------------------------------------
+def echo_record(samples):
+    # Function to give the record type of one ping in an echo file. Time is
+    # UTC in nanoseconds since 1970, the same instant as the time of the
+    # ping's DEPTH line in the raw log. Distances are in millimetres.
+    return np.dtype([('time', '<i8'), ('ping_number', '<u4'), ('distance', '<u4'),
+                     ('confidence', '<u2'), ('transmit_duration', '<u2'),
+                     ('scan_start', '<u4'), ('scan_length', '<u4'),
+                     ('gain_setting', '<u4'), ('soundspeed', '<f4'),
+                     ('samples', 'u1', (samples,))])
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def datetime_to_ns(value):
+    # Function to convert a UTC datetime to nanoseconds since 1970
+    seconds = value.hour*3600 + value.minute*60 + value.second
+    return ((value.toordinal() - dt.date(1970, 1, 1).toordinal())*DAY_NS +
+            (seconds*1000000 + value.microsecond)*1000)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Echo_Writer:
+# Class to append the echo profile of each ping to an echo file. Records are
+# only ever appended, unbuffered, so a file cut short by a crash loses at most
+# its last ping. An existing echo file is appended to with the samples of its
+# header, after any record a crash left part written is cut off.
+    def __init__(self, filename, samples=ECHO_SAMPLES):
+        self.filename = filename
+        self.file = None
+        new = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        if not new:
+            with open(filename, 'rb') as file:
+                header = file.read(ECHO_HEADER_SIZE)
+            if len(header) < ECHO_HEADER_SIZE or header[:8] != ECHO_MAGIC:
+                print(filename+' is not an echo file, echo profiles will not be saved')
+                return
+            file_samples = int.from_bytes(header[8:12], 'little')
+            if file_samples != samples:
+                print(f'{filename} has {file_samples} samples per ping, profiles '
+                      f'will be cut or padded to fit')
+                samples = file_samples
+        self.dtype = echo_record(samples)
+        self.samples = samples
+        if not new:
+            records = (os.path.getsize(filename) - ECHO_HEADER_SIZE)//self.dtype.itemsize
+            os.truncate(filename, ECHO_HEADER_SIZE + records*self.dtype.itemsize)
+        self.file = open(filename, 'ab', buffering=0)
+        if new:
+            self.file.write(ECHO_MAGIC + samples.to_bytes(4, 'little') +
+                            bytes(ECHO_HEADER_SIZE - 12))
+        
+    def write(self, distance, soundspeed):
+        # Function to write one ping from a distance dictionary with its
+        # profile_data and datetime. Profiles of another length are cut or
+        # padded with zeros to the samples of the file.
+        if self.file is None or distance.get('profile_data') is None:
+            return False
+        record = np.zeros(1, dtype=self.dtype)
+        record['time'] = datetime_to_ns(distance['datetime'])
+        record['distance'] = round(distance['distance']*1000)
+        for name in ('ping_number', 'confidence', 'transmit_duration',
+                     'scan_start', 'scan_length', 'gain_setting'):
+            record[name] = distance[name]
+        record['soundspeed'] = soundspeed
+        samples = np.frombuffer(bytes(distance['profile_data']), dtype=np.uint8)
+        record['samples'][0, :min(len(samples), self.samples)] = samples[:self.samples]
+        self.file.write(record.tobytes())
+        return True
+    
+    def close(self):
+        # Function to close the echo file
+        if self.file is not None:
+            self.file.close()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_meta_header(filename, metadata):
+    # Function to write new files with survey metadata as the header. Files
+    # ending in .gz start with the header as their own gzip member, for
+    # Block_Log_Writer to add blocks to.
+    if filename.endswith('.gz'):
+        file = io.StringIO()
+    else:
+        file = open(filename, 'w', newline='')
+    with file:
+        writer = csv.writer(file)
+        writer.writerow([metadata['filetype']])
+        writer.writerow(['Header_Start'])
+        writer.writerow(metadata['Survey'])
+        writer.writerow(metadata['Geodetics'])
+        writer.writerow(metadata['Vessel'])
+        writer.writerow(metadata['GNSS'])
+        writer.writerow(metadata['Sonar'])
+        writer.writerow(metadata['SVP'])
+        writer.writerow(metadata['GNSS_Com'])
+        writer.writerow(metadata['Sonar_Com'])
+        writer.writerow(metadata['SVP_Com'])
+        for name in CONFIG_OPTIONS:
+            if name in metadata:
+                writer.writerow([name]+metadata[name])
+        for sensor in metadata.get('Sensors', []):
+            writer.writerow(['Sensor']+sensor)
+        if metadata['filetype'][0] == 'OSP_SIMPLE_LOG':
+            writer.writerow(['Time, Latitude, Longitude, Depth_Below_Water, Height_Ellipsoidal, Soundspeed'])
+        writer.writerow(['Header_End'])
+        if filename.endswith('.gz'):
+            with open(filename, 'wb') as compressed:
+                compressed.write(gzip.compress(file.getvalue().encode(), mtime=0))
+            if os.path.exists(filename+'.idx'):
+                os.remove(filename+'.idx')
+    print(metadata['filetype'][0]+' file created')    
+        
+#-----------------------------------------------------------------------------
+
+# Size and age of the blocks of a compressed log. Blocks are written once they
+# reach the size, or the age in seconds so little is lost if logging stops.
+LOG_BLOCK_SIZE = 256 * 1024
+LOG_BLOCK_SECONDS = 10
+
+# Pings and positions of the main sensors in raw log text. Records of
+# additional sensors have their tag between the log time and the sentence, so
+# they do not match.
+MAIN_PING_RECORD = re.compile(r'^[^,\n]*,\$DEPTH,', re.MULTILINE)
+MAIN_POSITION_RECORD = re.compile(r'^[^,\n]*,\$..GGA,', re.MULTILINE)
+
+#-----------------------------------------------------------------------------
+def count_main_records(text):
+    # Function to count the pings and positions of the main sensors in raw
+    # log text, as processing finds soundings from them alone
+    return (len(MAIN_PING_RECORD.findall(text)),
+            len(MAIN_POSITION_RECORD.findall(text)))
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Block_Log_Writer:
+# Class to write a log as independently compressed gzip members, with an index
+# of the blocks in a sidecar .idx file, so any block can be read on its own.
+# The index counts the lines of each block, and the pings and positions of the
+# main sensors, so a log can be catalogued without decompressing it.
+# Lines are gathered in memory and full blocks are compressed and written by
+# a background thread, so acquisition only pays for keeping each line. The
+# log is a normal gzip file that any gzip tool can read whole.
+    def __init__(self, filename, block_size=LOG_BLOCK_SIZE):
+        self.filename = filename
+        self.block_size = block_size
+        self.lines = []
+        self.size = 0
+        self.block_start = time.monotonic()
+        self.blocks = queue.Queue()
+        self.thread = threading.Thread(target=self.compress_blocks, daemon=True)
+        self.thread.start()
+        
+    def write(self, text):
+        # Function to add text to the current block
+        self.lines.append(text)
+        self.size += len(text)
+        if (self.size >= self.block_size or
+                time.monotonic() - self.block_start >= LOG_BLOCK_SECONDS):
+            self.flush()
+            
+    def flush(self):
+        # Function to hand the current block to the compression thread
+        if self.lines:
+            self.blocks.put(''.join(self.lines))
+        self.lines = []
+        self.size = 0
+        self.block_start = time.monotonic()
+        
+    def compress_blocks(self):
+        # Function run by the compression thread until close
+        with open(self.filename, 'ab') as file, open(self.filename+'.idx', 'a') as index:
+            while True:
+                block = self.blocks.get()
+                if block is None:
+                    return
+                member = gzip.compress(block.encode(), compresslevel=6, mtime=0)
+                offset = file.tell()
+                file.write(member)
+                file.flush()
+                lines = block.splitlines()
+                pings, positions = count_main_records(block)
+                index.write(f'{offset},{len(member)},{len(lines)},'
+                            f'{line_time(lines[0])},{line_time(lines[-1])},'
+                            f'{pings},{positions}\n')
+                index.flush()
+                
+    def close(self):
+        # Function to write the last block and stop the compression thread
+        self.flush()
+        self.blocks.put(None)
+        self.thread.join()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def line_time(line):
+    # Function to read the HH:MM:SS.ffffff time at the start of a log line as
+    # nanoseconds since midnight, -1 if there is none
+    try:
+        hours, minutes, seconds = line.split(',', 1)[0].split(':')
+        return round((int(hours)*3600 + int(minutes)*60 + float(seconds))*1e9)
+    except ValueError:
+        return -1
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def format_line_time(time_ns):
+    # Function to write nanoseconds since midnight as the HH:MM:SS.ffffff time
+    # of a log line, None if there is no time
+    if time_ns < 0:
+        return None
+    hours, rest = divmod(int(time_ns), 3600*10**9)
+    minutes, rest = divmod(rest, 60*10**9)
+    return f'{hours:02d}:{minutes:02d}:{rest/1e9:09.6f}'
+#-----------------------------------------------------------------------------
+
+# Rows of the header that must match for raw logs to be merged, as they change
+# how the records are processed
+MERGE_MATCHED_ROWS = ['Geodetics', 'Vessel', 'GNSS', 'Sonar', 'Ping_Mode',
+                      'Latency', 'Sensors']
+
+# Most logs Log_Merger reads at once. More logs are first merged in groups of
+# this many into temporary files, which are then merged.
+MERGE_MAX_OPEN = 64
+
+# Seconds of log time over which Log_Merger remembers lines to leave out
+# lines repeated in several logs
+MERGE_REPEAT_SECONDS = 10
+
+# Lines read at the start of a log to find the date of its first RMC sentence
+MERGE_DATE_LINES = 2000
+
+#-----------------------------------------------------------------------------
+class Log_Merger:
+# Class to merge raw logs into one stream of lines in time order, such as the
+# logs left by restarts during a survey day, which may overlap or be given
+# out of order. Every log is read a line at a time and the next line is taken
+# from the log whose next line was logged first, so memory does not grow with
+# the logs and each log keeps the order of its own lines. Times of day are put
+# on the date of the first RMC sentence of each log, or else the survey date,
+# moving on a day whenever they jump back by more than half a day. Lines
+# found in more than one log are kept once.
+    def __init__(self, filenames, max_open=MERGE_MAX_OPEN):
+        self.max_open = max_open
+        self.headers = {}
+        for filename in filenames:
+            filetype, rows = read_header(filename)
+            self.headers[filename] = (read_config_file(filename)
+                                      if filetype == 'OSP_RAW_LOG' else None)
+        # Logs are merged from the one logged first, whose header is kept
+        first = {filename: next(self.log_lines(filename), (float('inf'),))[0]
+                 for filename in filenames}
+        self.filenames = sorted(filenames, key=first.get)
+        self.metadata = next((self.headers[filename] for filename in self.filenames
+                              if self.headers[filename] is not None), None)
+        self.kept = 0
+        self.repeats = 0
+        
+    def check_headers(self):
+        # Function to check every log has a raw log header matching the first
+        # in MERGE_MATCHED_ROWS, printing the logs that do not
+        compatible = self.metadata is not None
+        for filename in self.filenames:
+            metadata = self.headers[filename]
+            if metadata is None:
+                print(filename+' has no raw log header')
+                compatible = False
+                continue
+            differ = [name for name in MERGE_MATCHED_ROWS
+                      if metadata.get(name) != self.metadata.get(name)]
+            if differ:
+                print(filename+' does not match '+self.filenames[0]+' in '+', '.join(differ))
+                compatible = False
+        return compatible
+    
+    def times_of_day(self, lines):
+        # Function to read the time of day of each line in nanoseconds, with
+        # the number of days the log has moved on. Lines without a time take
+        # the time of the line before them.
+        days = 0
+        last = None
+        for line in lines:
+            time_of_day = line_time(line)
+            if time_of_day < 0:
+                time_of_day = 0 if last is None else last
+            elif last is not None and time_of_day < last - DAY_NS//2:
+                days += 1
+            last = time_of_day
+            yield days, time_of_day, line
+            
+    def log_day(self, lines, day):
+        # Function to find midnight of the first day of a log from the first
+        # RMC sentence with a date in its first lines, or keep the day given
+        for days, time_of_day, line in self.times_of_day(lines):
+            fields = line.split(',')
+            if len(fields) < 11 or fields[1][3:] != 'RMC':
+                continue
+            try:
+                date = dt.datetime.strptime(fields[10], '%d%m%y')
+            except ValueError:
+                continue
+            utc = line_time(fields[2][0:2]+':'+fields[2][2:4]+':'+fields[2][4:])
+            if utc < 0:
+                continue
+            rmc = datetime_to_ns(date) + utc
+            return (rmc - days*DAY_NS - time_of_day + DAY_NS//2)//DAY_NS*DAY_NS
+        return day
+    
+    def log_lines(self, filename):
+        # Function to read the lines after the header of a log, one at a time,
+        # with their log times in nanoseconds since the epoch
+        day = 0
+        metadata = self.headers[filename]
+        if metadata is not None:
+            survey = dt.datetime.fromisoformat(str(metadata['Survey'][2]).strip())
+            day = datetime_to_ns(dt.datetime.combine(survey.date(), dt.time()))
+        with open_log(filename) as file:
+            for line in file:
+                if line.rstrip('\r\n') == 'Header_End':
+                    break
+            start = list(itertools.islice(file, MERGE_DATE_LINES))
+            day = self.log_day(start, day)
+            lines = (line for line in itertools.chain(start, file) if line.strip())
+            for days, time_of_day, line in self.times_of_day(lines):
+                if not line.endswith('\n'):
+                    line += '\n'
+                yield day + days*DAY_NS + time_of_day, line
+                
+    def run_lines(self, filename):
+        # Function to read back the timed lines of a group merged into a
+        # temporary file
+        with open(filename, newline='') as file:
+            for line in file:
+                time_ns, line = line.split(',', 1)
+                yield int(time_ns), line
+                
+    def merge(self, sources):
+        # Function to merge sources of timed lines by time, leaving out lines
+        # already taken from another source within MERGE_REPEAT_SECONDS. Each
+        # line seen is kept with the source and time it was last taken from,
+        # and is forgotten once that time has left the window.
+        window = MERGE_REPEAT_SECONDS*1000000000
+        recent = collections.deque()
+        seen = {}
+        numbered = [zip(itertools.repeat(number), source)
+                    for number, source in enumerate(sources)]
+        for number, (time_ns, line) in heapq.merge(*numbered, key=lambda item: item[1][0]):
+            while recent and recent[0][0] < time_ns - window:
+                expired, text = recent.popleft()
+                if seen.get(text, (None, None))[1] == expired:
+                    del seen[text]
+            text = line.rstrip('\r\n')
+            if seen.get(text, (number,))[0] != number:
+                self.repeats += 1
+                continue
+            seen[text] = (number, time_ns)
+            recent.append((time_ns, text))
+            yield time_ns, line
+            
+    def lines(self):
+        # Function to return the merged lines one at a time. Logs are only
+        # opened once their lines are needed. With more than max_open logs,
+        # groups of them are merged into temporary files, and the groups of
+        # those until few enough are left. Groups stay in the order of their
+        # logs, so lines logged at the same time keep the order of the logs.
+        sources = [self.log_lines(filename) for filename in self.filenames]
+        runs = []
+        try:
+            while len(sources) > self.max_open:
+                groups = [sources[start:start+self.max_open]
+                          for start in range(0, len(sources), self.max_open)]
+                sources = []
+                for group in groups:
+                    with tempfile.NamedTemporaryFile('w', suffix='.osp', newline='',
+                                                     delete=False) as run:
+                        runs.append(run.name)
+                        for time_ns, line in self.merge(group):
+                            run.write(str(time_ns)+','+line)
+                    sources.append(self.run_lines(run.name))
+            for time_ns, line in self.merge(sources):
+                self.kept += 1
+                yield line
+        finally:
+            for run in runs:
+                os.remove(run)
+                
+    def write(self, filename):
+        # Function to write the merged lines as one raw log with the header of
+        # the first log, compressed in blocks when the name ends in .gz
+        metadata = dict(self.metadata, filetype=['OSP_RAW_LOG'])
+        write_meta_header(filename, metadata)
+        if filename.endswith('.gz'):
+            log = Block_Log_Writer(filename)
+        else:
+            log = open(filename, 'a', newline='')
+        for line in self.lines():
+            log.write(line)
+        log.close()
+        self.report()
+        print('Merged raw log saved to '+filename)
+        
+    def report(self):
+        # Function to print the number of lines merged and left out
+        print(f'{self.kept} lines merged from {len(self.filenames)} logs, '
+              f'{self.repeats} repeated lines left out')
+#-----------------------------------------------------------------------------
+
+# Size of the .npy headers written by Column_Writer, fixed so the row count
+# can be filled in after the rows are written
+COLUMN_HEADER_SIZE = 128
+
+# Number of rows converted and written at a time
+COLUMN_CHUNK_ROWS = 100000
+
+#-----------------------------------------------------------------------------
+def npy_header(dtype, rows):
+    # Function to make a .npy header of COLUMN_HEADER_SIZE bytes for a column
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype),
+                   'fortran_order': False, 'shape': (rows,)})
+    header = header.ljust(COLUMN_HEADER_SIZE - 11) + '\n'
+    return (b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') +
+            header.encode('latin1'))
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Column_Writer:
+# Class to write typed columns to a directory with one .npy file per column
+# and a schema.json sidecar. Rows are appended in chunks so only one chunk is
+# held in memory, and the row count in each header is filled in on close.
+# Writing to an existing directory appends to its columns. Text columns are
+# widened when a later chunk has longer text, so no text is cut short.
+    def __init__(self, path, attrs=None):
+        self.path = path
+        self.attrs = attrs or {}
+        self.rows = 0
+        self.dtypes = {}
+        self.files = {}
+        if os.path.exists(os.path.join(path, 'schema.json')):
+            schema = read_schema(path)
+            self.rows = schema['rows']
+            self.attrs = dict(schema['attrs'], **self.attrs)
+            for column in schema['columns']:
+                self.dtypes[column['name']] = np.dtype(column['dtype'])
+                self.files[column['name']] = open(self.column_file(column['name']), 'r+b')
+                self.files[column['name']].seek(0, 2)
+        else:
+            os.makedirs(path, exist_ok=True)
+    
+    def column_file(self, name):
+        # Function to give the file name of a column
+        return os.path.join(self.path, name+'.npy')
+    
+    def append(self, columns):
+        # Function to append a chunk of rows given as a dictionary of columns
+        if not self.files:
+            for name, column in columns.items():
+                dtype = np.asarray(column).dtype
+                if dtype.kind == 'U':
+                    dtype = np.dtype('U'+str(max(dtype.itemsize//4, 16)))
+                self.dtypes[name] = dtype
+                self.files[name] = open(self.column_file(name), 'w+b')
+                self.files[name].write(npy_header(dtype, 0))
+        if list(columns) != list(self.dtypes):
+            print('Columns do not match the data already in '+self.path)
+            return False
+        lengths = set(len(column) for column in columns.values())
+        if len(lengths) > 1:
+            print('Columns of different lengths cannot be saved together')
+            return False
+        for name, column in columns.items():
+            dtype = np.asarray(column).dtype
+            if (self.dtypes[name].kind == 'U' and dtype.kind == 'U' and
+                    dtype.itemsize > self.dtypes[name].itemsize):
+                self.widen(name, np.dtype('U'+str(max(dtype.itemsize,
+                                                      2*self.dtypes[name].itemsize)//4)))
+        for name, column in columns.items():
+            column = np.ascontiguousarray(column, dtype=self.dtypes[name])
+            self.files[name].write(column.tobytes())
+        self.rows += lengths.pop() if lengths else 0
+        return True
+    
+    def widen(self, name, dtype):
+        # Function to rewrite a text column with a wider type, a chunk of rows
+        # at a time, keeping the rows already written
+        filename = self.column_file(name)
+        size = self.dtypes[name].itemsize
+        column = self.files[name]
+        column.seek(COLUMN_HEADER_SIZE)
+        with open(filename+'.tmp', 'wb') as wider:
+            wider.write(npy_header(dtype, self.rows))
+            for start in range(0, self.rows, COLUMN_CHUNK_ROWS):
+                chunk = column.read(min(COLUMN_CHUNK_ROWS, self.rows-start)*size)
+                wider.write(np.frombuffer(chunk, dtype=self.dtypes[name])
+                            .astype(dtype).tobytes())
+        column.close()
+        os.replace(filename+'.tmp', filename)
+        self.files[name] = open(filename, 'r+b')
+        self.files[name].seek(0, 2)
+        print(f'Column {name} widened to {dtype.itemsize//4} characters')
+        self.dtypes[name] = dtype
+    
+    def close(self):
+        # Function to complete the headers and write the schema sidecar
+        for name, file in self.files.items():
+            file.seek(0)
+            file.write(npy_header(self.dtypes[name], self.rows))
+            file.close()
+        self.files = {}
+        schema = {'format': 'OSP_COLUMNS', 'version': 1, 'rows': self.rows,
+                  'columns': [{'name': name, 'dtype': dtype.str}
+                              for name, dtype in self.dtypes.items()],
+                  'attrs': self.attrs}
+        with open(os.path.join(self.path, 'schema.json'), 'w') as file:
+            json.dump(schema, file, indent=1)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def rows_to_columns(rows, names=None):
+    # Function to turn rows into a dictionary of typed columns, named by names
+    # and by position for any columns beyond them
+    names = list(names or [])
+    width = len(rows[0]) if rows else len(names)
+    names = names[:width] + ['column_'+str(index)
+                             for index in range(len(names), width)]
+    return {name: np.array(column) for name, column in zip(names, zip(*rows))}
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def columns_to_rows(columns):
+    # Function to turn a dictionary of columns into rows for save_data
+    return [list(row) for row in zip(*[column.tolist()
+                                       for column in columns.values()])]
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_columns(path, data, names=None, attrs=None):
+    # Function to write rows, or a dictionary of columns or a SoundingSet, to
+    # a column directory in chunks of COLUMN_CHUNK_ROWS rows
+    writer = Column_Writer(path, attrs)
+    if hasattr(data, 'items'):
+        data = dict(data.items())
+        length = len(next(iter(data.values()), []))
+        for start in range(0, max(length, 1), COLUMN_CHUNK_ROWS):
+            writer.append({name: column[start:start+COLUMN_CHUNK_ROWS]
+                           for name, column in data.items()})
+    else:
+        rows = iter(data)
+        while True:
+            chunk = list(itertools.islice(rows, COLUMN_CHUNK_ROWS))
+            if not chunk:
+                break
+            writer.append(rows_to_columns(chunk, names))
+    writer.close()
+    return writer.rows
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def export_csv(path, filename, names=None):
+    # Function to export the columns of a column directory to a csv file with
+    # a row of column names, in chunks of COLUMN_CHUNK_ROWS rows
+    columns = read_columns(path, names)
+    if not columns:
+        return False
+    length = read_schema(path)['rows']
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(list(columns))
+        for start in range(0, length, COLUMN_CHUNK_ROWS):
+            writer.writerows(columns_to_rows(
+                {name: column[start:start+COLUMN_CHUNK_ROWS]
+                 for name, column in columns.items()}))
+    return True
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def save_data(data, names=None, attrs=None):
+    # Function to save rows, or a dictionary of columns or a SoundingSet, as
+    # typed columns or as a csv export. Names label the columns of rows, attrs
+    # are stored in the schema sidecar of typed columns.
+    print('--------------------------------------------------')
+    print('Would you like to save this data?')
+    print('    - yes           (Save as typed columns in a directory)')
+    print('    - csv           (Export to a csv file)')
+    print('    - no')
+    selection = input('Type your selection here: ')
+    if selection == 'no':
+        print('You have elected not to save your data')
+        return
+    elif selection == 'yes':
+        filename = input('Enter a directory name: ')
+        rows = write_columns(filename, data, names, attrs)
+        print(str(rows)+' rows saved to '+filename)
+    elif selection == 'csv':
+        filename = input('Enter a file name: ')
+        if hasattr(data, 'items'):
+            data = columns_to_rows(dict(data.items()))
+        with open(filename, 'a', newline='') as file:
+            writer = csv.writer(file)
+            
+            writer.writerows(data)
+        print('Data saved to file.')
+    return
+#-----------------------------------------------------------------------------
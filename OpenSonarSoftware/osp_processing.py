@@ -0,0 +1,2413 @@
+##############################################################################
+############################################################################## 
+# Open Sonar Library - Processing
+##############################################################################
+##############################################################################
+# Created for the Open Sonar Project by:
+# Graham Christie, Isaac Fuller, Kara Sanford
+# January 2022
+#############################################
+# Version 5.0
+##############################################################################
+##############################################################################
+
+# Decoding raw logs and post processing their soundings, for Open Sonar
+# Processor and the live processing of Open Sonar Online. matplotlib is
+# imported by the functions that plot, so it is only loaded for a plot.
+
+import csv
+import os
+import io
+import itertools
+import time
+import multiprocessing
+import warnings
+import queue
+import sqlite3
+import tempfile
+import contextlib
+import tracemalloc
+import cProfile
+import pstats
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import datetime as dt
+import math
+
+from osp_io import (DAY_NS, CTD_COLUMNS, ECHO_SAMPLES, Log_Merger, columns_to_rows,
+                    datetime_to_ns, read_config_file, read_ctd_cast, read_echoes,
+                    read_log_body, read_manifest, save_data, STREAMED_PING_MODES)
+
+#########################################
+#########################################
+# NMEA Decoding
+#########################################
+#########################################
+
+# Field positions of the decoded records, counted from the sentence identifier
+# so the log time written in front of each sentence is not counted. Latitude
+# and longitude are followed by their hemisphere field.
+NMEA_SENTENCES = {
+    'GGA': {'utc': 1, 'latitude': 2, 'longitude': 4, 'quality': 6,
+            'satellites': 7, 'hdop': 8, 'altitude': 9, 'separation': 11},
+    'RMC': {'utc': 1, 'status': 2, 'latitude': 3, 'longitude': 5, 'speed': 7,
+            'course': 8, 'date': 9},
+    'GLL': {'latitude': 1, 'longitude': 3, 'utc': 5, 'status': 6},
+    'GSA': {'mode': 1, 'fix': 2, 'prn': 3, 'pdop': 15, 'hdop': 16, 'vdop': 17},
+    'GSV': {'messages': 1, 'message': 2, 'in_view': 3},
+    'DEPTH': {'distance': 1, 'confidence': 2, 'transmit_duration': 3,
+              'scan_start': 4, 'scan_length': 5, 'gain_setting': 6,
+              'soundspeed': 7},
+}
+
+# Fields that only some receivers write, NaN in records without them. The
+# GSA system id was added in NMEA 0183 version 4.10.
+NMEA_OPTIONAL_FIELDS = {
+    'GSA': {'system': 18},
+}
+
+# Fields holding a single character rather than a number
+NMEA_TEXT_FIELDS = ('status', 'mode')
+
+# Satellite systems counted in the GNSS quality series, with the talker ids
+# and NMEA 4.10 system ids that identify them
+GNSS_SYSTEMS = ('gps', 'glonass', 'galileo', 'beidou', 'qzss', 'navic')
+TALKER_SYSTEMS = {'GP': 0, 'GL': 1, 'GA': 2, 'GB': 3, 'BD': 3, 'GQ': 4, 'GI': 5}
+SYSTEM_IDS = {1: 0, 2: 1, 3: 2, 4: 3, 5: 4, 6: 5}
+
+# Columns of the rows from Raw_Log.extract_dop
+DOP_FIELDS = ['time', 'sentence', 'pdop', 'hdop', 'vdop']
+
+# Fields of the soundings from Raw_Log.extract_soundings, and the fields
+# Profile.correct_soundings adds to them
+SOUNDING_FIELDS = ['time', 'sounding_number', 'latitude', 'longitude',
+                   'ant_elip_height', 'heading', 'speed', 'hdop', 'fix_quality',
+                   'satellites', 'water_depth', 'bottom_elip_height',
+                   'soundspeed']
+CORRECTED_FIELDS = ['corrected_depth', 'corrected_bottom_height',
+                    'harmonic_soundspeed']
+
+# Fields Uncertainty_Model adds to soundings, after the corrected fields
+TPU_FIELDS = ['horizontal_tpu', 'vertical_tpu']
+
+# Field Raw_Log.extract_lines adds to soundings, after the uncertainty
+LINE_FIELDS = ['survey_line']
+
+# Field Heave_Filter adds to soundings, after the survey line
+HEAVE_FIELDS = ['heave']
+
+# Every field a sounding can have, in order
+PROCESSED_FIELDS = (SOUNDING_FIELDS + CORRECTED_FIELDS + TPU_FIELDS + LINE_FIELDS +
+                    HEAVE_FIELDS)
+
+# Horizontal and vertical GNSS position uncertainty in metres at a DOP of 1,
+# one standard deviation, for each GGA fix quality. Soundings with a fix
+# quality not listed have no uncertainty and are given NaN.
+GNSS_UNCERTAINTY = {1: (1.5, 3.0), 2: (0.5, 1.0), 3: (1.5, 3.0),
+                    4: (0.01, 0.02), 5: (0.2, 0.4), 6: (5.0, 10.0)}
+
+# Lookup table from character code to hexadecimal digit value, -1 if not a digit
+HEX_DIGITS = np.full(256, -1, dtype=np.int16)
+for _value, _digit in enumerate('0123456789ABCDEF'):
+    HEX_DIGITS[ord(_digit)] = _value
+    HEX_DIGITS[ord(_digit.lower())] = _value
+
+# Kinds of character found in numeric fields: invalid, digit, decimal point,
+# sign and separator, and what each kind adds to the per field counts of
+# digits, points and invalid characters
+CHARACTER_KINDS = np.zeros(256, dtype=np.uint8)
+CHARACTER_KINDS[ord('0'):ord('9')+1] = 1
+CHARACTER_KINDS[ord('.')] = 2
+CHARACTER_KINDS[[ord('-'), ord('+')]] = 3
+CHARACTER_KINDS[ord(' ')] = 4
+CHARACTER_COUNTS = np.array([1 << 16, 1, 1 << 8, 1 << 16, 0], dtype=np.int32)
+
+# Marker for times that are missing from a record
+NO_TIME = np.iinfo(np.int64).min
+
+# Longest gap between GGA records that streamed pings are interpolated across
+STREAM_GAP_NS = 2 * 1000000000
+
+#-----------------------------------------------------------------------------
+class NMEA_Decoder:
+# Class to decode the records of a raw log into columns of values. Every step
+# works on numpy arrays of the raw characters, so no Python code runs per
+# sentence and corrupted sentences are counted by the reason they failed.
+    def __init__(self):
+        self.rejected = {}
+        self.unsupported = 0
+
+    def reject(self, reason, mask):
+        # Function to keep count of records rejected for each reason
+        count = int(np.count_nonzero(mask))
+        if count:
+            self.rejected[reason] = self.rejected.get(reason, 0) + count
+
+    def decode(self, data):
+        # Function to decode the body of a raw log, given as bytes, into a
+        # dictionary of columns for each record type. Every record type has a
+        # 'line' column with the position of the record in the log, so records
+        # can be matched to their neighbours once corrupted lines are removed.
+        chars = np.frombuffer(data + b'\n' + bytes(32), dtype=np.uint8)
+        ends = np.flatnonzero(chars == 10)
+        starts = np.zeros(len(ends), dtype=np.int64)
+        starts[1:] = ends[:-1] + 1
+        ends = ends - (chars[ends-1] == 13)
+
+        dollars = np.flatnonzero(chars == 36)
+        line_of = np.searchsorted(ends, dollars)
+        first = np.ones(len(dollars), dtype=bool)
+        first[1:] = line_of[1:] != line_of[:-1]
+        dollars, line_of = dollars[first], line_of[first]
+        self.unsupported += int(np.count_nonzero(ends > starts)) - len(dollars)
+        self.stars = np.flatnonzero(chars == 42)
+        self.commas = np.flatnonzero(chars == 44)
+        
+        # Records of additional sensors have #name between the log time and
+        # the sentence. The sensor column of each record is the index of its
+        # name in sensors, 0 for the main sensors.
+        line_sensor = np.zeros(len(ends), dtype=np.int64)
+        self.sensors = ['']
+        comma = np.searchsorted(self.commas, starts[line_of])
+        comma = self.commas[np.minimum(comma, len(self.commas) - 1)] if len(self.commas) else dollars
+        tagged = (comma < dollars) & (chars[comma + 1] == 35)
+        # Log times end before the tag, or otherwise before the sentence
+        self.time_ends = np.zeros(len(ends), dtype=np.int64)
+        self.time_ends[line_of] = np.where(tagged, comma + 1, dollars)
+        if tagged.any():
+            names = [data[start + 2:data.index(b',', start + 2)].decode('ascii', 'replace')
+                     for start in comma[tagged].tolist()]
+            self.sensors += sorted(set(names))
+            number = {name: index for index, name in enumerate(self.sensors)}
+            line_sensor[line_of[tagged]] = [number[name] for name in names]
+
+        kinds = (chars[dollars+3].astype(np.int32) << 16) | \
+            (chars[dollars+4].astype(np.int32) << 8) | chars[dollars+5]
+        is_depth = (chars[dollars+1] == ord('D')) & (chars[dollars+2] == ord('E'))
+
+        records = {}
+        matched = np.zeros(len(dollars), dtype=bool)
+        for kind in NMEA_SENTENCES:
+            code = kind if kind != 'DEPTH' else 'PTH'
+            code = (ord(code[0]) << 16) | (ord(code[1]) << 8) | ord(code[2])
+            select = (kinds == code) & (is_depth == (kind == 'DEPTH'))
+            matched |= select
+            line = line_of[select]
+            records[kind] = self.decode_group(kind, chars, dollars[select],
+                                              starts[line], ends[line], line)
+            records[kind]['sensor'] = line_sensor[records[kind]['line']]
+        self.unsupported += int(np.count_nonzero(~matched))
+        return records
+
+    def decode_group(self, kind, chars, dollars, starts, ends, lines):
+        # Function to decode all the records of one type at once
+        keep = np.ones(len(dollars), dtype=bool)
+        body_ends = ends
+        if kind != 'DEPTH':
+            star = np.searchsorted(self.stars, ends) - 1
+            star = np.where(star >= 0, self.stars[np.maximum(star, 0)], -1) \
+                if len(self.stars) else np.full(len(ends), -1)
+            missing = star <= dollars
+            self.reject('missing_checksum', missing)
+            keep &= ~missing
+            body_ends = np.where(missing, ends, star)
+            bounds = np.empty(2*len(dollars), dtype=np.int64)
+            bounds[0::2] = dollars + 1
+            bounds[1::2] = body_ends
+            if len(bounds):
+                calculated = np.bitwise_xor.reduceat(chars, bounds)[0::2]
+                given = HEX_DIGITS[chars[star+1]]*16 + HEX_DIGITS[chars[star+2]]
+                given[(HEX_DIGITS[chars[star+1]] < 0) |
+                      (HEX_DIGITS[chars[star+2]] < 0)] = -1
+                bad_checksum = keep & (calculated != given)
+                self.reject('bad_checksum', bad_checksum)
+                keep &= ~bad_checksum
+
+        fields = NMEA_SENTENCES[kind]
+        width = max(fields.values()) + 1
+        first_comma = np.searchsorted(self.commas, dollars)
+        field_count = np.searchsorted(self.commas, body_ends) - first_comma + 1
+        short = keep & (field_count < width)
+        self.reject('short_sentence', short)
+        keep &= ~short
+
+        log_time, bad_time = parse_log_times(chars, starts, self.time_ends[lines])
+        bad_time &= keep
+        self.reject('bad_log_time', bad_time)
+        keep &= ~bad_time
+
+        dollars, body_ends = dollars[keep], body_ends[keep]
+        first_comma, field_count = first_comma[keep], field_count[keep]
+        columns = {'line': lines[keep], 'log_time': log_time[keep]}
+        if kind != 'DEPTH':
+            talker = np.stack([chars[dollars+1], chars[dollars+2]], axis=1)
+            columns['talker'] = talker.copy().view('S2').ravel().astype('U2')
+
+        def field_bounds(position):
+            # Fields beyond the end of a record are returned empty
+            absent = position >= field_count
+            field_starts = self.commas[np.minimum(first_comma + position - 1,
+                                                  len(self.commas) - 1)] + 1
+            last = position >= field_count - 1
+            field_ends = np.where(last, body_ends,
+                                  self.commas[np.minimum(first_comma + position,
+                                                         len(self.commas) - 1)])
+            return (np.where(absent, body_ends, field_starts),
+                    np.where(absent, body_ends, field_ends))
+
+        fields = dict(fields, **NMEA_OPTIONAL_FIELDS.get(kind, {}))
+
+        # All numeric fields of the group are parsed together in one call
+        numeric = [name for name in fields if name not in NMEA_TEXT_FIELDS]
+        bounds = [field_bounds(fields[name]) for name in numeric]
+        values, bad_values = parse_numbers(chars,
+                                           np.concatenate([start for start, end in bounds]),
+                                           np.concatenate([end for start, end in bounds]))
+        values = values.reshape(len(numeric), len(dollars))
+        bad = bad_values.reshape(len(numeric), len(dollars)).any(axis=0)
+
+        for name, position in fields.items():
+            if name in NMEA_TEXT_FIELDS:
+                columns[name] = parse_characters(chars, *field_bounds(position))
+                continue
+            column = values[numeric.index(name)]
+            if name == 'utc':
+                columns[name], bad_utc = hhmmss_to_ns(column)
+                bad |= bad_utc
+            elif name in ('latitude', 'longitude'):
+                hemispheres = parse_characters(chars, *field_bounds(position+1))
+                columns[name], bad_hemisphere = ddmm_to_degrees(column,
+                                                                hemispheres, name)
+                bad |= bad_hemisphere
+            else:
+                columns[name] = column
+
+        # GSA lists the satellites used in the solution in fields 3 to 14
+        if kind == 'GSA':
+            used = [np.subtract(*field_bounds(position)[::-1]) > 0
+                    for position in range(3, 15)]
+            columns['satellites_used'] = np.sum(used, axis=0)
+
+        self.reject('bad_value', bad)
+        for name in columns:
+            columns[name] = columns[name][~bad]
+        return columns
+
+    def report(self):
+        # Function to print the number of rejected records by reason
+        if not self.rejected:
+            print('All supported records passed decoding checks.')
+            return
+        print('Rejected records:')
+        for reason, count in sorted(self.rejected.items()):
+            print(f'    {reason}: {count}')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def parse_numbers(chars, starts, ends):
+    # Function to parse the decimal numbers between each start and end position
+    # of a character array. The fields are copied into one space separated
+    # buffer and checked character by character, then converted in a single
+    # call. Empty fields become NaN and fields that are not plain decimal
+    # numbers are flagged in the returned mask.
+    lengths = np.maximum(ends - starts, 0)
+    empty = lengths == 0
+    sizes = np.where(empty, 1, lengths) + 1
+    first = np.cumsum(sizes) - sizes
+    total = int(sizes.sum())
+    if total == 0:
+        return np.zeros(0), np.zeros(0, dtype=bool)
+
+    source = np.repeat(np.where(empty, 0, starts) - first, sizes) + np.arange(total)
+    text = chars[source]
+    text[first[empty]] = 48
+    text[first + sizes - 1] = 32
+
+    # Count digits, points and invalid characters per field in one pass. A
+    # sign is only valid as the first character of a field.
+    kind = CHARACTER_KINDS[text]
+    signed = first[kind[first] == 3]
+    kind[signed] = 4
+    counts = np.add.reduceat(CHARACTER_COUNTS[kind], first)
+    bad = ((counts & 255) == 0) | (((counts >> 8) & 255) > 1) | ((counts >> 16) > 0)
+    if bad.any():
+        text[np.repeat(bad, sizes) & (text != 32)] = 48
+
+    values = np.fromstring(text.tobytes(), dtype=np.float64, sep=' ')
+    values[empty | bad] = np.nan
+    return values, bad
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def parse_characters(chars, starts, ends):
+    # Function to read single character fields, with '' for empty fields
+    single = np.where(ends - starts == 1, chars[starts], 0).astype(np.uint8)
+    return single.view('S1').astype('U1')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def parse_log_times(chars, starts, dollars):
+    # Function to convert the HH:MM:SS or HH:MM:SS.ffffff log times written in
+    # front of each record to nanoseconds since midnight. The dollars are the
+    # positions just after the comma that ends each log time.
+    lengths = dollars - 1 - starts
+    codes = sliding_window_view(chars, 15)[starts].astype(np.int64) - 48
+    digits = codes[:, [0, 1, 3, 4, 6, 7]]
+    fraction = np.where(lengths[:, None] == 15, codes[:, 9:15], 0)
+    bad = (lengths != 8) & (lengths != 15)
+    bad |= chars[dollars-1] != 44
+    bad |= ((digits < 0) | (digits > 9)).any(axis=1)
+    bad |= ((fraction < 0) | (fraction > 9)).any(axis=1)
+    bad |= (codes[:, 2] != 10) | (codes[:, 5] != 10)
+    bad |= (lengths == 15) & (codes[:, 8] != -2)
+    hours = digits[:, 0]*10 + digits[:, 1]
+    minutes = digits[:, 2]*10 + digits[:, 3]
+    seconds = digits[:, 4]*10 + digits[:, 5]
+    bad |= (hours >= 24) | (minutes >= 60) | (seconds >= 61)
+    microseconds = fraction @ np.array([100000, 10000, 1000, 100, 10, 1])
+    ns = ((hours*60 + minutes)*60 + seconds)*1000000000 + microseconds*1000
+    ns[bad] = NO_TIME
+    return ns, bad
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def hhmmss_to_ns(values):
+    # Function to convert hhmmss.ss times to nanoseconds since midnight. Empty
+    # times are returned as NO_TIME and impossible times are flagged.
+    hours = np.floor(values / 10000)
+    minutes = np.floor(values / 100) - hours*100
+    seconds = values - hours*10000 - minutes*100
+    missing = np.isnan(values)
+    bad = ~missing & ((hours >= 24) | (minutes >= 60) | (seconds >= 61) | (values < 0))
+    microseconds = np.round((hours*3600 + minutes*60 + seconds) * 1e6)
+    microseconds[missing | bad] = 0
+    ns = microseconds.astype(np.int64) * 1000
+    ns[missing | bad] = NO_TIME
+    return ns, bad
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def ddmm_to_degrees(values, hemispheres, name):
+    # Function to convert ddmm.mmmm or dddmm.mmmm coordinates to signed decimal
+    # degrees using their hemisphere field. Values given without a valid
+    # hemisphere are flagged.
+    if name == 'latitude':
+        positive, negative = 'N', 'S'
+    else:
+        positive, negative = 'E', 'W'
+    degrees = np.floor(values / 100)
+    decimal = degrees + (values - degrees*100) / 60
+    decimal[hemispheres == negative] *= -1
+    unknown = (hemispheres != positive) & (hemispheres != negative)
+    bad = unknown & ~np.isnan(values)
+    decimal[unknown] = np.nan
+    return decimal, bad
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def survey_day_ns(metadata):
+    # Function to get midnight UTC of the survey date from the metadata, in
+    # nanoseconds since the epoch
+    date = metadata['Survey'][2]
+    if not isinstance(date, dt.datetime):
+        date = dt.datetime.fromisoformat(str(date).strip())
+    return int(np.datetime64(date.date(), 'ns').astype(np.int64))
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def ddmmyy_to_ns(values):
+    # Function to convert ddmmyy RMC dates to midnight of that day in
+    # nanoseconds since the epoch, NO_TIME where missing or impossible
+    valid = ~np.isnan(values)
+    dates = np.where(valid, values, 10100).astype(np.int64)
+    day, month, year = dates // 10000, dates // 100 % 100, dates % 100
+    valid &= (day >= 1) & (day <= 31) & (month >= 1) & (month <= 12)
+    day, month = np.where(valid, day, 1), np.where(valid, month, 1)
+    months = (np.datetime64('2000', 'Y') + year).astype('datetime64[M]') + (month - 1)
+    days = months.astype('datetime64[D]') + (day - 1)
+    ns = days.astype('datetime64[ns]').astype(np.int64)
+    ns[~valid] = NO_TIME
+    return ns
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def assign_epoch_times(records, metadata):
+    # Function to turn the times of day of decoded records into absolute times
+    # in nanoseconds since the epoch. Log times are read in log order and a new
+    # day is started whenever the time of day jumps back by more than half a
+    # day. The first day is the survey date, corrected to the date of the first
+    # RMC sentence if there is one. GNSS times are then placed on the day that
+    # brings them closest to the log time they were recorded at.
+    kinds = list(records)
+    lines = np.concatenate([records[kind]['line'] for kind in kinds])
+    log_time = np.concatenate([records[kind]['log_time'] for kind in kinds])
+    order = np.argsort(lines, kind='stable')
+    days = np.zeros(len(lines), dtype=np.int64)
+    days[order[1:]] = np.cumsum(np.diff(log_time[order]) < -DAY_NS//2)
+    epoch = survey_day_ns(metadata) + days*DAY_NS + log_time
+
+    offsets = np.cumsum([0] + [len(records[kind]['line']) for kind in kinds])
+    rmc = records['RMC']
+    rmc_days = ddmmyy_to_ns(rmc['date'])
+    dated = np.flatnonzero((rmc_days != NO_TIME) & (rmc['utc'] != NO_TIME))
+    if len(dated):
+        first = dated[np.argmin(rmc['line'][dated])]
+        rmc_epoch = rmc_days[first] + rmc['utc'][first]
+        shift = (rmc_epoch - epoch[offsets[kinds.index('RMC')] + first] + DAY_NS//2) // DAY_NS
+        epoch += shift*DAY_NS
+
+    for kind, start, end in zip(kinds, offsets[:-1], offsets[1:]):
+        columns = records[kind]
+        columns['log_time'] = epoch[start:end]
+        if 'utc' not in columns:
+            continue
+        utc = columns['utc']
+        missing = utc == NO_TIME
+        day = (columns['log_time'] - utc + DAY_NS//2) // DAY_NS
+        columns['utc'] = np.where(missing, NO_TIME, day*DAY_NS + utc)
+    return records
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def previous_values(records, name, lines):
+    # Function to take a column value from the last record of a decoded group
+    # logged before each of the given line numbers, NaN where there is none
+    index = np.searchsorted(records['line'], lines) - 1
+    found = index >= 0
+    values = np.full(len(lines), np.nan)
+    values[found] = records[name][index[found]]
+    return values
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def bracket_records(records, times, max_gap):
+    # Function to find the records logged either side of each time, and the
+    # fraction of the way from the first to the second. Times without records
+    # on both sides less than max_gap nanoseconds apart are not found.
+    log_time = records['log_time']
+    after = np.searchsorted(log_time, times, side='right')
+    found = (after > 0) & (after < len(log_time))
+    after = np.minimum(after, len(log_time) - 1)
+    before = np.maximum(after - 1, 0)
+    gap = log_time[after] - log_time[before] if len(log_time) else after
+    found &= (gap > 0) & (gap < max_gap)
+    fraction = np.where(found, (times - log_time[before])/np.maximum(gap, 1), 0)
+    return before, after, fraction, found
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def gnss_systems(records):
+    # Function to find the satellite system of each GSA or GSV record, as an
+    # index into GNSS_SYSTEMS or -1 if unknown. The NMEA 4.10 system id is used
+    # first, then the talker id, then for combined GN sentences the number of
+    # the first satellite listed.
+    systems = np.full(len(records['line']), -1)
+    for talker, system in TALKER_SYSTEMS.items():
+        systems[records['talker'] == talker] = system
+    if 'prn' in records:
+        prn = records['prn']
+        combined = systems < 0
+        systems[combined & (prn >= 1) & (prn <= 64)] = 0
+        systems[combined & (prn >= 65) & (prn <= 96)] = 1
+    if 'system' in records:
+        for system_id, system in SYSTEM_IDS.items():
+            systems[records['system'] == system_id] = system
+    return systems
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def time_index(times, targets):
+    # Function to find the position in times of each target time, -1 where no
+    # time matches exactly
+    times = np.asarray(times)
+    order = np.argsort(times, kind='stable')
+    sorted_times = times[order]
+    index = np.minimum(np.searchsorted(sorted_times, targets), len(order) - 1)
+    positions = np.full(len(targets), -1)
+    if len(order):
+        found = sorted_times[index] == targets
+        positions[found] = order[index[found]]
+    return positions
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def values_at_times(series, name, times):
+    # Function to take a column value from the row of a time series with
+    # exactly the given time, NaN where there is none
+    index = time_index(series['time'], times)
+    values = np.full(len(times), np.nan)
+    values[index >= 0] = series[name][index[index >= 0]]
+    return values
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def values_before_times(series, name, times):
+    # Function to take a column value from the last row of a time series at
+    # or before each time, NaN before the first row
+    index = np.searchsorted(series['time'], times, side='right') - 1
+    values = np.full(len(times), np.nan)
+    values[index >= 0] = series[name][index[index >= 0]]
+    return values
+#-----------------------------------------------------------------------------
+
+#########################################
+#########################################
+# Post processing applications
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+class Profile:
+# Class to manage soundspeed profiles and their application
+    def __init__(self, svp_filename):
+        self.svp_filename = svp_filename
+        
+    def read_simple_svp(self):
+        # Function to read a simple svp into the class
+        lines = []        
+        with open(self.svp_filename) as file:
+            csv_reader = csv.reader(file)
+            for row in csv_reader:
+                lines.append(row)
+        self.depths_list = []
+        self.speeds_list = []
+        for item in lines:
+            depth = item[0]
+            speed = item[1]
+            try:
+                depth = float(depth)
+                speed = float(speed)
+                self.depths_list.append(depth)
+                self.speeds_list.append(speed)
+            except:
+                pass
+        return self.depths_list, self.speeds_list
+    
+    def read_ctd_cast(self, latitude, bin_size=0.5, equation='chen_millero'):
+        # Function to read a raw CTD cast into the class, reduced to the mean
+        # sound speed in depth bins of its downcast by Ctd_Cast
+        cast = Ctd_Cast(self.svp_filename, latitude)
+        depths, speeds = cast.bin_profile(bin_size, equation)
+        self.depths_list = depths.tolist()
+        self.speeds_list = speeds.tolist()
+        return self.depths_list, self.speeds_list
+    
+    def calculate_harmonic_mean(self):
+        # Function to calculate hmss using layers of constant gradient
+        surface_soundspeed = round(self.speeds_list[0],1)
+        
+        last_depth = 0
+        last_speed = surface_soundspeed
+        time_sum = 0
+        delta_depth_sum = 0
+        
+        self.harmonic_mean_list = []
+        
+        count = 0
+        
+        while count <= (len(self.depths_list)-1):
+            delta_speed = self.speeds_list[count] - last_speed
+            delta_depth = self.depths_list[count] - last_depth
+            
+            if delta_speed == 0:
+                # A layer without a gradient is crossed at its one speed
+                time = delta_depth/last_speed
+            else:
+                g = delta_speed/delta_depth
+                time = (1/g) * (np.log(self.speeds_list[count]/last_speed))
+            
+            time_sum = time_sum + time
+            delta_depth_sum = delta_depth_sum + delta_depth
+            harmonic_mean = delta_depth_sum/time_sum
+            self.harmonic_mean_list.append(harmonic_mean)
+            
+            last_depth = self.depths_list[count]
+            last_speed = self.speeds_list[count]
+            count += 1
+        
+        return self.harmonic_mean_list
+    
+    def correct_soundings(self, soundings):
+        # Function to add the corrected depth, corrected bottom height and
+        # harmonic mean sound speed to a SoundingSet. Any uncertainty found
+        # before is removed, as it depends on the depths being corrected.
+        new_depths, new_speeds = self.correct_depths(soundings['water_depth'],
+                                                     soundings['soundspeed'])
+        diff = new_depths - soundings['water_depth']
+        corrected = {'corrected_depth': np.round(new_depths, 3),
+                     'corrected_bottom_height': np.round(soundings['bottom_elip_height']+diff, 3),
+                     'harmonic_soundspeed': np.round(new_speeds, 3)}
+        for name in TPU_FIELDS:
+            soundings.pop(name)
+        corrected_soundings = soundings.update(corrected)
+    
+        return corrected_soundings
+    
+    def correct_depths(self, depths, soundspeeds):
+        # Function to change depths measured at the given sound speeds to the
+        # harmonic mean sound speed at their depth, for whole arrays at once.
+        # Depths are looked up in the profile by size, as soundings are
+        # negative below the water line, and depths past either end of the
+        # profile take the harmonic mean at that end.
+        depths = np.asarray(depths, dtype=np.float64)
+        travel_time = depths/np.asarray(soundspeeds, dtype=np.float64)
+        new_soundspeed = np.interp(np.abs(depths), self.depths_list,
+                                   self.harmonic_mean_list)
+        return new_soundspeed*travel_time, new_soundspeed
+    
+    def correct_soundspeed(self, original_depth, original_soundspeed):
+        # Function to take a depth ping and soundspeed and change to new soundspeed
+        new_depth, new_soundspeed = self.correct_depths(original_depth,
+                                                        original_soundspeed)
+        return float(new_depth), float(new_soundspeed)
+    
+    def plot_hmss(self):
+        # Function to plot profile and harmonic mean sound speed
+        import matplotlib.pyplot as plt
+        plt.plot(self.speeds_list, self.depths_list, color='turquoise', 
+                 linewidth=3, linestyle='solid', label="Observed")
+        plt.plot(self.harmonic_mean_list, self.depths_list, color='red', 
+                 linewidth=3, linestyle='solid', label="Harmonic Mean")
+        plt.axis([min(self.speeds_list)-0.05, max(self.speeds_list)+0.05, 
+                  max(self.depths_list)+0.5, min(self.depths_list)-0.5])
+        plt.title("Harmonic Mean Sound Speed vs Depth")
+        plt.xlabel("Sound Speed [m/s]")
+        plt.ylabel("Depth [m]")
+        plt.legend()
+        plt.gcf().set_dpi(300)
+        plt.grid()
+        plt.show()
+        
+        return
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def chen_millero(temperature, salinity, pressure):
+    # Function to calculate sound speed in m/s from temperature in degrees C,
+    # salinity in PSU and pressure in dbar with the UNESCO equation of Chen
+    # and Millero (1977), as given by Fofonoff and Millard (1983)
+    T = np.asarray(temperature, dtype=np.float64)
+    S = np.asarray(salinity, dtype=np.float64)
+    P = np.asarray(pressure, dtype=np.float64)/10
+    
+    D = 1.727e-3 - 7.9836e-6*P
+    B1 = 7.3637e-5 + 1.7945e-7*T
+    B0 = -1.922e-2 - 4.42e-5*T
+    B = B0 + B1*P
+    A3 = (-3.389e-13*T + 6.649e-12)*T + 1.100e-10
+    A2 = ((7.988e-12*T - 1.6002e-10)*T + 9.1041e-9)*T - 3.9064e-7
+    A1 = (((-2.0122e-10*T + 1.0507e-8)*T - 6.4885e-8)*T - 1.2580e-5)*T + 9.4742e-5
+    A0 = (((-3.21e-8*T + 2.006e-6)*T + 7.164e-5)*T - 1.262e-2)*T + 1.389
+    A = ((A3*P + A2)*P + A1)*P + A0
+    C3 = (-2.3643e-12*T + 3.8504e-10)*T - 9.7729e-9
+    C2 = (((1.0405e-12*T - 2.5335e-10)*T + 2.5974e-8)*T - 1.7107e-6)*T + 3.1260e-5
+    C1 = (((-6.1185e-10*T + 1.3621e-7)*T - 8.1788e-6)*T + 6.8982e-4)*T + 0.153563
+    C0 = ((((3.1464e-9*T - 1.47800e-6)*T + 3.3420e-4)*T - 5.80852e-2)*T + 5.03711)*T + 1402.388
+    C = ((C3*P + C2)*P + C1)*P + C0
+    return C + (A + B*np.sqrt(np.abs(S)) + D*S)*S
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def del_grosso(temperature, salinity, pressure):
+    # Function to calculate sound speed in m/s from temperature in degrees C,
+    # salinity in PSU and pressure in dbar with the NRL II equation of Del
+    # Grosso (1974), which takes gauge pressure in kg/cm2
+    T = np.asarray(temperature, dtype=np.float64)
+    S = np.asarray(salinity, dtype=np.float64)
+    P = np.asarray(pressure, dtype=np.float64)*1.019716/10
+    
+    dct = (5.01109398873 - (0.0550946843172 - 0.000221535969240*T)*T)*T
+    dcs = (1.32952290781 + 0.000128955756844*S)*S
+    dcp = (0.156059257041 + (0.0000244998688441 - 0.00000000883392332513*P)*P)*P
+    dcstp = (-0.0127562783426*T*S + 0.00635191613389*T*P
+             + 0.0000000265484716608*T*T*P*P - 0.00000159349479045*T*P*P
+             + 0.000000000522116437235*T*P*P*P - 0.000000438031096213*T*T*T*P
+             - 0.00000000161674495909*S*S*P*P + 0.0000968403156410*T*T*S
+             + 0.00000485639620015*T*S*S*P - 0.000340597039004*T*S*P)
+    return 1402.392 + dct + dcs + dcp + dcstp
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def pressure_to_depth(pressure, latitude):
+    # Function to convert pressure in dbar to depth in metres at a latitude
+    # in degrees, for standard ocean water, from Fofonoff and Millard (1983)
+    P = np.asarray(pressure, dtype=np.float64)
+    X = np.sin(np.radians(latitude))**2
+    gravity = 9.780318*(1.0 + (5.2788e-3 + 2.36e-5*X)*X) + 1.092e-6*P
+    return (((-1.82e-15*P + 2.279e-10)*P - 2.2512e-5)*P + 9.72659)*P/gravity
+#-----------------------------------------------------------------------------
+
+# Sound speed equations Ctd_Cast can use, by name
+SOUND_SPEED_EQUATIONS = {'chen_millero': chen_millero, 'del_grosso': del_grosso}
+
+#-----------------------------------------------------------------------------
+class Ctd_Cast:
+# Class to reduce a raw CTD cast to a sound speed profile for Profile. The
+# downcast is separated from the soak at the surface and the upcast, sound
+# speed is calculated for every sample at once, and samples are averaged in
+# depth bins.
+    def __init__(self, ctd_filename, latitude):
+        self.ctd_filename = ctd_filename
+        self.latitude = latitude
+        self.samples = read_ctd_cast(ctd_filename) or {
+            column: np.empty(0) for column in CTD_COLUMNS}
+        
+    def downcast(self):
+        # Function to flag the samples of the downcast. It ends at the deepest
+        # sample, and only samples deeper than every one before them are
+        # kept, so the cast is monotonic where the CTD was lifted by the swell
+        pressure = np.where(np.isnan(self.samples['pressure']), -np.inf,
+                            self.samples['pressure'])
+        down = np.zeros(len(pressure), dtype=bool)
+        if len(pressure) == 0:
+            return down
+        deepest = int(np.argmax(pressure))
+        before = np.maximum.accumulate(pressure[:deepest+1])
+        down[1:deepest+1] = pressure[1:deepest+1] > before[:-1]
+        down[0] = np.isfinite(pressure[0])
+        valid = np.isfinite(self.samples['temperature']) & np.isfinite(self.samples['salinity'])
+        return down & valid & (pressure >= 0)
+    
+    def bin_profile(self, bin_size=0.5, equation='chen_millero'):
+        # Function to return the mean depth and sound speed of the downcast
+        # samples in each depth bin, leaving out empty bins
+        down = self.downcast()
+        samples = {name: column[down] for name, column in self.samples.items()}
+        depth = pressure_to_depth(samples['pressure'], self.latitude)
+        speed = SOUND_SPEED_EQUATIONS[equation](samples['temperature'],
+                                                samples['salinity'],
+                                                samples['pressure'])
+        bins = np.floor(depth/bin_size).astype(np.int64)
+        count = np.bincount(bins)
+        filled = count > 0
+        depths = np.bincount(bins, depth)[filled]/count[filled]
+        speeds = np.bincount(bins, speed)[filled]/count[filled]
+        print(f'{int(down.sum())} of {len(down)} samples in the downcast, '
+              f'{len(depths)} bins to {depths[-1] if len(depths) else 0:.1f} m')
+        return depths, speeds
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Raw_Log:
+# Class to manage raw log processing. A list of raw logs can be given with the
+# Log_Merger that checked their headers, so they are not read again.
+    def __init__(self, raw_log_filename, merger=None):
+        self.raw_log_filename = raw_log_filename
+        self.merger = merger
+        
+    def read_raw_log(self, processes=None):
+        # Function to read a raw log file and decode its sentences into columns.
+        # A manifest from Log_Rotator is read as one log, with its segments
+        # decoded in worker processes and joined in order. A list of raw logs
+        # is merged into one in time order by Log_Merger into a temporary
+        # file, and decoded from it in chunks. Records of the main
+        # sensors are kept in records, and those of additional sensors in
+        # sensor_records by sensor name. None is returned for the metadata
+        # and records when there is no log to read.
+        if isinstance(self.raw_log_filename, list):
+            merger = self.merger or Log_Merger(self.raw_log_filename)
+            self.metadata = merger.metadata
+            with tempfile.TemporaryFile() as merged:
+                for line in merger.lines():
+                    merged.write(line.encode())
+                merger.report()
+                merged.seek(0)
+                results = [decode_log(None, body) for body in read_chunks(merged)]
+        else:
+            if self.raw_log_filename.endswith('.json'):
+                segments = read_manifest(self.raw_log_filename)
+            else:
+                segments = [self.raw_log_filename]
+            if not segments:
+                print('No raw log segments to read in '+self.raw_log_filename)
+                return None, None
+            self.metadata = read_config_file(segments[0])
+            if self.metadata is None:
+                return None, None
+            pool = process_pool(min(processes or os.cpu_count() or 1, len(segments)))
+            if pool is None:
+                results = [decode_log(segment) for segment in segments]
+            else:
+                with pool:
+                    results = pool.map(decode_log, segments)
+        self.decoder = NMEA_Decoder()
+        self.sensors = ['']
+        parts = []
+        offset = 0
+        for records, rejected, unsupported, lines, sensors in results:
+            for name in sensors:
+                if name not in self.sensors:
+                    self.sensors.append(name)
+            number = np.array([self.sensors.index(name) for name in sensors])
+            for kind in records:
+                records[kind]['line'] = records[kind]['line'] + offset
+                records[kind]['sensor'] = number[records[kind]['sensor']]
+            parts.append(records)
+            offset += lines
+            for reason, count in rejected.items():
+                self.decoder.rejected[reason] = self.decoder.rejected.get(reason, 0) + count
+            self.decoder.unsupported += unsupported
+        self.records = {kind: {name: np.concatenate([part[kind][name] for part in parts])
+                               for name in parts[0][kind]}
+                        for kind in parts[0]}
+        self.decoder.report()
+        self.records = assign_epoch_times(self.records, self.metadata)
+        self.sensor_records = {}
+        if len(self.sensors) > 1:
+            print('Records from additional sensors: '+', '.join(self.sensors[1:]))
+            self.sensor_records = {name: select_sensor(self.records, index)
+                                   for index, name in enumerate(self.sensors) if name}
+            self.records = select_sensor(self.records, 0)
+        
+        return self.metadata, self.records
+    
+    def extract_dop(self):
+        #Function to extract dop values from the first GSA message of each epoch
+        gsa = self.records['GSA']
+        first = np.ones(len(gsa['line']), dtype=bool)
+        first[1:] = np.diff(gsa['line']) != 1
+        
+        pings = ['$'+talker+'GSA' for talker in gsa['talker'][first]]
+        dop_log = [list(row) for row in zip(gsa['log_time'][first].tolist(), pings, 
+                                            gsa['pdop'][first].tolist(),
+                                            gsa['hdop'][first].tolist(),
+                                            gsa['vdop'][first].tolist())]
+        return dop_log
+        
+    def extract_soundings(self, metadata, sensor=None):
+        # Function to extract soundings from RMC, GGA and DEPTH records as a
+        # SoundingSet of SOUNDING_FIELDS, from the main sonar or the
+        # additional sonar named
+        print(metadata)
+        columns, lines = self.locate_soundings(metadata, sensor)
+        sounding_log = SoundingSet({name: columns[name] for name in SOUNDING_FIELDS})
+        return sounding_log
+    
+    def locate_soundings(self, metadata, sensor=None):
+        # Function to find the soundings in the RMC, GGA and DEPTH records as
+        # columns of SOUNDING_FIELDS, with the log line of each sounding. Each
+        # DEPTH record logged directly after a GGA sentence is a sounding, with
+        # heading and speed from the most recent RMC sentence. Streamed and
+        # free run pings are not triggered by GNSS sentences, so every DEPTH
+        # record is a sounding positioned between the GGA records logged
+        # around it.
+        # Additional sonars always stream, and are named by sensor. With a
+        # latency in the configuration, pings are taken to have been made
+        # that many seconds before they were logged, and are positioned
+        # between GGA records at that time in every ping mode.
+        ant_off = metadata['GNSS'][2]
+        sonar_off = metadata['Sonar'][2]
+        
+        gga = self.records['GGA']
+        rmc = self.records['RMC']
+        depth = self.records['DEPTH']
+        if sensor:
+            depth = self.sensor_records[sensor]['DEPTH']
+            sonar_off = [row[4] for row in metadata['Sensors'] if row[0] == sensor][0]
+        gga_time = np.where(gga['utc'] == NO_TIME, gga['log_time'], gga['utc'])
+        latency = int(round(metadata['Latency'][0]*1e9))
+        
+        if metadata['Ping_Mode'][0] in STREAMED_PING_MODES or sensor or latency:
+            ping_time = depth['log_time'] - latency
+            index, after, fraction, found = bracket_records(gga, ping_time,
+                                                            STREAM_GAP_NS)
+            index, after, fraction = index[found], after[found], fraction[found]
+            depth = {name: column[found] for name, column in depth.items()}
+            ping_time = ping_time[found]
+            def at_pings(name):
+                return gga[name][index] + fraction*(gga[name][after] - gga[name][index])
+            latitude = at_pings('latitude')
+            longitude = at_pings('longitude')
+            ant_elip_height = at_pings('altitude') + at_pings('separation')
+            time = gga_time[index] + (ping_time - gga['log_time'][index])
+        else:
+            index = np.searchsorted(gga['line'], depth['line'] - 1)
+            found = index < len(gga['line'])
+            found[found] = gga['line'][index[found]] == depth['line'][found] - 1
+            index = index[found]
+            depth = {name: column[found] for name, column in depth.items()}
+            latitude = gga['latitude'][index]
+            longitude = gga['longitude'][index]
+            ant_elip_height = gga['altitude'][index] + gga['separation'][index]
+            time = gga_time[index]
+
+        hdg = previous_values(rmc, 'course', depth['line'])
+        speed = previous_values(rmc, 'speed', depth['line'])
+        
+        ant_elip_height = np.round(ant_elip_height, 3)
+        water_depth = -depth['distance'] + sonar_off
+        bottom_elip_height = ant_elip_height - ant_off + water_depth
+        
+        columns = dict(zip(SOUNDING_FIELDS, (
+            time, np.arange(len(index)), latitude, longitude, ant_elip_height,
+            hdg, speed, gga['hdop'][index], gga['quality'][index],
+            gga['satellites'][index], water_depth, bottom_elip_height,
+            depth['soundspeed'])))
+        # Scan length is logged in millimetres, and sets the sonar's range
+        # resolution for Uncertainty_Model
+        columns['scan_length'] = depth['scan_length']/1000
+        return columns, depth['line']
+    
+    def extract_gnss_quality(self):
+        # Function to build a GNSS quality time series with one row per GGA
+        # epoch. GSA and GSV records count towards the epoch of the GGA logged
+        # before them. DOPs and fix type come from the first GSA of the epoch,
+        # satellites used and in view are counted for each satellite system.
+        gga = self.records['GGA']
+        gsa = self.records['GSA']
+        gsv = self.records['GSV']
+        epochs = len(gga['line'])
+        
+        quality = {'time': np.where(gga['utc'] == NO_TIME, gga['log_time'],
+                                    gga['utc']),
+                   'fix_quality': gga['quality'],
+                   'satellites': gga['satellites'],
+                   'hdop': gga['hdop']}
+        
+        epoch = np.searchsorted(gga['line'], gsa['line']) - 1
+        found = epoch >= 0
+        epoch_of, first = np.unique(epoch[found], return_index=True)
+        for name, column in (('pdop', 'pdop'), ('vdop', 'vdop'),
+                             ('fix_type', 'fix')):
+            quality[name] = np.full(epochs, np.nan)
+            quality[name][epoch_of] = gsa[column][found][first]
+        
+        system = gnss_systems(gsa)
+        keep = found & (system >= 0)
+        used = np.zeros((epochs, len(GNSS_SYSTEMS)), dtype=np.int64)
+        np.add.at(used, (epoch[keep], system[keep]), gsa['satellites_used'][keep])
+        
+        epoch = np.searchsorted(gga['line'], gsv['line']) - 1
+        system = gnss_systems(gsv)
+        keep = (epoch >= 0) & (system >= 0) & ~np.isnan(gsv['in_view'])
+        in_view = np.zeros((epochs, len(GNSS_SYSTEMS)), dtype=np.int64)
+        np.maximum.at(in_view, (epoch[keep], system[keep]),
+                      gsv['in_view'][keep].astype(np.int64))
+        
+        quality['satellites_used'] = used.sum(axis=1)
+        for index, name in enumerate(GNSS_SYSTEMS):
+            quality['used_'+name] = used[:, index]
+        for index, name in enumerate(GNSS_SYSTEMS):
+            quality['in_view_'+name] = in_view[:, index]
+        return quality
+    
+    def extract_uncertainty(self, metadata, soundings, quality=None,
+                            profile=None, sensor=None):
+        # Function to add the horizontal and vertical uncertainty to each
+        # sounding from Uncertainty_Model. VDOP comes from the GNSS
+        # quality series at the epoch of each sounding, and the scan length
+        # from the ping of each sounding, found again by its sounding number,
+        # so soundings already removed by the quality gate are not needed.
+        # Uncorrected soundings take the harmonic mean from the profile given.
+        if quality is None:
+            quality = self.extract_gnss_quality()
+        columns = soundings
+        located, lines = self.locate_soundings(metadata, sensor)
+        scan_length = located['scan_length'][columns['sounding_number'].astype(np.int64)]
+        vdop = values_before_times(quality, 'vdop', columns['time'])
+        harmonic = None
+        if profile is not None:
+            harmonic = profile.correct_depths(columns['water_depth'],
+                                              columns['soundspeed'])[1]
+        model = Uncertainty_Model(metadata)
+        horizontal, vertical = model.propagate(columns, vdop, scan_length, harmonic)
+        model.report()
+        return model.apply(soundings, horizontal, vertical)
+    
+    def extract_lines(self, metadata, soundings=None):
+        # Function to split the RMC track into survey lines with
+        # Line_Segmenter and the thresholds of the Line_Segmentation row,
+        # returning the track as a time series of its line numbers. Soundings
+        # given are labelled with the line of the track at their time.
+        rmc = self.records['RMC']
+        track = {'time': np.where(rmc['utc'] == NO_TIME, rmc['log_time'], rmc['utc'])}
+        segmenter = Line_Segmenter(*metadata['Line_Segmentation'])
+        track['survey_line'] = segmenter.segment(track['time'], rmc['latitude'],
+                                                 rmc['longitude'], rmc['course'],
+                                                 rmc['speed'])
+        segmenter.report(track['time'], track['survey_line'])
+        if soundings is not None:
+            lines = values_before_times(track, 'survey_line', soundings['time'])
+            soundings['survey_line'] = np.nan_to_num(lines)
+        return track
+    
+    def extract_echo_index(self, echoes):
+        # Function to find the echo record of each DEPTH record by time, -1
+        # for pings logged without an echo profile. Both times come from the
+        # same clock reading, but the log only records its time of day and
+        # takes the date from the survey, so times of day are matched.
+        return time_index(echoes['time'] % DAY_NS,
+                          self.records['DEPTH']['log_time'] % DAY_NS)
+    
+    def apply_bottom_picks(self, echoes, distance, confidence):
+        # Function to replace the sonar's bottom pick in the DEPTH records with
+        # picks made from the echo profiles, given in millimetres for each
+        # echo record like Bottom_Detector makes them. Pings without an echo
+        # profile keep the sonar's pick, pings where no bottom was picked are
+        # removed. The sonar's pick is kept as firmware_distance.
+        depth = self.records['DEPTH']
+        index = self.extract_echo_index(echoes)
+        linked = index >= 0
+        keep = ~linked
+        keep[linked] = ~np.isnan(distance[index[linked]])
+        
+        depth['firmware_distance'] = depth['distance'].copy()
+        depth['distance'][linked] = distance[index[linked]]/1000
+        depth['confidence'][linked] = confidence[index[linked]]
+        self.records['DEPTH'] = {name: column[keep] for name, column in depth.items()}
+        print(f'{int(linked.sum())} pings re-picked, {int((~keep).sum())} without a bottom removed')
+        return self.records
+    
+#-----------------------------------------------------------------------------
+
+# Bytes of a merged log decoded at a time, so the merged text is never held
+# in memory whole
+DECODE_CHUNK_BYTES = 64 * 1024 * 1024
+
+#-----------------------------------------------------------------------------
+def read_chunks(file, size=DECODE_CHUNK_BYTES):
+    # Function to read a file in chunks of about size bytes, each ending at
+    # the end of a line
+    carry = b''
+    while True:
+        data = file.read(size)
+        if not data:
+            if carry:
+                yield carry
+            return
+        data = carry + data
+        end = data.rfind(b'\n') + 1
+        carry = data[end:]
+        if end:
+            yield data[:end]
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def decode_log(filename, body=None):
+    # Function to decode one raw log for Raw_Log, or the body of one given,
+    # returning the records, the rejected and unsupported counts, and the
+    # number of lines so the line numbers of later segments can follow on
+    decoder = NMEA_Decoder()
+    if body is None:
+        body = read_log_body(filename)
+    records = decoder.decode(body)
+    lines = body.count(b'\n') + (not body.endswith(b'\n'))
+    return records, decoder.rejected, decoder.unsupported, lines, decoder.sensors
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def select_sensor(records, sensor):
+    # Function to take the decoded records of one sensor, by its index in the
+    # decoder's sensors
+    selected = {}
+    for kind, columns in records.items():
+        keep = columns['sensor'] == sensor
+        selected[kind] = {name: column[keep] for name, column in columns.items()}
+    return selected
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class SoundingSet:
+# Class to hold soundings as one contiguous NumPy column for each field,
+# kept in the order of PROCESSED_FIELDS with any other fields after them, so
+# a sounding takes no more memory than its values. Columns are looked up,
+# added and replaced by name like a dictionary of columns. Indexing with a
+# slice, a mask or an array of indexes selects soundings, and a slice shares
+# the columns instead of copying them. Times are integers so they keep their
+# nanosecond precision, every other field is a float with NaN where missing.
+    def __init__(self, columns=None):
+        self.columns = {}
+        self.update(columns or {})
+        
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+    
+    def __contains__(self, name):
+        return name in self.columns
+    
+    def __iter__(self):
+        return iter(self.columns)
+    
+    def __getitem__(self, key):
+        # Function to take a column by name, or a selection of the soundings
+        if isinstance(key, str):
+            return self.columns[key]
+        return SoundingSet({name: column[key] for name, column in self.columns.items()})
+    
+    def __setitem__(self, name, column):
+        # Function to add or replace a column. A single value is given to
+        # every sounding.
+        dtype = np.int64 if name == 'time' else np.float64
+        column = np.asarray(column, dtype=dtype)
+        if column.ndim == 0:
+            column = np.full(len(self), column, dtype=dtype)
+        self.columns[name] = column
+        order = {field: index for index, field in enumerate(PROCESSED_FIELDS)}
+        self.columns = dict(sorted(self.columns.items(),
+                                   key=lambda item: order.get(item[0], len(order))))
+        
+    def get(self, name, default=None):
+        return self.columns.get(name, default)
+    
+    def pop(self, name, default=None):
+        # Function to remove a column, returning it
+        return self.columns.pop(name, default)
+    
+    def items(self):
+        return self.columns.items()
+    
+    def update(self, columns):
+        # Function to add or replace several columns, returning the soundings
+        for name, column in columns.items():
+            self[name] = column
+        return self
+    
+    def copy(self):
+        return SoundingSet({name: column.copy() for name, column in self.columns.items()})
+    
+    def rows(self):
+        # Function to turn the soundings into rows of their fields
+        return columns_to_rows(self.columns)
+    
+    def nbytes(self):
+        # Function to return the memory taken by the columns in bytes
+        return sum(column.nbytes for column in self.columns.values())
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def join_soundings(sets):
+    # Function to join sets of soundings end to end. Fields missing from some
+    # of the sets are NaN for their soundings.
+    names = dict.fromkeys(name for soundings in sets for name in soundings)
+    return SoundingSet({name: np.concatenate(
+        [soundings[name] if name in soundings else np.full(len(soundings), np.nan)
+         for soundings in sets]) for name in names})
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def split_lines(soundings):
+    # Function to group soundings by their survey line, so each line can be
+    # worked on by itself. Soundings off every line are under 0.
+    lines = soundings['survey_line'].astype(np.int64)
+    order = np.argsort(lines, kind='stable')
+    numbers, starts = np.unique(lines[order], return_index=True)
+    return {int(number): soundings[group]
+            for number, group in zip(numbers, np.split(order, starts[1:]))}
+#-----------------------------------------------------------------------------
+
+# Number of soundings read from or written to a sounding store at a time
+STORE_CHUNK_ROWS = 100000
+
+#-----------------------------------------------------------------------------
+class Sounding_Store:
+# Class to keep soundings from many logs in one SQLite database, indexed by
+# time, survey line and position so a selection can be read without loading
+# the rest. Positions are kept in an R-tree, and soundings are added in one
+# transaction per log. Adding a log that is already in the store replaces its
+# soundings, so a log can be processed again without duplicating them.
+    def __init__(self, database='Output/soundings.sqlite'):
+        self.database = database
+        self.fields = [name for name in PROCESSED_FIELDS if name not in LINE_FIELDS]
+        self.connection = sqlite3.connect(database)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS soundings (id INTEGER PRIMARY KEY, '
+                'source TEXT, survey_line INTEGER, time INTEGER, '+
+                ', '.join(name+' REAL' for name in self.fields[1:])+')')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS soundings_time '
+                                    'ON soundings (time)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS soundings_line '
+                                    'ON soundings (survey_line, time)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS soundings_source '
+                                    'ON soundings (source)')
+            self.connection.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS sounding_positions USING '
+                'rtree(id, min_latitude, max_latitude, min_longitude, max_longitude)')
+            # Stores made before a field existed are given a column for it
+            stored = [row[1] for row in
+                      self.connection.execute('PRAGMA table_info(soundings)')]
+            for name in self.fields:
+                if name not in stored:
+                    self.connection.execute('ALTER TABLE soundings ADD COLUMN '+
+                                            name+' REAL')
+            
+    def append(self, soundings, source, survey_line=None):
+        # Function to add a SoundingSet, or a dictionary of sounding columns,
+        # of one log, replacing any soundings already stored from it. The
+        # survey line is one number for every sounding or a column with one
+        # for each, and is taken from the soundings when they have been split
+        # into lines. The number of soundings stored is returned.
+        columns = soundings
+        count = len(columns['time'])
+        if survey_line is None and 'survey_line' in columns:
+            survey_line = columns['survey_line'].astype(np.int64)
+        lines = np.broadcast_to(np.array(survey_line, dtype=object), count)
+        values = [columns[name] if name in columns else np.full(count, np.nan)
+                  for name in self.fields]
+        with self.connection:
+            self.remove(source)
+            first = self.connection.execute(
+                'SELECT COALESCE(MAX(id), 0) + 1 FROM soundings').fetchone()[0]
+            for start in range(0, count, STORE_CHUNK_ROWS):
+                stop = min(start + STORE_CHUNK_ROWS, count)
+                ids = range(first + start, first + stop)
+                # NaN is written as NULL so missing values stay missing
+                chunk = [np.where(np.isnan(column[start:stop]), None,
+                                  column[start:stop].astype(object))
+                         if column.dtype.kind == 'f' else column[start:stop].tolist()
+                         for column in values]
+                self.connection.executemany(
+                    'INSERT INTO soundings (id, source, survey_line, '+
+                    ', '.join(self.fields)+') VALUES ('+
+                    ', '.join('?'*(len(self.fields)+3))+')',
+                    zip(ids, itertools.repeat(source), lines[start:stop].tolist(),
+                        *chunk))
+                latitude = columns['latitude'][start:stop]
+                longitude = columns['longitude'][start:stop]
+                placed = ~(np.isnan(latitude) | np.isnan(longitude))
+                self.connection.executemany(
+                    'INSERT INTO sounding_positions VALUES (?, ?, ?, ?, ?)',
+                    zip(np.array(ids)[placed].tolist(), latitude[placed].tolist(),
+                        latitude[placed].tolist(), longitude[placed].tolist(),
+                        longitude[placed].tolist()))
+        print(f'{count} soundings from {source} added to {self.database}')
+        return count
+        
+    def remove(self, source):
+        # Function to remove the soundings of one log from the store
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM sounding_positions WHERE id IN '
+                '(SELECT id FROM soundings WHERE source = ?)', (source,))
+            self.connection.execute('DELETE FROM soundings WHERE source = ?', (source,))
+            
+    def select(self, names, start, stop, bounds, survey_line, source):
+        # Function to build the query for a selection of soundings. Times are
+        # nanoseconds since 1970 or datetimes, bounds are minimum latitude,
+        # minimum longitude, maximum latitude and maximum longitude.
+        query = 'SELECT '+', '.join('s.'+name for name in names)+' FROM soundings AS s'
+        where = []
+        values = []
+        if bounds is not None:
+            query += ' JOIN sounding_positions AS p ON p.id = s.id'
+            # The R-tree keeps single precision boxes rounded outwards, so
+            # the stored positions are checked exactly as well
+            where += ['p.max_latitude >= ?', 'p.max_longitude >= ?',
+                      'p.min_latitude <= ?', 'p.min_longitude <= ?',
+                      's.latitude BETWEEN ? AND ?', 's.longitude BETWEEN ? AND ?']
+            values += [bounds[0], bounds[1], bounds[2], bounds[3],
+                       bounds[0], bounds[2], bounds[1], bounds[3]]
+        for condition, value in (('s.time >= ?', start), ('s.time < ?', stop)):
+            if value is not None:
+                if isinstance(value, dt.datetime):
+                    value = datetime_to_ns(value)
+                where.append(condition)
+                values.append(int(value))
+        if survey_line is not None:
+            where.append('s.survey_line = ?')
+            values.append(survey_line)
+        if source is not None:
+            where.append('s.source = ?')
+            values.append(source)
+        if where:
+            query += ' WHERE '+' AND '.join(where)
+        return query+' ORDER BY s.time', values
+    
+    def read_chunks(self, names=None, start=None, stop=None, bounds=None,
+                    survey_line=None, source=None):
+        # Function to read a selection of soundings as dictionaries of columns
+        # of at most STORE_CHUNK_ROWS soundings, so selections larger than
+        # memory can be worked through a chunk at a time
+        names = list(names or ['source', 'survey_line'] + self.fields)
+        query, values = self.select(names, start, stop, bounds, survey_line, source)
+        cursor = self.connection.execute(query, values)
+        rows = cursor.fetchmany(STORE_CHUNK_ROWS)
+        while rows:
+            table = list(zip(*rows))
+            chunk = {}
+            for name, column in zip(names, table):
+                if name == 'source':
+                    chunk[name] = np.array(column, dtype=str)
+                elif name in ('time', 'survey_line'):
+                    chunk[name] = np.array([-1 if value is None else value
+                                            for value in column], dtype=np.int64)
+                else:
+                    chunk[name] = np.array(column, dtype=np.float64)
+            yield chunk
+            rows = cursor.fetchmany(STORE_CHUNK_ROWS)
+            
+    def read(self, names=None, start=None, stop=None, bounds=None,
+             survey_line=None, source=None):
+        # Function to read a selection of soundings as one dictionary of
+        # columns. Only the named columns are read, all of them by default.
+        chunks = list(self.read_chunks(names, start, stop, bounds, survey_line, source))
+        names = list(names or ['source', 'survey_line'] + self.fields)
+        if not chunks:
+            return {name: np.empty(0) for name in names}
+        return {name: np.concatenate([chunk[name] for chunk in chunks])
+                for name in names}
+    
+    def sources(self):
+        # Function to list the logs in the store with their sounding counts
+        # and time spans
+        return self.connection.execute(
+            'SELECT source, COUNT(*), MIN(time), MAX(time) FROM soundings '
+            'GROUP BY source ORDER BY MIN(time)').fetchall()
+    
+    def close(self):
+        # Function to close the store database
+        self.connection.close()
+#-----------------------------------------------------------------------------
+
+# Most raw log lines kept waiting for a GGA sentence before the oldest are
+# dropped, so a long GNSS outage does not hold on to every line
+STREAM_CARRY_LINES = 20000
+
+#-----------------------------------------------------------------------------
+class Sounding_Stream:
+# Class to extract soundings from raw log text as it arrives, with the same
+# steps as Raw_Log. The lines after the last GGA sentence that a sounding may
+# still depend on, and the RMC sentence before them, are kept and decoded
+# again with the next text, so each sounding is found once it is complete.
+# Soundings are corrected with a profile when one is given.
+    def __init__(self, metadata, profile=None):
+        self.metadata = metadata
+        self.profile = profile
+        self.model = Uncertainty_Model(metadata)
+        self.heave = None
+        if metadata['Heave_Filter'][0] != 'none':
+            self.heave = Heave_Filter(*metadata['Heave_Filter'][1:])
+        self.carry = b''
+        self.done = 0
+        self.count = 0
+        # Streamed and free run pings, and pings moved back by a latency, need
+        # the GGA after them as well as the one before
+        self.keep_gga = 2 if (metadata['Ping_Mode'][0] in STREAMED_PING_MODES or
+                              metadata['Latency'][0]) else 1
+        
+    def add(self, text, final=False):
+        # Function to decode new raw log lines and return the soundings they
+        # complete as a SoundingSet of SOUNDING_FIELDS, and CORRECTED_FIELDS with a
+        # profile, TPU_FIELDS, and HEAVE_FIELDS with a heave filter set. The
+        # last text of a log is final, and every sounding found in it is
+        # returned.
+        data = self.carry + text.encode()
+        raw_log = Raw_Log(None)
+        decoder = NMEA_Decoder()
+        raw_log.records = assign_epoch_times(decoder.decode(data), self.metadata)
+        if len(decoder.sensors) > 1:
+            raw_log.records = select_sensor(raw_log.records, 0)
+        lines = data.split(b'\n')
+        
+        # Soundings logged before the cut are complete. The lines kept start
+        # at the RMC before the first GGA that later soundings may use, and
+        # soundings that were already returned are not returned again.
+        gga = raw_log.records['GGA']['line']
+        cut = gga[-self.keep_gga] if len(gga) >= self.keep_gga else 0
+        if cut == 0 and len(lines) > STREAM_CARRY_LINES:
+            cut = len(lines) - STREAM_CARRY_LINES
+        if final:
+            cut = len(lines)
+        keep = cut
+        if self.keep_gga == 2:
+            # Streamed pings are timed when they were read, so one logged
+            # after a GGA sentence can come before it and need the GGA before
+            keep = gga[-3] if len(gga) >= 3 else 0
+        rmc = raw_log.records['RMC']['line']
+        rmc = rmc[rmc < keep]
+        if len(rmc):
+            keep = rmc[-1]
+        self.carry = b'\n'.join(lines[keep:])
+        
+        columns, sounding_lines = raw_log.locate_soundings(self.metadata)
+        done = (sounding_lines >= self.done) & (sounding_lines < cut)
+        self.done = max(cut - keep, 0)
+        columns = SoundingSet({name: column[done] for name, column in columns.items()})
+        columns['sounding_number'] = self.count + np.arange(len(columns['time']))
+        self.count += len(columns['time'])
+        if self.profile is not None:
+            corrected, harmonic = self.profile.correct_depths(columns['water_depth'],
+                                                              columns['soundspeed'])
+            columns['corrected_depth'] = corrected
+            columns['corrected_bottom_height'] = (columns['bottom_elip_height'] +
+                                                  corrected - columns['water_depth'])
+            columns['harmonic_soundspeed'] = harmonic
+        if self.heave is not None:
+            columns.update(self.heave.correct(columns, self.heave.causal(
+                columns['time'], columns['ant_elip_height'])))
+        # VDOP is only known from the GSA sentences still in this text, and
+        # HDOP stands in for it before them
+        vdop = values_before_times(raw_log.extract_gnss_quality(), 'vdop',
+                                   columns['time'])
+        columns['horizontal_tpu'], columns['vertical_tpu'] = self.model.propagate(
+            columns, vdop, columns['scan_length'])
+        return columns
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Coverage_Grid:
+# Class to keep a grid of the number of soundings and the mean and spread of
+# depth in square cells, on a flat projection around the first sounding. The
+# grid grows as soundings land outside it, and soundings are added a whole
+# array at a time. Soundings added with their vertical uncertainty are
+# weighted by its inverse square, so the mean depth of each cell leans on the
+# best soundings in it.
+    def __init__(self, cell_size=5.0):
+        self.cell_size = cell_size
+        self.origin = None
+        self.weighted = False
+        self.corner = np.zeros(2, dtype=np.int64)
+        self.count = np.zeros((0, 0), dtype=np.int64)
+        self.weight = np.zeros((0, 0))
+        self.total = np.zeros((0, 0))
+        self.squares = np.zeros((0, 0))
+        
+    def cells(self, latitude, longitude):
+        # Function to find the row and column of the cell of each position
+        if self.origin is None:
+            self.origin = (float(latitude[0]), float(longitude[0]))
+            self.scale = (110574.0, 111320.0*math.cos(math.radians(self.origin[0])))
+        rows = np.floor((latitude - self.origin[0])*self.scale[0]/self.cell_size)
+        columns = np.floor((longitude - self.origin[1])*self.scale[1]/self.cell_size)
+        return rows.astype(np.int64), columns.astype(np.int64)
+    
+    def add(self, latitude, longitude, depth, uncertainty=None):
+        # Function to add soundings to the grid, growing it to fit them.
+        # With uncertainties, soundings without one are left out.
+        valid = np.isfinite(latitude) & np.isfinite(longitude) & np.isfinite(depth)
+        weight = np.ones(len(depth))
+        if uncertainty is not None:
+            self.weighted = True
+            valid &= np.isfinite(uncertainty)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                weight = 1/np.maximum(uncertainty, 0.001)**2
+        if not valid.any():
+            return
+        depth = depth[valid]
+        weight = weight[valid]
+        rows, columns = self.cells(latitude[valid], longitude[valid])
+        top = self.corner + self.count.shape
+        low = np.array([rows.min(), columns.min()])
+        high = np.array([rows.max()+1, columns.max()+1])
+        if self.count.size:
+            # Grow with room to spare, so a moving vessel does not copy the
+            # grid for every new row of cells
+            low = np.where(low < self.corner, low - 32, self.corner)
+            high = np.where(high > top, high + 32, top)
+        if self.count.size == 0 or (low != self.corner).any() or (high != top).any():
+            shape = tuple(high - low)
+            start = self.corner - low
+            stop = start + self.count.shape
+            for name in ('count', 'weight', 'total', 'squares'):
+                grown = np.zeros(shape, dtype=getattr(self, name).dtype)
+                grown[start[0]:stop[0], start[1]:stop[1]] = getattr(self, name)
+                setattr(self, name, grown)
+            self.corner = low
+        cell = (rows - self.corner[0], columns - self.corner[1])
+        np.add.at(self.count, cell, 1)
+        np.add.at(self.weight, cell, weight)
+        np.add.at(self.total, cell, weight*depth)
+        np.add.at(self.squares, cell, weight*depth*depth)
+        
+    def add_soundings(self, columns):
+        # Function to add a dictionary of sounding columns, with the corrected
+        # depth where there is one and weighted by the vertical uncertainty
+        # when it has been found. Soundings are left unweighted when none of
+        # them has an uncertainty.
+        depth = columns['water_depth']
+        if 'corrected_depth' in columns:
+            depth = np.where(np.isnan(columns['corrected_depth']), depth,
+                             columns['corrected_depth'])
+        uncertainty = columns.get('vertical_tpu')
+        if uncertainty is not None and not np.isfinite(uncertainty).any():
+            print('Soundings have no vertical uncertainty, gridded unweighted.')
+            uncertainty = None
+        self.add(columns['latitude'], columns['longitude'], depth, uncertainty)
+        
+    def mean_depth(self):
+        # Function to return the mean depth of each cell, NaN where empty
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.total/self.weight
+    
+    def depth_spread(self):
+        # Function to return the standard deviation of depth in each cell
+        mean = self.mean_depth()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(np.maximum(self.squares/self.weight - mean*mean, 0))
+    
+    def mean_uncertainty(self):
+        # Function to return the uncertainty of the weighted mean depth of
+        # each cell, NaN where empty or when soundings were not weighted
+        with np.errstate(divide='ignore'):
+            uncertainty = 1/np.sqrt(self.weight)
+        uncertainty[(self.count == 0) | (not self.weighted)] = np.nan
+        return uncertainty
+    
+    def summary(self):
+        # Function to sum up the coverage of the grid
+        covered = int(np.count_nonzero(self.count))
+        return {'cells': covered, 'area': covered*self.cell_size**2,
+                'mean_depth': float(self.total.sum()/max(self.weight.sum(), 1e-12))}
+    
+    def save(self, filename):
+        # Function to save the grid with its origin and cell size
+        np.savez(filename, count=self.count, mean_depth=self.mean_depth(),
+                 depth_spread=self.depth_spread(),
+                 mean_uncertainty=self.mean_uncertainty(), corner=self.corner,
+                 origin=np.array(self.origin or (np.nan, np.nan)),
+                 cell_size=self.cell_size)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def stream_process(metadata, profile_filename, cell_size, grid_file, inbox, outbox):
+    # Function run by Stream_Processor away from acquisition. Batches of raw
+    # log lines are taken from the inbox, with any that queued up while the
+    # last ones were processed taken together, so the delay stays bounded.
+    # A summary of the grid goes to the outbox after each step, and the grid
+    # is saved once None arrives.
+    profile = None
+    if profile_filename:
+        profile = Profile(profile_filename)
+        profile.read_simple_svp()
+        profile.calculate_harmonic_mean()
+    extractor = Sounding_Stream(metadata, profile)
+    grid = Coverage_Grid(cell_size)
+    finished = False
+    while not finished:
+        batches = [inbox.get()]
+        while True:
+            try:
+                batches.append(inbox.get_nowait())
+            except queue.Empty:
+                break
+        finished = None in batches
+        batches = [batch for batch in batches if batch is not None]
+        if not batches:
+            batches = [('', time.time())]
+        columns = extractor.add(''.join(text for text, sent in batches), finished)
+        grid.add_soundings(columns)
+        summary = grid.summary()
+        summary['soundings'] = extractor.count
+        summary['latency'] = time.time() - min(sent for text, sent in batches)
+        outbox.put(summary)
+    grid.save(grid_file)
+    outbox.put(None)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Line_Segmenter:
+# Class to split a vessel track into survey lines and the turns and transits
+# between them. The track is on a line while the vessel holds its heading at
+# survey speed: its turn rate over a window of samples stays under a limit,
+# its speed is over a minimum, and its heading stays near the mean heading of
+# the line. Stretches shorter than the minimum duration are turns. Every step
+# works on whole columns of the track.
+    def __init__(self, max_turn_rate=3.0, max_heading_change=20.0,
+                 min_speed=1.0, min_duration=60.0, window=10.0):
+        self.max_turn_rate = max_turn_rate
+        self.max_heading_change = max_heading_change
+        self.min_speed = min_speed
+        self.min_duration = min_duration
+        self.window = window
+        
+    def track_heading(self, seconds, latitude, longitude, course):
+        # Function to return the heading of the track in degrees, unwrapped
+        # so it runs on through north. The course over ground is used where
+        # it was logged, and the bearing between positions elsewhere.
+        north = np.diff(latitude)*110574.0
+        east = np.diff(longitude)*111320.0*np.cos(np.radians(latitude[1:]))
+        bearing = np.degrees(np.arctan2(east, north)) % 360
+        heading = np.where(np.isnan(course), np.append(bearing[:1], bearing), course)
+        # Gaps are filled with the last heading before them
+        known = np.where(np.isnan(heading), 0, np.arange(len(heading)))
+        heading = heading[np.maximum.accumulate(known)]
+        return np.degrees(np.unwrap(np.radians(np.nan_to_num(heading))))
+    
+    def turn_rate(self, seconds, heading):
+        # Function to return the rate of turn in degrees per second over a
+        # window centred on each sample
+        first = np.searchsorted(seconds, seconds - self.window/2)
+        last = np.searchsorted(seconds, seconds + self.window/2, side='right') - 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rate = (heading[last] - heading[first])/(seconds[last] - seconds[first])
+        return np.nan_to_num(rate)
+    
+    def runs(self, steady, breaks):
+        # Function to number the runs of steady samples from 1, 0 elsewhere.
+        # A run also ends where the track breaks.
+        starts = steady & (~np.append(False, steady[:-1]) | breaks)
+        return np.where(steady, np.cumsum(starts), 0)
+    
+    def segment(self, times, latitude, longitude, course, speed):
+        # Function to return the line number of each track sample, numbered
+        # from 1 in time order, with 0 for turns, transits and stops. Times
+        # are in nanoseconds and speeds in knots, as decoded from RMC.
+        if len(times) == 0:
+            return np.zeros(0, dtype=np.int64)
+        seconds = (times - times[0])/1e9
+        heading = self.track_heading(seconds, latitude, longitude, course)
+        steady = ((np.abs(self.turn_rate(seconds, heading)) <= self.max_turn_rate) &
+                  (np.nan_to_num(speed) >= self.min_speed))
+        # Gaps in the track longer than the window hide any turn made in
+        # them, so the track breaks at gaps, and at heading jumps across them
+        breaks = np.append(False, (np.diff(seconds) > self.window) |
+                           (np.abs(np.diff(heading)) > self.max_heading_change))
+        
+        # Slow curves hold every turn rate under the limit, so samples that
+        # stray too far from the mean heading of their run are split off
+        runs = self.runs(steady, breaks)
+        mean = np.bincount(runs, heading)/np.maximum(np.bincount(runs), 1)
+        steady &= np.abs(heading - mean[runs]) <= self.max_heading_change
+        runs = self.runs(steady, breaks)
+        
+        first = np.full(runs.max()+1, np.inf)
+        last = np.full(runs.max()+1, -np.inf)
+        np.minimum.at(first, runs, seconds)
+        np.maximum.at(last, runs, seconds)
+        long_enough = last - first >= self.min_duration
+        long_enough[0] = False
+        numbers = np.where(long_enough, np.cumsum(long_enough), 0)
+        return numbers[runs]
+    
+    def report(self, times, lines):
+        # Function to print the lines found with their durations
+        print(f'{int(lines.max(initial=0))} survey lines found')
+        for number in range(1, int(lines.max(initial=0))+1):
+            line_times = times[lines == number]
+            print(f'    line {number}: {len(line_times)} samples, '
+                  f'{(line_times[-1]-line_times[0])/1e9:.0f} s')
+        print(f'    off line: {int(np.count_nonzero(lines == 0))} samples')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Heave_Filter:
+# Class to separate the heave of the vessel from the slowly changing ellipsoid
+# height of the GNSS antenna. Motion faster than the period is heave. In
+# processing, heights are resampled to a regular time step and low-passed
+# with the magnitude of a Butterworth filter applied forwards and backwards,
+# by FFT over each continuous stretch of a line, so it has no phase delay.
+# While recording, the low-pass is a mean over the last period, so only past
+# heights are used. Depths are referred to the mean waterline by adding the
+# heave, and the antenna height is the low-passed height. Bottom heights take
+# the heave from both, so they are not changed.
+    def __init__(self, period=20.0, order=2):
+        self.period = period
+        self.order = order
+        self.recent = (np.empty(0, dtype=np.int64), np.empty(0))
+        
+    def settings(self, method):
+        # Function to describe the filter, to be kept with its output
+        return {'method': method, 'period': self.period, 'order': self.order}
+    
+    def stretches(self, times, lines=None):
+        # Function to split soundings into continuous stretches, at gaps of
+        # over half a period and wherever the survey line changes
+        breaks = np.diff(times) > self.period*1e9/2
+        if lines is not None:
+            breaks |= np.diff(lines) != 0
+        return np.split(np.arange(len(times)), np.flatnonzero(breaks) + 1)
+    
+    def low_pass(self, seconds, heights):
+        # Function to low-pass the heights of one stretch without delay. The
+        # ends are padded with a period of the heights mirrored about them.
+        # The heights are resampled at the median of the steps between their
+        # times, leaving out repeated times, and None is returned when every
+        # time is the same.
+        steps = np.diff(seconds)
+        steps = steps[steps > 0]
+        if not len(steps):
+            return None
+        step = float(np.median(steps))
+        grid = np.arange(seconds[0], seconds[-1] + step/2, step)
+        values = np.interp(grid, seconds, heights)
+        pad = min(int(self.period/step), len(values) - 1)
+        padded = np.concatenate([2*values[0] - values[pad:0:-1], values,
+                                 2*values[-1] - values[-2:-pad-2:-1]])
+        frequency = np.fft.rfftfreq(len(padded), step)
+        gain = 1/(1 + (frequency*self.period)**(2*self.order))
+        smooth = np.fft.irfft(np.fft.rfft(padded)*gain, len(padded))
+        return np.interp(seconds, grid, smooth[pad:pad+len(values)])
+    
+    def zero_phase(self, times, heights, lines=None):
+        # Function to return the low-passed heights for processing, NaN where
+        # a height is missing or its stretch is too short to filter
+        slow = np.full(len(heights), np.nan)
+        valid = np.flatnonzero(~np.isnan(heights))
+        for part in self.stretches(times[valid], None if lines is None else lines[valid]):
+            index = valid[part]
+            if len(index) > 2:
+                filtered = self.low_pass((times[index] - times[index[0]])/1e9,
+                                         heights[index])
+                if filtered is not None:
+                    slow[index] = filtered
+        return slow
+    
+    def causal(self, times, heights):
+        # Function to return the low-passed heights while recording, as the
+        # mean of the heights over the period up to each one. The heights of
+        # the last period are kept for the next call.
+        valid = ~np.isnan(heights)
+        all_times = np.concatenate([self.recent[0], times[valid]])
+        all_heights = np.concatenate([self.recent[1], heights[valid]])
+        sums = np.cumsum(np.append(0, all_heights))
+        first = np.searchsorted(all_times, all_times - int(self.period*1e9), side='right')
+        ends = np.arange(1, len(all_times) + 1)
+        means = (sums[ends] - sums[first])/(ends - first)
+        slow = np.full(len(heights), np.nan)
+        slow[valid] = means[len(self.recent[0]):]
+        keep = all_times > all_times[-1] - int(self.period*1e9) if len(all_times) else []
+        self.recent = (all_times[keep], all_heights[keep])
+        return slow
+    
+    def correct(self, columns, slow):
+        # Function to return the columns changed by removing heave, given the
+        # low-passed heights. Heave already removed from the depths is put
+        # back first, so the filter can be run again with new settings.
+        old = np.nan_to_num(columns.get('heave', np.zeros(len(slow))))
+        heights = columns['ant_elip_height'] + old
+        heave = np.nan_to_num(heights - slow)
+        changed = {'ant_elip_height': np.where(np.isnan(slow), heights, slow),
+                   'water_depth': columns['water_depth'] - old + heave,
+                   'heave': heave}
+        if 'corrected_depth' in columns:
+            changed['corrected_depth'] = columns['corrected_depth'] - old + heave
+        return changed
+    
+    def apply(self, soundings):
+        # Function to remove heave from a SoundingSet over whole lines,
+        # returning the soundings
+        columns = soundings
+        heights = columns['ant_elip_height'] + np.nan_to_num(columns.get('heave', 0))
+        lines = columns.get('survey_line')
+        if lines is not None:
+            # Soundings joined from sets not split into lines have none
+            lines = np.nan_to_num(lines)
+        changed = self.correct(columns, self.zero_phase(columns['time'], heights, lines))
+        heave = changed['heave']
+        print(f'Heave removed from {len(heave)} soundings, standard deviation '
+              f'{float(np.std(heave)) if len(heave) else 0:.3f} m, largest '
+              f'{float(np.max(np.abs(heave), initial=0)):.3f} m')
+        return soundings.update({name: np.round(column, 3)
+                                 for name, column in changed.items()})
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Latency_Calibrator:
+# Class to estimate the latency of sonar time stamps behind GNSS time stamps,
+# as the seconds a ping was made before it was logged. In swell, the sonar
+# range rises and falls with the GNSS antenna height, so the lag of the peak
+# of their cross-correlation is the latency. On reciprocal lines over a
+# slope, a latency moves each line's profile forward along its own track, so
+# the two profiles are apart by twice the distance run in the latency. Both
+# are found over whole arrays, and given with a standard error.
+    def __init__(self, max_latency=2.0, step=0.01):
+        self.max_latency = max_latency
+        self.step = step
+        
+    def high_pass(self, values, window):
+        # Function to remove the part of a regularly sampled series that
+        # changes slower than the window, such as tide and the slope of the
+        # bottom, with a moving mean taken from cumulative sums
+        half = max(int(window/2), 1)
+        padded = np.concatenate([np.full(half, values[0]), values,
+                                 np.full(half, values[-1])])
+        sums = np.cumsum(np.append(0, padded))
+        mean = (sums[2*half+1:] - sums[:-2*half-1])/(2*half+1)
+        return values - mean
+    
+    def correlate(self, ping_series, gnss_series):
+        # Function to return the normalised cross-correlation of two regular
+        # series of the same length by FFT, at each lag in samples of the
+        # ping series behind the GNSS series, up to the largest latency
+        count = len(ping_series)
+        size = 1 << int(2*count - 1).bit_length()
+        spectrum = np.fft.rfft(ping_series, size)*np.conj(np.fft.rfft(gnss_series, size))
+        circular = np.fft.irfft(spectrum, size)
+        most = min(int(self.max_latency/self.step), count - 1)
+        lags = np.arange(-most, most + 1)
+        norm = np.sqrt(np.sum(ping_series**2)*np.sum(gnss_series**2))
+        return lags, circular[lags]/max(norm, 1e-12)
+    
+    def peak(self, lags, values):
+        # Function to find the lag of the peak of a sampled curve, between
+        # samples by fitting a parabola through the peak and its neighbours
+        best = int(np.argmax(values))
+        if 0 < best < len(values) - 1:
+            left, middle, right = values[best-1:best+2]
+            bend = left - 2*middle + right
+            if bend < 0:
+                return lags[best] + 0.5*(left - right)/bend, middle
+        return float(lags[best]), values[best]
+    
+    def from_swell(self, records, window=20.0, segments=8):
+        # Function to estimate the latency from the GNSS antenna height and
+        # sonar range logged in swell over a flat bottom. Both are resampled
+        # to a regular time step on the log clock and high-passed, and the
+        # spread of the estimates from separate segments gives the error.
+        gga = records['GGA']
+        depth = records['DEPTH']
+        height = gga['altitude'] + gga['separation']
+        gnss = ~np.isnan(height)
+        ping = ~np.isnan(depth['distance'])
+        start = max(gga['log_time'][gnss][0], depth['log_time'][ping][0])
+        stop = min(gga['log_time'][gnss][-1], depth['log_time'][ping][-1])
+        grid = np.arange(start, stop, int(self.step*1e9))
+        gnss_series = self.high_pass(np.interp(grid, gga['log_time'][gnss], height[gnss]),
+                                     window/self.step)
+        ping_series = self.high_pass(np.interp(grid, depth['log_time'][ping],
+                                               depth['distance'][ping]),
+                                     window/self.step)
+        lags, values = self.correlate(ping_series, gnss_series)
+        lag, correlation = self.peak(lags, values)
+        estimates = []
+        for part in np.array_split(np.arange(len(grid)), segments):
+            if len(part)*self.step > 4*self.max_latency:
+                estimates.append(self.peak(*self.correlate(ping_series[part],
+                                                           gnss_series[part]))[0])
+        error = (np.std(estimates, ddof=1)/math.sqrt(len(estimates))*self.step
+                 if len(estimates) > 1 else np.nan)
+        return {'method': 'swell', 'latency': lag*self.step, 'error': error,
+                'correlation': float(correlation)}
+    
+    def along_track(self, columns, heading, origin):
+        # Function to return the distance of each sounding from an origin
+        # along a heading in degrees, on a flat projection, and its bottom
+        # height, sorted by distance and leaving out missing values
+        north = (columns['latitude'] - origin[0])*110574.0
+        east = (columns['longitude'] - origin[1])*111320.0*math.cos(math.radians(origin[0]))
+        distance = north*math.cos(math.radians(heading)) + east*math.sin(math.radians(heading))
+        height = columns['bottom_elip_height']
+        if 'corrected_bottom_height' in columns:
+            height = np.where(np.isnan(columns['corrected_bottom_height']), height,
+                              columns['corrected_bottom_height'])
+        keep = ~(np.isnan(distance) | np.isnan(height))
+        order = np.argsort(distance[keep])
+        return distance[keep][order], height[keep][order]
+    
+    def from_reciprocal_lines(self, first, second, grid_step=0.1):
+        # Function to estimate the latency from the soundings of two lines
+        # run in opposite directions over a slope, as columns of
+        # SOUNDING_FIELDS. The bottom heights of the second line are moved
+        # along the track by every shift up to the largest latency at once,
+        # and the shift with the least mean square difference to the first
+        # line is found. The latency is on top of any already configured.
+        # Its error comes from the curvature of the misfit at its minimum.
+        heading = float(np.nanmedian(first['heading']))
+        origin = (float(first['latitude'][0]), float(first['longitude'][0]))
+        first_distance, first_height = self.along_track(first, heading, origin)
+        second_distance, second_height = self.along_track(second, heading, origin)
+        
+        speed = np.nanmean(np.concatenate([first['speed'], second['speed']]))*0.514444
+        most = 2*speed*self.max_latency
+        low = max(first_distance[0], second_distance[0]) + most
+        high = min(first_distance[-1], second_distance[-1]) - most
+        if high - low < 10*grid_step:
+            print('The lines do not overlap enough to estimate the latency')
+            return None
+        grid = np.arange(low, high, grid_step)
+        shifts = np.arange(-most, most + grid_step/2, grid_step)
+        first_grid = np.interp(grid, first_distance, first_height)
+        moved = np.interp(grid[None, :] - shifts[:, None], second_distance, second_height)
+        misfit = np.mean((first_grid[None, :] - moved)**2, axis=1)
+        shift = self.peak(shifts/grid_step, -misfit)[0]*grid_step
+        
+        best = int(np.argmin(misfit))
+        error = np.nan
+        if 0 < best < len(misfit) - 1:
+            bend = (misfit[best-1] - 2*misfit[best] + misfit[best+1])/grid_step**2
+            if bend > 0:
+                error = math.sqrt(2*misfit[best]/(len(grid)*bend))/(2*speed)
+        matched = np.interp(grid - shift, second_distance, second_height)
+        correlation = np.corrcoef(first_grid, matched)[0, 1]
+        return {'method': 'reciprocal lines', 'latency': shift/(2*speed),
+                'error': error, 'correlation': float(correlation)}
+    
+    def report(self, result):
+        # Function to print an estimate with its error and correlation
+        print(f"Latency from {result['method']}: {result['latency']:.3f} s "
+              f"+/- {result['error']:.3f} s (correlation {result['correlation']:.2f})")
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Uncertainty_Model:
+# Class to propagate the total horizontal and vertical uncertainty of
+# soundings, one standard deviation in metres, from the GNSS fix, the sound
+# speed, the sonar's range resolution and the offset uncertainties in the
+# Uncertainty row of the configuration. The sources are taken as independent
+# and added in quadrature over whole columns, and the median of each source is
+# kept for the report.
+    def __init__(self, metadata):
+        self.antenna, self.transducer, self.soundspeed = metadata['Uncertainty']
+        fixes = sorted(GNSS_UNCERTAINTY)
+        self.fixes = np.array(fixes)
+        self.gnss = np.array([GNSS_UNCERTAINTY[fix] for fix in fixes])
+        self.sources = {}
+        
+    def gnss_uncertainty(self, fix_quality):
+        # Function to look up the horizontal and vertical GNSS uncertainty at
+        # a DOP of 1 for each fix quality, NaN for unlisted fixes
+        index = np.clip(np.searchsorted(self.fixes, fix_quality), 0, len(self.fixes)-1)
+        listed = self.fixes[index] == fix_quality
+        return (np.where(listed, self.gnss[index, 0], np.nan),
+                np.where(listed, self.gnss[index, 1], np.nan))
+    
+    def propagate(self, columns, vdop, scan_length, harmonic=None):
+        # Function to return the horizontal and vertical uncertainty of each
+        # sounding in columns of SOUNDING_FIELDS. HDOP stands in for VDOP
+        # where no GSA sentence was logged. The sonar's range is read from
+        # one of ECHO_SAMPLES samples over the scan length. Uncorrected
+        # depths are out by the difference between the surface sound speed
+        # the sonar used and the harmonic mean, when it is given, while
+        # corrected depths keep only the uncertainty of the sound speed.
+        horizontal_gnss, vertical_gnss = self.gnss_uncertainty(columns['fix_quality'])
+        vdop = np.where(np.isnan(vdop), columns['hdop'], vdop)
+        depth = columns['water_depth']
+        corrected = np.zeros(len(depth), dtype=bool)
+        if 'corrected_depth' in columns:
+            corrected = ~np.isnan(columns['corrected_depth'])
+            depth = np.where(corrected, columns['corrected_depth'], depth)
+        speed_error = np.full(len(depth), self.soundspeed)
+        if harmonic is not None:
+            speed_error = np.where(corrected, speed_error,
+                                   np.hypot(speed_error, harmonic - columns['soundspeed']))
+        
+        self.sources = {
+            'horizontal': {'gnss': horizontal_gnss*columns['hdop'],
+                           'antenna_offset': self.antenna,
+                           'transducer_offset': self.transducer},
+            'vertical': {'gnss': vertical_gnss*vdop,
+                         'antenna_offset': self.antenna,
+                         'transducer_offset': self.transducer,
+                         'range_resolution': scan_length/ECHO_SAMPLES/math.sqrt(12),
+                         'soundspeed': np.abs(depth)*speed_error/columns['soundspeed']}}
+        return tuple(np.sqrt(sum(np.square(source) for source in sources.values()))
+                     *np.ones(len(depth)) for sources in self.sources.values())
+    
+    def apply(self, soundings, horizontal, vertical):
+        # Function to add the uncertainties to a SoundingSet. Any
+        # uncertainties already added are replaced.
+        return soundings.update({'horizontal_tpu': np.round(horizontal, 3),
+                                 'vertical_tpu': np.round(vertical, 3)})
+    
+    def report(self):
+        # Function to print the median size of each source of uncertainty
+        for direction, sources in self.sources.items():
+            print(f'Median {direction} uncertainty sources (m):')
+            for name, source in sources.items():
+                print(f'    {name}: {float(np.nanmedian(source)):.3f}')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Quality_Gate:
+# Class to reject soundings by GNSS quality and by their uncertainty. Each
+# configured check is evaluated over whole columns and combined into a single
+# mask, and the number of soundings failing each check is kept for the report.
+    def __init__(self, fix_qualities=None, max_hdop=None, max_pdop=None,
+                 max_vdop=None, min_satellites=None, max_horizontal_tpu=None,
+                 max_vertical_tpu=None):
+        self.fix_qualities = fix_qualities
+        self.max_hdop = max_hdop
+        self.max_pdop = max_pdop
+        self.max_vdop = max_vdop
+        self.min_satellites = min_satellites
+        self.max_horizontal_tpu = max_horizontal_tpu
+        self.max_vertical_tpu = max_vertical_tpu
+        self.rejected = {}
+        
+    def mask(self, soundings, quality=None):
+        # Function to flag the soundings that pass every configured check.
+        # PDOP and VDOP are taken from the GNSS quality series at the last
+        # epoch at or before each sounding, as streamed and delayed pings fall
+        # between epochs. Soundings with a missing value fail the check for it.
+        columns = soundings
+        checks = {}
+        if self.fix_qualities is not None:
+            checks['fix_quality'] = np.isin(columns['fix_quality'],
+                                            self.fix_qualities)
+        if self.max_hdop is not None:
+            checks['hdop'] = columns['hdop'] <= self.max_hdop
+        if self.min_satellites is not None:
+            checks['satellites'] = columns['satellites'] >= self.min_satellites
+        for name in ('pdop', 'vdop'):
+            limit = getattr(self, 'max_'+name)
+            if limit is None:
+                continue
+            if quality is None:
+                print(f'No GNSS quality series given, {name} check skipped.')
+                continue
+            checks[name] = values_before_times(quality, name, columns['time']) <= limit
+        for name in TPU_FIELDS:
+            limit = getattr(self, 'max_'+name)
+            if limit is None:
+                continue
+            if name not in columns:
+                print(f'Soundings have no uncertainty yet, {name} check skipped.')
+                continue
+            checks[name] = columns[name] <= limit
+        
+        passed = np.ones(len(soundings), dtype=bool)
+        self.rejected = {}
+        for name, check in checks.items():
+            self.rejected[name] = int(np.count_nonzero(~check))
+            passed &= check
+        return passed
+    
+    def apply(self, soundings, quality=None):
+        # Function to keep only the soundings that pass the gate
+        passed = self.mask(soundings, quality)
+        self.report(len(soundings), int(np.count_nonzero(passed)))
+        return soundings[passed]
+    
+    def report(self, total, kept):
+        # Function to print the number of soundings failing each check
+        print(f'{kept} of {total} soundings passed the quality gate.')
+        for name, count in self.rejected.items():
+            print(f'    {name}: {count} failed')
+#-----------------------------------------------------------------------------
+
+# Number of pings in each chunk of bottom detection
+BOTTOM_CHUNK_PINGS = 20000
+
+#-----------------------------------------------------------------------------
+class Bottom_Detector:
+# Class to pick the bottom in echo profiles. Every method works on a block of
+# pings as a 2-D array of pings by samples, so no Python code runs per ping.
+# Methods are 'maximum' for the strongest sample, 'threshold' for the first
+# sample above the threshold, and 'leading_edge' for where the echo first
+# rises to edge_fraction of its peak. The tracking gate searches each ping
+# only within gate metres of the median pick of the track_pings pings around
+# it, so single pings cannot jump to weeds or a second bottom return.
+    def __init__(self, method='leading_edge', threshold=60, edge_fraction=0.5,
+                 blanking=0.3, gate=1.0, track_pings=11):
+        self.method = method
+        self.threshold = threshold
+        self.edge_fraction = edge_fraction
+        self.blanking = blanking
+        self.gate = gate
+        self.track_pings = track_pings
+        
+    def pick(self, samples, usable):
+        # Function to pick the bottom among the usable samples of each ping,
+        # as a fractional sample index, with the peak amplitude and whether a
+        # bottom was found
+        values = np.where(usable, samples, 0)
+        rows = np.arange(len(values))
+        peak_index = values.argmax(axis=1)
+        peak = values[rows, peak_index]
+        found = peak >= self.threshold
+        if self.method == 'maximum':
+            return peak_index.astype(np.float64), peak, found
+        
+        if self.method == 'threshold':
+            level = np.full(len(values), float(self.threshold))
+            index = (values >= level[:, None]).argmax(axis=1)
+        else:
+            level = self.edge_fraction*peak
+            columns = np.arange(values.shape[1])
+            below = (values < level[:, None]) & (columns < peak_index[:, None])
+            last_below = values.shape[1] - 1 - below[:, ::-1].argmax(axis=1)
+            index = np.where(below.any(axis=1), last_below + 1, 0)
+        # Interpolate where the echo crosses the level from the sample before
+        before = np.maximum(index - 1, 0)
+        low = values[rows, before]
+        high = values[rows, index]
+        step = np.where(high > low, (level - low)/np.maximum(high - low, 1e-9), 1)
+        return np.where(index > 0, before + np.clip(step, 0, 1), 0), peak, found
+    
+    def detect_block(self, pings):
+        # Function to pick the bottom in a block of ping records from
+        # read_echoes, giving the distance in millimetres (NaN where no bottom
+        # was found) and a confidence from 0 to 100
+        samples = np.asarray(pings['samples'], dtype=np.float32)
+        count = samples.shape[1]
+        start = pings['scan_start'].astype(np.float64)[:, None]
+        length = pings['scan_length'].astype(np.float64)[:, None]
+        ranges = start + (np.arange(count) + 0.5)*length/count
+        usable = ranges >= self.blanking*1000
+        
+        index, peak, found = self.pick(samples, usable)
+        distance = np.where(found, start[:, 0] + (index + 0.5)*length[:, 0]/count, np.nan)
+        if self.gate and len(distance):
+            half = self.track_pings//2
+            padded = np.pad(distance, half, constant_values=np.nan)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                track = np.nanmedian(sliding_window_view(padded, 2*half + 1), axis=1)
+            gated = np.abs(ranges - track[:, None]) <= self.gate*1000
+            usable &= gated | np.isnan(track)[:, None]
+            index, peak, found = self.pick(samples, usable)
+            distance = np.where(found, start[:, 0] + (index + 0.5)*length[:, 0]/count, np.nan)
+        
+        noise = np.median(samples, axis=1)
+        confidence = np.clip(100*(peak - noise)/np.maximum(255 - noise, 1), 0, 100)
+        return distance, np.where(found, np.round(confidence), 0)
+    
+    def detect_file(self, filename, processes=1):
+        # Function to pick the bottom in every ping of an echo file. The file
+        # is read in chunks of BOTTOM_CHUNK_PINGS pings, and chunks are shared
+        # out to worker processes when more than one process is asked for.
+        # None if the file is not an echo file.
+        echoes = read_echoes(filename)
+        if echoes is False:
+            return None
+        pings = len(echoes)
+        chunks = [(self, filename, start, min(start + BOTTOM_CHUNK_PINGS, pings))
+                  for start in range(0, pings, BOTTOM_CHUNK_PINGS)]
+        pool = process_pool(processes)
+        if pool is None:
+            results = [detect_chunk(chunk) for chunk in chunks]
+        else:
+            with pool:
+                results = pool.map(detect_chunk, chunks)
+        if not results:
+            return np.empty(0), np.empty(0)
+        return (np.concatenate([distance for distance, confidence in results]),
+                np.concatenate([confidence for distance, confidence in results]))
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def detect_chunk(chunk):
+    # Function to pick the bottom in one chunk of an echo file. Pings either
+    # side of the chunk are included so the tracking gate is the same as if
+    # the file was processed at once.
+    detector, filename, start, stop = chunk
+    echoes = read_echoes(filename)
+    half = detector.track_pings//2
+    first = max(start - half, 0)
+    distance, confidence = detector.detect_block(echoes[first:stop + half])
+    return (distance[start - first:stop - first],
+            confidence[start - first:stop - first])
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def process_pool(processes):
+    # Function to make a pool of worker processes, or None to work in this
+    # process. Workers are only forked, as starting them fresh would rerun
+    # the script that imported osplib, so without fork the work stays here.
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1:
+        return None
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print('Worker processes are not supported here, working in one process')
+        return None
+    return multiprocessing.get_context('fork').Pool(processes)
+#-----------------------------------------------------------------------------
+
+# Most pings drawn across an echogram, longer ranges are thinned to fit
+ECHOGRAM_WIDTH = 4000
+
+#-----------------------------------------------------------------------------
+def plot_echogram(echoes, start=0, stop=None):
+    # Function to plot the echo profiles of a range of pings from read_echoes
+    # with the sonar's bottom pick over them. Only the pings drawn are read
+    # from the file, and each is placed on a common depth axis so pings with
+    # different scan ranges line up.
+    import matplotlib.pyplot as plt
+    stop = len(echoes) if stop is None else min(stop, len(echoes))
+    step = max(1, -(-(stop - start)//ECHOGRAM_WIDTH))
+    pings = echoes[start:stop:step]
+    if len(pings) == 0:
+        print('No pings in the selected range')
+        return
+    samples = pings['samples'].shape[1]
+    top = pings['scan_start']/1000
+    bottom = (pings['scan_start'] + pings['scan_length'])/1000
+    depths = np.linspace(top.min(), bottom.max(), samples)
+    index = np.floor((depths[:, None] - top)/(bottom - top)*samples).astype(int)
+    inside = (index >= 0) & (index < samples)
+    image = np.take_along_axis(np.asarray(pings['samples']).T,
+                               np.clip(index, 0, samples - 1), axis=0)
+    image = np.where(inside, image, np.nan)
+    
+    plt.imshow(image, aspect='auto', cmap='viridis', interpolation='nearest',
+               extent=[start, start + len(pings)*step, depths[-1], depths[0]])
+    plt.plot(start + np.arange(len(pings))*step, pings['distance']/1000,
+             color='red', linewidth=0.5, label='Sonar Bottom Pick')
+    plt.title('Echogram')
+    plt.xlabel('Ping Number')
+    plt.ylabel('Range [m]')
+    plt.colorbar(label='Echo Strength')
+    plt.legend()
+    plt.gcf().set_dpi(300)
+    plt.show()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Clean_Soundings:
+# Class to manage 
+    def __init__(self, soundings):
+        self.soundings = soundings
+        self.clean_soundings()
+        
+    def pull_items(self):
+        self.ping = self.soundings['sounding_number'].tolist()
+        self.old_depth = self.soundings['water_depth'].tolist()
+        self.new_depth = self.soundings['corrected_depth'].tolist()
+        self.old_speed = self.soundings['soundspeed'].tolist()
+        self.new_speed = self.soundings['harmonic_soundspeed'].tolist()
+    
+    def plot_data(self):
+        import matplotlib.pyplot as plt
+        if self.right-self.left <= 100:
+            plt.scatter(self.ping, self.new_depth, label="Ping")
+        plt.plot(self.ping, self.new_depth, color='red', 
+                 linewidth=1, linestyle='solid', label="Corrected Depth")
+        #plt.plot(self.ping, self.old_depth, color='red', 
+                 #linewidth=1, linestyle='solid', label="Original")
+        plt.axis([self.left, self.right, self.y_min-0.05, self.y_max+0.05])
+        plt.title("Corrected Depth")
+        plt.xlabel("Ping Number")
+        plt.legend()
+        plt.ylabel("Depth [m]")
+        plt.gcf().set_dpi(300)
+        plt.grid()
+        plt.show()
+    
+    def clean_soundings(self):
+    # Function to allow plotting and cleaning of data
+        self.pull_items()
+        self.y_min = min(self.new_depth)
+        self.y_max = max(self.new_depth)
+        self.left = min(self.ping)
+        self.right = max(self.ping)
+        self.plot_data()
+        
+        new_soundings = self.soundings
+        while True:
+            print('-------------------------------------------------')
+            print('Please enter ping numbers for the desired left and right extents to zoom')
+            self.left = input('Enter left extent: ')
+            self.right = input('Enter right extent: ')
+            
+            try:
+                self.left = int(self.left)
+            except:
+                pass
+            try:
+                self.right = int(self.right)
+            except:
+                pass
+            
+            if self.left == 'min':
+                self.left = int(min(self.ping))
+            if self.right == 'max':
+                self.right = int(max(self.ping))
+            
+            self.y_min = min(self.new_depth[self.left:self.right])
+            self.y_max = max(self.new_depth[self.left:self.right])
+            
+            self.plot_data()
+            
+            print('Do you want to remove any soundings?')
+            print('    - yes           (You will be asked to select a range of soundings)')
+            print('    - no            (You will be able to change zoom again)')
+            print('    - save          (Save the data as is)')
+            print('    - exit          (Exit without saving)')
+            selection = input('Enter your selection here: ')
+            
+            if selection == 'exit':
+                return
+            elif selection == 'no':
+                pass
+            elif selection == 'save':
+                save_data(new_soundings)
+            elif selection == 'yes':
+                print('---------------------------------------------')
+                print('Please enter the left and right pings to delete')
+                left_delete = int(input('Leftmost ping to delete: '))
+                right_delete = int(input('Rightmost ping to delete: '))
+                
+                ping = new_soundings['sounding_number']
+                new_soundings = new_soundings[(ping < left_delete) | (ping > right_delete)]
+                
+                self.soundings = new_soundings
+                self.pull_items()
+
+                self.plot_data()
+                    
+#-----------------------------------------------------------------------------
+
+# Number of functions listed for each stage by Stage_Profiler with cprofile
+PROFILE_FUNCTIONS = 25
+
+#-----------------------------------------------------------------------------
+class Stage_Profiler:
+# Class to measure the stages of a processing run: wall and CPU time, the
+# peak and retained memory allocated while each ran, as traced by
+# tracemalloc, and the rows worked through per second. With cprofile, the
+# functions that took the most time in each stage are kept too. Tracing
+# slows the run down, so times are only comparable between profiled runs.
+# Worker processes are not measured, only the time spent waiting for them.
+# Stages are run untouched when the profiler is not enabled.
+    def __init__(self, enabled=False, cprofile=False):
+        self.enabled = enabled or cprofile
+        self.cprofile = cprofile
+        self.stages = []
+        
+    @contextlib.contextmanager
+    def stage(self, name):
+        # Function to measure the code in a with block as one stage. The
+        # block can set the rows it worked through in the record it is given.
+        # Stages are not nested, as each one resets the traced peak.
+        record = {'stage': name, 'rows': None}
+        if not self.enabled:
+            yield record
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        profile = cProfile.Profile() if self.cprofile else None
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.process_time() - cpu
+            current, peak = tracemalloc.get_traced_memory()
+            record['peak'] = peak - before
+            record['retained'] = current - before
+            if profile is not None:
+                text = io.StringIO()
+                stats = pstats.Stats(profile, stream=text)
+                stats.sort_stats('cumulative').print_stats(PROFILE_FUNCTIONS)
+                record['functions'] = text.getvalue()
+            self.stages.append(record)
+            
+    def table(self):
+        # Function to lay out the measurements of every stage as text lines
+        lines = [f"{'stage':<22}{'wall s':>9}{'cpu s':>9}{'peak MB':>10}"
+                 f"{'kept MB':>10}{'rows':>10}{'rows/s':>12}"]
+        for record in self.stages:
+            rows = record['rows']
+            rate = rows/record['wall'] if rows and record['wall'] > 0 else None
+            lines.append(f"{record['stage']:<22}{record['wall']:>9.3f}{record['cpu']:>9.3f}"
+                         f"{record['peak']/1e6:>10.1f}{record['retained']/1e6:>10.1f}"
+                         f"{'' if rows is None else rows:>10}"
+                         f"{'' if rate is None else format(rate, '.0f'):>12}")
+        return lines
+    
+    def report(self, filename):
+        # Function to print the table of stages, and write it with the
+        # busiest functions of each stage to a report file
+        if not self.enabled:
+            return
+        lines = self.table()
+        print('-----------------------------------------')
+        print('\n'.join(lines))
+        with open(filename, 'w') as file:
+            file.write('\n'.join(lines)+'\n')
+            for record in self.stages:
+                if 'functions' in record:
+                    file.write('\n'+'='*78+'\n'+record['stage']+'\n'+'='*78+'\n')
+                    file.write(record['functions'])
+        print('Profile report saved to '+filename)
+#-----------------------------------------------------------------------------
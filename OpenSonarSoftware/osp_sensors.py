@@ -0,0 +1,623 @@
+##############################################################################
+############################################################################## 
+# Open Sonar Library - Sensors
+##############################################################################
+##############################################################################
+# Created for the Open Sonar Project by:
+# Graham Christie, Isaac Fuller, Kara Sanford
+# January 2022
+#############################################
+# Version 5.0
+##############################################################################
+##############################################################################
+
+# GNSS receivers, sonars and sound speed probes, and the event loop that reads
+# their ports while online. Only Open Sonar Online uses them, so the serial
+# and sonar libraries are not loaded by the other programs.
+
+import os
+import io
+import time
+import threading
+import collections
+import queue
+import numpy as np
+import datetime as dt
+import serial
+from brping import Ping1D, PingMessage, PingParser, definitions
+import pynmea2
+import socket
+import select
+import selectors
+
+# Ping1D messages. Newer brping versions decode with the messages of every
+# Blue Robotics sonar by default, where some Ping1D ids mean something else.
+PING1D_PAYLOADS = dict(getattr(definitions, 'payload_dict_common', {}))
+PING1D_PAYLOADS.update(getattr(definitions, 'payload_dict_ping1d', {}))
+
+#########################################
+#########################################
+# Sensors
+#########################################
+#########################################
+
+#-----------------------------------------------------------------------------
+class GNSS:
+# Class to manage all GNSS functions. Additional receivers are given their own
+# port settings in place of GNSS_Com.
+    def __init__(self, metadata, com=None):
+        com = com or metadata['GNSS_Com']
+        self.gps_com = com[1]
+        self.gps_baud = com[2]
+        self.lines = None
+        self.waiting = collections.deque()
+    
+    def connect_gnss(self):
+        # Function to connect to the GNSS serial port
+        try:
+            self.gps_ser = serial.Serial(self.gps_com, self.gps_baud, timeout=0.1)
+            self.gps_sio = io.TextIOWrapper(io.BufferedRWPair(self.gps_ser, self.gps_ser))
+            self.gps_found = True
+            print('GNSS Connected')
+            return self.gps_found
+        except:
+            print('No GNSS Found!')
+            self.gps_found = False
+            return self.gps_found
+        
+    def disconnect_gnss(self):
+        # Function to close serial port to GNSS
+        if not self.gps_found:
+            return
+        self.gps_ser.close()
+        self.gps_found = False
+            
+    def read_with(self, mux):
+        # Function to have the port read by a Sensor_Mux, which passes every
+        # line on with the time it arrived rather than dropping old lines.
+        # Every line is logged, but when pings fall behind the GNSS only the
+        # newest position line of each type pings, so pings use the newest
+        # fix as they do when old lines are dropped.
+        if not self.gps_found:
+            return
+        self.lines = queue.Queue()
+        mux.add_lines(self.gps_ser, self.lines)
+            
+    def get_nmea(self):
+        # Function to get GGA strings with timestamp attached
+        if not self.gps_found:
+            gps_error = [['No','GNSS Found'],True]
+            return gps_error
+        while True:
+            ping = False
+            try:
+                if self.lines is None:
+                    self.gps_ser.reset_input_buffer()
+                    line = self.gps_sio.readline()
+                    time = dt.datetime.utcnow().time()
+                else:
+                    time, line = self.next_line()
+                msg = pynmea2.parse(line)
+                
+            
+                if type(msg) == pynmea2.types.talker.GGA:
+                    ping = True
+                elif type(msg) == pynmea2.types.talker.RMC:
+                    ping = True
+                elif type(msg) == pynmea2.types.talker.GLL:
+                    ping = True
+                if ping and self.lines is not None:
+                    ping = not self.newer_waiting(msg.sentence_type)
+                return time, msg, ping
+            except:
+                pass
+                
+    def next_line(self):
+        # Function to take the oldest line from the Sensor_Mux, waiting for
+        # one if none has arrived
+        if self.waiting:
+            return self.waiting.popleft()
+        return self.lines.get()
+    
+    def newer_waiting(self, sentence_type):
+        # Function to check whether a newer sentence of the same type has
+        # arrived, taking every line queued so far to look through
+        while True:
+            try:
+                self.waiting.append(self.lines.get_nowait())
+            except queue.Empty:
+                break
+        return any(line[3:6] == sentence_type for arrival, line in self.waiting)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Sonar:
+# Class to manage all sonar functions. The sonar is pinged on request, or in
+# streaming mode pings on its own while a reader thread, or a Sensor_Mux,
+# queues its messages. Additional sonars are given their own port settings in
+# place of Sonar_Com.
+    def __init__(self, metadata, com=None):
+        com = com or metadata['Sonar_Com']
+        self.sonar_com = com[1]
+        self.sonar_baud = com[2]
+        self.reader = None
+        self.streaming = False
+        self.stream = collections.deque()
+        self.last_observation = None
+        self.lock = threading.Lock()
+        self.capture_echoes = metadata.get('Echo_Capture', ['no'])[0] == 'yes'
+        
+    def connect_sonar(self):
+        # Function to connect to the sonar, over UDP if the port is given as
+        # udp:host:port, such as a Ping1D_Simulator
+        try:
+            try:
+                self.myping = Ping1D(PING1D_PAYLOADS)
+            except TypeError:
+                self.myping = Ping1D()
+            if str(self.sonar_com).startswith('udp:'):
+                host, port = self.sonar_com[4:].rsplit(':', 1)
+                self.myping.connect_udp(host, int(port))
+            else:
+                self.myping.connect_serial(self.sonar_com, self.sonar_baud)
+            self.sonar_found = True
+            print('Sonar Connected')
+            return self.sonar_found
+        except:
+            print('No Sonar Found!')
+            self.sonar_found = False
+            return self.sonar_found
+        
+    def send_ping(self):
+        # Function to take a single ping from sonar, with its echo profile
+        # when echoes are captured
+        if not self.sonar_found:
+            return
+        with self.lock:
+            if self.capture_echoes:
+                self.distance = self.myping.get_profile()
+            else:
+                self.distance = self.myping.get_distance()
+        self.distance['distance'] = self.distance['distance']/1000
+        self.distance['datetime'] = dt.datetime.utcnow()
+        self.time = self.distance['datetime'].time()
+        
+        observation = self.time, self.distance
+        
+        return observation
+            
+    def start_stream(self, ping_interval, mux=None):
+        # Function to have the sonar ping continuously every ping_interval
+        # milliseconds, sending a profile message for each ping. A reader
+        # thread, or the Sensor_Mux given, decodes the messages and queues
+        # them with their arrival time.
+        if not self.sonar_found:
+            return False
+        with self.lock:
+            if not self.myping.set_ping_interval(ping_interval):
+                print('Sonar did not accept a ping interval of '+str(ping_interval)+' ms')
+            self.myping.control_continuous_start(definitions.PING1D_PROFILE)
+        self.streaming = True
+        if mux is None:
+            self.reader = threading.Thread(target=self.read_stream, daemon=True)
+            self.reader.start()
+        else:
+            mux.add(self.myping.iodev, self.read_messages)
+        print(f'Sonar streaming with {ping_interval} ms between pings')
+        return True
+    
+    def read_stream(self):
+        # Function run by the reader thread
+        while self.streaming:
+            if not self.read_messages():
+                time.sleep(0.001)
+                
+    def read_messages(self):
+        # Function to queue every profile message that has arrived, returning
+        # whether any data was read. The time is taken before reading so it is
+        # no later than the arrival of the messages read.
+        arrival = dt.datetime.utcnow()
+        found = False
+        while True:
+            with self.lock:
+                message = self.myping.read()
+            if message is None:
+                return found
+            found = True
+            if message.message_id != definitions.PING1D_PROFILE:
+                continue
+            distance = {name: getattr(message, name) for name in
+                        ('distance', 'confidence', 'transmit_duration',
+                         'ping_number', 'scan_start', 'scan_length',
+                         'gain_setting', 'profile_data')}
+            distance['distance'] = distance['distance']/1000
+            distance['datetime'] = arrival
+            self.stream.append((arrival.time(), distance))
+            
+    def get_stream(self):
+        # Function to take the observations queued since the last call
+        observations = []
+        while self.stream:
+            observations.append(self.stream.popleft())
+        if observations:
+            self.last_observation = observations[-1]
+        return observations
+    
+    def stop_stream(self):
+        # Function to stop the sonar pinging continuously
+        if not self.streaming:
+            return
+        self.streaming = False
+        if self.reader is not None:
+            self.reader.join()
+            self.reader = None
+        with self.lock:
+            self.myping.control_continuous_stop(definitions.PING1D_PROFILE)
+            
+    def ping_to_string(self, ssp, observation=None):
+        #Function to turn the observation dictionary into a string for writing.
+        # Without an observation the last ping sent is used.
+        if not self.sonar_found:
+            return 'No Sonar Found'
+        if observation is None:
+            observation = self.time, self.distance
+        ping_time, distance = observation
+        dist = distance['distance']
+        conf = distance['confidence']
+        dura = distance['transmit_duration']
+        star = distance['scan_start']
+        leng = distance['scan_length']
+        gain = distance['gain_setting']
+        
+        ping_string = str(ping_time)+','+'$DEPTH,'+str(dist)+','+\
+            str(conf)+','+str(dura)+','+str(star)+','+str(leng)+','\
+            +str(gain)+','+str(ssp) + '\n'
+        
+        return ping_string
+    
+    def send_setting(self, message_id, **values):
+        # Function to send a Ping1D set message with the values given, without
+        # waiting for a reply so profiles are not held up while streaming
+        if not self.sonar_found:
+            return False
+        message = PingMessage(message_id, payload_dict=PING1D_PAYLOADS)
+        for name, value in values.items():
+            setattr(message, name, value)
+        message.pack_msg_data()
+        with self.lock:
+            self.myping.write(message.msg_data)
+        return True
+    
+    def set_mode_auto(self, auto):
+        # Function to let the sonar choose its own scan window and gain, or
+        # keep the ones set
+        return self.send_setting(definitions.PING1D_SET_MODE_AUTO, mode_auto=int(auto))
+    
+    def set_range(self, scan_start, scan_length):
+        # Function to set the scan window in metres, used when not in auto mode
+        return self.send_setting(definitions.PING1D_SET_RANGE,
+                                 scan_start=int(round(scan_start*1000)),
+                                 scan_length=int(round(scan_length*1000)))
+    
+    def set_ping_interval(self, ping_interval):
+        # Function to set the milliseconds between pings while streaming
+        return self.send_setting(definitions.PING1D_SET_PING_INTERVAL,
+                                 ping_interval=int(ping_interval))
+    
+    def set_sound_speed(self, soundspeed):
+        # Function to set a specified sound speed to the sonar
+        sound_speed_ms = soundspeed
+        if not self.sonar_found:
+            return False
+        sound_speed_mms = round(sound_speed_ms * 1000)
+        print('--------------------------------------------------------------')
+        print(f'Setting sound speed to {sound_speed_ms} m/s on sonar head')
+        print('--------------------------------------------------------------')
+        # The set message is packed here with the Ping1D messages, see
+        # PING1D_PAYLOADS. While streaming, profiles arriving during the reply
+        # are not queued.
+        message = PingMessage(definitions.PING1D_SET_SPEED_OF_SOUND,
+                              payload_dict=PING1D_PAYLOADS)
+        message.speed_of_sound = sound_speed_mms
+        message.pack_msg_data()
+        with self.lock:
+            self.myping.write(message.msg_data)
+            self.myping.legacyRequest(definitions.PING1D_SPEED_OF_SOUND)
+        return True
+    
+    def get_sound_speed(self):
+        # Function to get the sound speed set onthe sonar
+        if not self.sonar_found:
+            return
+        with self.lock:
+            sound_speed_mms = self.myping.get_speed_of_sound()
+        sound_speed_ms = sound_speed_mms['speed_of_sound']/1000
+        print('--------------------------------------------------------------')
+        print(f'Sound speed is to {sound_speed_ms} m/s on sonar head')
+        print('--------------------------------------------------------------')
+        return sound_speed_ms
+        
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Ping1D_Simulator:
+# Class to stand in for a Ping1D sonar over UDP, so acquisition can be run and
+# tested without hardware. Requests are answered and settings stored like the
+# sonar does, and while streaming a profile is sent every ping interval with
+# the bottom at a depth that rises and falls over a minute. In auto mode the
+# scan reaches twice the depth in 5 m steps, otherwise the scan window
+# set is kept and a bottom outside it is found with no confidence. A ping
+# takes at least the two way travel time to the end of the scan.
+    def __init__(self, host='127.0.0.1', port=12345, depth=5.0):
+        self.address = (host, port)
+        self.depth = depth
+        self.settings = {'ping_interval': 100, 'speed_of_sound': 1500000,
+                         'scan_start': 0, 'scan_length': 10000,
+                         'gain_setting': 2, 'mode_auto': 1, 'ping_enabled': 1,
+                         'firmware_version_major': 3, 'firmware_version_minor': 29,
+                         'voltage_5': 5000, 'device_id': 0, 'version_major': 1,
+                         'version_minor': 0, 'version_patch': 0,
+                         'transmit_duration': 100, 'confidence': 100}
+        self.ping_number = 0
+        self.streaming = False
+        self.client = None
+        self.running = False
+        
+    def start(self):
+        # Function to start serving in a background thread
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(self.address)
+        self.parser = PingParser(payload_dict=PING1D_PAYLOADS)
+        self.start_time = time.monotonic()
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        print(f'Ping1D simulator listening on udp:{self.address[0]}:{self.address[1]}')
+        
+    def stop(self):
+        # Function to stop serving and close the socket
+        self.running = False
+        self.thread.join()
+        self.socket.close()
+        
+    def serve(self):
+        # Function to answer messages and stream profiles until stopped
+        next_ping = time.monotonic()
+        while self.running:
+            wait = 0.05
+            if self.streaming:
+                wait = max(0, min(wait, next_ping - time.monotonic()))
+            readable, _, _ = select.select([self.socket], [], [], wait)
+            if readable:
+                data, self.client = self.socket.recvfrom(4096)
+                for byte in data:
+                    if self.parser.parse_byte(byte) == PingParser.NEW_MESSAGE:
+                        self.handle(self.parser.rx_msg)
+            if self.streaming and time.monotonic() >= next_ping:
+                self.send(definitions.PING1D_PROFILE)
+                scan_end = self.settings['scan_start'] + self.settings['scan_length']
+                next_ping += max(self.settings['ping_interval']/1000,
+                                 2*scan_end/self.settings['speed_of_sound'])
+                next_ping = max(next_ping, time.monotonic())
+                
+    def handle(self, message):
+        # Function to act on a message from the sonar's user
+        if message.message_id == definitions.COMMON_GENERAL_REQUEST:
+            self.send(message.requested_id)
+        elif message.message_id == definitions.PING1D_CONTINUOUS_START:
+            self.streaming = message.id == definitions.PING1D_PROFILE
+        elif message.message_id == definitions.PING1D_CONTINUOUS_STOP:
+            self.streaming = False
+        elif 1000 <= message.message_id < 1100:
+            # Ping1D set messages store their fields as settings
+            for name in message.payload_field_names:
+                self.settings[name] = getattr(message, name)
+        elif message.payload_length == 0:
+            self.send(message.message_id)
+            
+    def send(self, message_id):
+        # Function to send a message filled from the settings and a new ping
+        if self.client is None or message_id not in PING1D_PAYLOADS:
+            return
+        message = PingMessage(message_id, payload_dict=PING1D_PAYLOADS)
+        values = dict(self.settings)
+        if message_id in (definitions.PING1D_DISTANCE, definitions.PING1D_DISTANCE_SIMPLE,
+                          definitions.PING1D_PROFILE):
+            values.update(self.ping())
+        for name in message.payload_field_names:
+            if name in values:
+                setattr(message, name, values[name])
+        message.pack_msg_data()
+        self.socket.sendto(message.msg_data, self.client)
+        
+    def ping(self):
+        # Function to simulate a ping, with a profile of 200 samples over the
+        # scan range peaking at the bottom
+        elapsed = time.monotonic() - self.start_time
+        depth = self.depth + 0.5*np.sin(2*np.pi*elapsed/60)
+        self.ping_number += 1
+        if self.settings['mode_auto']:
+            self.settings['scan_start'] = 0
+            self.settings['scan_length'] = 5000*max(1, int(np.ceil(depth*2/5)))
+        scan_start = self.settings['scan_start']
+        scan_length = self.settings['scan_length']
+        found = scan_start <= depth*1000 <= scan_start + scan_length
+        samples = np.arange(200) + 0.5
+        ranges = scan_start + samples*scan_length/200
+        profile = 20 + 235*found*np.exp(-((ranges - depth*1000)/100)**2)
+        return {'distance': int(round(depth*1000)) if found else 0,
+                'confidence': self.settings['confidence'] if found else 0,
+                'ping_number': self.ping_number,
+                'profile_data': bytearray(profile.astype(np.uint8).tobytes()),
+                'profile_data_length': 200}
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Speed:
+# Class to manage all surface sound speed functions
+    def __init__(self, metadata):
+        self.svp_com = metadata['SVP_Com'][1]
+        self.svp_baud = metadata['SVP_Com'][2]
+        
+    def connect_speed(self):
+        # Function to connect to the surface svp
+        try:
+            self.svp_ser = serial.Serial(self.svp_com, self.svp_baud, timeout=2.5)
+            self.svp_sio = io.TextIOWrapper(io.BufferedRWPair(self.svp_ser, self.svp_ser))
+            self.svp_found = True
+            print('SVP Connected')
+            return self.svp_found
+        except:
+            print('No SVP Found!')
+            self.svp_found = False
+            return self.svp_found
+        
+    def get_surface_sound_speed(self):
+        try:
+            self.svp_ser.reset_input_buffer()
+            line = self.svp_ser.readline()
+            message = line.decode()
+            soundspeed = float(message)/1000
+            return soundspeed
+        except:
+            print('SVP Error')
+            pass
+
+    def disconnect_speed(self):
+        # Function to close serial port to surface svp
+        if not self.svp_found:
+            return
+        self.svp_ser.close()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+class Sensor_Mux:
+# Class to read the ports of every sensor from one thread. Ports are watched
+# by a selectors event loop and each is only read when it has data, so more
+# sensors add no threads and no blocking reads. Windows cannot select on
+# serial ports, so there every port is polled in the same loop instead.
+# Additional sensors from the Sensor rows of the metadata are kept here, and
+# their records are tagged with the sensor name in the raw log.
+    def __init__(self, metadata=None):
+        self.selector = selectors.DefaultSelector()
+        self.polling = os.name == 'nt'
+        self.handlers = []
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.records = collections.deque()
+        self.sensors = (metadata or {}).get('Sensors', [])
+        self.gnss = {}
+        self.sonars = {}
+        
+    def add(self, port, handler):
+        # Function to call handler whenever the port has data. Handlers read
+        # without blocking and return whether they read anything.
+        self.handlers.append(handler)
+        if not self.polling:
+            self.selector.register(port, selectors.EVENT_READ, handler)
+            
+    def add_lines(self, port, lines=None, tag=None):
+        # Function to read NMEA lines from a serial port, each with the time
+        # its data arrived. Lines go to the lines queue if one is given,
+        # otherwise they are tagged and kept for the raw log.
+        buffer = bytearray()
+        def read_lines():
+            arrival = dt.datetime.utcnow().time()
+            data = port.read(port.in_waiting)
+            if not data:
+                return False
+            buffer.extend(data)
+            *complete, rest = buffer.split(b'\n')
+            buffer[:] = rest
+            for line in complete:
+                line = line.strip().decode('ascii', 'replace')
+                if not line:
+                    continue
+                if lines is not None:
+                    lines.put((arrival, line))
+                else:
+                    self.records.append(str(arrival)+',#'+tag+','+line+'\n')
+            return True
+        self.add(port, read_lines)
+        
+    def connect_sensors(self, metadata):
+        # Function to connect the additional sensors, returning False if any
+        # could not be connected
+        connected = True
+        for tag, kind, port, baud, offset in self.sensors:
+            com = [tag, port, baud]
+            if kind == 'gnss':
+                device = GNSS(metadata, com)
+                if device.connect_gnss():
+                    self.gnss[tag] = device
+                    self.add_lines(device.gps_ser, tag=tag)
+                    continue
+            elif kind == 'sonar':
+                device = Sonar(metadata, com)
+                if device.connect_sonar():
+                    self.sonars[tag] = device
+                    continue
+            else:
+                print('Sensor '+tag+' has unknown type '+kind)
+            print('Sensor '+tag+' not connected')
+            connected = False
+        return connected
+    
+    def start_streams(self, ping_interval):
+        # Function to have every additional sonar stream pings. Additional
+        # sonars are never triggered, so their pings do not wait on each other.
+        for sonar in self.sonars.values():
+            sonar.start_stream(ping_interval, self)
+            
+    def set_sound_speed(self, soundspeed):
+        # Function to set the sound speed on every additional sonar
+        for sonar in self.sonars.values():
+            sonar.set_sound_speed(soundspeed)
+            
+    def get_records(self, soundspeed, display=None, echo_logs=None):
+        # Function to take the tagged records of the additional sensors that
+        # arrived since the last call, as raw log lines. Echo profiles of each
+        # additional sonar are written to its echo log in echo_logs, a
+        # dictionary of Echo_Writers by sensor name, when one is given.
+        records = []
+        while self.records:
+            records.append(self.records.popleft())
+        for tag, sonar in self.sonars.items():
+            for observation in sonar.get_stream():
+                ping_time, ping = sonar.ping_to_string(soundspeed, observation).split(',', 1)
+                records.append(ping_time+',#'+tag+','+ping)
+                if echo_logs and tag in echo_logs:
+                    echo_logs[tag].write(observation[1], soundspeed)
+                if display is not None:
+                    display.count_ping()
+        return records
+    
+    def start(self):
+        # Function to start the event loop in its own thread
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        
+    def run(self):
+        # Function run by the event loop thread until stopped
+        while not self.stop_event.is_set():
+            if self.polling:
+                if not any([handler() for handler in self.handlers]):
+                    time.sleep(0.002)
+                continue
+            for key, events in self.selector.select(timeout=0.1):
+                key.data()
+                
+    def stop(self):
+        # Function to stop the event loop and the additional sensors
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for sonar in self.sonars.values():
+            sonar.stop_stream()
+        for gnss in self.gnss.values():
+            gnss.disconnect_gnss()
+        self.selector.close()
+#-----------------------------------------------------------------------------
+
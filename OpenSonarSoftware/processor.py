@@ -14,18 +14,39 @@
 # This program should be used to process raw log files from Open Sonar Online.
 # Capabilities include:
 #     - Reading raw files to extract soundings with all available data
+#     - Merging several raw logs of a survey into one in time order
 #     - Reading raw files to extract dilution of precision data
+#     - Reading raw files to extract GNSS quality over time
+#     - Removing soundings with poor GNSS quality
 #     - Reading sound speed profiles to calculate harmonic mean sound speeds
+#     - Reducing raw CTD casts to sound speed profiles
 #     - Correcting sounding depths to harmonic mean sound speed from profiles
+#     - Estimating the total horizontal and vertical uncertainty of soundings
+#     - Splitting the track into survey lines and labelling each sounding
+#     - Calibrating the latency of sonar time stamps behind GNSS time stamps
+#     - Removing heave from depths and heights with a filter of GNSS heights
 #     - Vertically referencing sounding depths to water level and ellipsoid
 #     - Viewing processed data
+#     - Viewing echograms of captured echo profiles
+#     - Re-picking the bottom from captured echo profiles
 #     - Cleaning suspect soundings from processed data
+#     - Saving results as typed columns, or exporting them to csv
+#     - Adding soundings to a sounding store shared by many logs
+#     - Gridding soundings weighted by their uncertainty
+#     - Profiling the time, memory and throughput of each processing stage
+
+# Run with --profile to measure each processing stage, and with --cprofile
+# to also list the functions each stage spent its time in. The report is
+# printed at the end and saved in Output.
 
 ##############################################################################
 ##############################################################################
 
+import sys
 import time
 
+import numpy as np
+
 import osplib
 
 # Introductory text displayed
@@ -37,27 +58,45 @@ print('Please type your responses to the following questions in the terminal.')
 print('Do not use spaces in any response.')
 time.sleep(3)
 
+cprofile = '--cprofile' in sys.argv
+profiler = osplib.Stage_Profiler('--profile' in sys.argv, cprofile)
+
 proceed = False
 while not proceed:
-    raw_file = input('Enter raw log file name: ')
+    print('Several raw logs separated by commas are merged in time order')
+    raw_file = input('Enter raw log file name or segment manifest: ')
     if raw_file == 'smile':
         osplib.smile()
-    proceed = osplib.file_check(raw_file, '.csv')
+    raw_files = raw_file.split(',')
+    proceed = all(osplib.file_check(name, ('.csv', '.csv.gz', '.json')) for name in raw_files)
+    merger = None
+    if proceed and len(raw_files) > 1:
+        merger = osplib.Log_Merger(raw_files)
+        proceed = merger.check_headers()
 
 print('Reading raw log file. This may take a moment.....')
 
-raw_log = osplib.Raw_Log(raw_file)    
-metadata, read_log = raw_log.read_raw_log()
+raw_log = osplib.Raw_Log(raw_files if len(raw_files) > 1 else raw_file, merger)    
+with profiler.stage('read_raw_log') as stage:
+    metadata, read_log = raw_log.read_raw_log()
+    stage['rows'] = sum(len(records['line']) for records in (read_log or {}).values())
+if metadata is None:
+    print('The raw log could not be read. Exiting the processor.')
+    sys.exit()
 
 print('-----------------------------------------')
 print('Raw log file read and metadata extracted.')
 
-raw_soundings = False
+soundings = False
 profile = False
 raw_soundings_exists = False
 profile_exists = False
 correct = False
 dops = False
+gnss_quality = False
+sensor = None
+# Attributes kept with saved soundings, with the settings of any heave filter
+attrs = {'metadata': metadata, 'heave_filter': None}
 
 proceed = False
 while not proceed:
@@ -65,7 +104,8 @@ while not proceed:
     if not profile:
         print('    - profile       (Calculate harmonic mean sound speed profile)')
     
-    if not raw_soundings:
+    if not soundings:
+        print('    - bottom        (Re-pick the bottom from captured echo profiles)')
         print('    - soundings     (Extract soundings from raw data)')
         
     if profile_exists and raw_soundings_exists:
@@ -76,7 +116,15 @@ while not proceed:
     if raw_soundings_exists:
         if not dops:
             print('    - dops          (Extract dilution of precision values over time)')
+        print('    - uncertainty   (Estimate the total uncertainty of each sounding)')
+        print('    - lines         (Split the track into survey lines)')
+        print('    - heave         (Remove heave found from GNSS heights)')
+        print('    - quality       (Extract GNSS quality and remove soundings with poor quality)')
+        print('    - grid          (Grid soundings, weighted by their uncertainty)')
+        print('    - store         (Add soundings to a sounding store)')
         print('    - clean         (Clean data by removing bad points)')
+    print('    - echogram      (View captured echo profiles)')
+    print('    - latency       (Calibrate the sonar latency from swell or reciprocal lines)')
         
     selection = input('Type your selection here: ')
     
@@ -85,34 +133,249 @@ while not proceed:
         print('Please enter the name of the profile you wish to process below')
         profile_name = input('Enter profile name: ')
         raw_profile = osplib.Profile(profile_name)
-        raw_profile.read_simple_svp()
-        profile = raw_profile.calculate_harmonic_mean()
+        print('Enter svp for a depth and sound speed profile, or ctd for a raw')
+        print('CTD cast of pressure, temperature and salinity')
+        profile_type = input('Enter profile type: ')
+        if profile_type == 'ctd':
+            latitude = input('Enter cast latitude (leave empty for the survey mean): ')
+            latitude = float(latitude) if latitude else float(
+                np.nanmean(read_log['GGA']['latitude']))
+            bin_size = input('Enter depth bin size in metres (leave empty for 0.5): ')
+            print('Select a sound speed equation: chen_millero or del_grosso')
+            equation = input('Enter equation (leave empty for chen_millero): ')
+        with profiler.stage('profile') as stage:
+            if profile_type == 'ctd':
+                raw_profile.read_ctd_cast(latitude, float(bin_size) if bin_size else 0.5,
+                                          equation or 'chen_millero')
+            else:
+                raw_profile.read_simple_svp()
+            profile = raw_profile.calculate_harmonic_mean()
+            stage['rows'] = len(profile)
         profile_exists = True
         profile_for_save = map(lambda x: [x], profile)
         raw_profile.plot_hmss()
-        osplib.save_data(profile_for_save)
+        osplib.save_data(profile_for_save, ['harmonic_soundspeed'])
         
         
+    elif selection == 'bottom':
+        print('-----------------------------------------')
+        print('Please enter the name of the echo file saved with the raw log')
+        echo_file = input('Enter echo file name: ')
+        if osplib.file_check(echo_file, '.bin'):
+            echoes = osplib.read_echoes(echo_file)
+            if echoes is False:
+                continue
+            print('Select a bottom detection method:')
+            print('    - leading_edge  (Where the echo first rises to half its peak)')
+            print('    - threshold     (First sample above the threshold)')
+            print('    - maximum       (Strongest sample)')
+            method = input('Enter method: ')
+            settings = {}
+            for name in ('threshold', 'blanking', 'gate'):
+                value = input('Enter '+name+' (leave empty for the default): ')
+                if value:
+                    settings[name] = float(value)
+            processes = input('Enter number of processes to use (leave empty for all): ')
+            detector = osplib.Bottom_Detector(method, **settings)
+            with profiler.stage('bottom') as stage:
+                distance, confidence = detector.detect_file(
+                    echo_file, int(processes) if processes else None)
+                raw_log.apply_bottom_picks(echoes, distance, confidence)
+                stage['rows'] = len(distance)
+    
     elif selection == 'soundings':
-        raw_soundings = raw_log.extract_soundings(metadata)
+        if raw_log.sensor_records:
+            print('Additional sensors: '+', '.join(raw_log.sensor_records))
+            sensor = input('Enter a sonar name to use (leave empty for the main sonar): ') or None
+        with profiler.stage('extract_soundings') as stage:
+            soundings = raw_log.extract_soundings(metadata, sensor)
+            stage['rows'] = len(soundings)
         raw_soundings_exists = True
-        osplib.save_data(raw_soundings)
+        attrs['heave_filter'] = None
+        osplib.save_data(soundings, attrs=attrs)
     
     elif selection == 'correct':
-        soundings = raw_profile.correct_soundings(raw_soundings)
-        osplib.save_data(soundings)
+        uncertainty = 'vertical_tpu' in soundings
+        with profiler.stage('correct_soundings') as stage:
+            soundings = raw_profile.correct_soundings(soundings)
+            stage['rows'] = len(soundings)
+        if uncertainty:
+            # The uncertainty found before depends on the uncorrected depths
+            print('Estimating the uncertainty again for the corrected depths')
+            with profiler.stage('extract_uncertainty') as stage:
+                soundings = raw_log.extract_uncertainty(
+                    metadata, soundings, gnss_quality, raw_profile, sensor)
+                stage['rows'] = len(soundings)
+        osplib.save_data(soundings, attrs=attrs)
         
     elif selection == 'dops':
-        dops = raw_log.extract_dop()
-        osplib.save_data(dops)
+        with profiler.stage('extract_dop') as stage:
+            dops = raw_log.extract_dop()
+            stage['rows'] = len(dops)
+        osplib.save_data(dops, osplib.DOP_FIELDS)
+    
+    elif selection == 'uncertainty':
+        if gnss_quality is False:
+            with profiler.stage('extract_gnss_quality') as stage:
+                gnss_quality = raw_log.extract_gnss_quality()
+                stage['rows'] = len(gnss_quality['time'])
+            osplib.save_data(gnss_quality)
+        with profiler.stage('extract_uncertainty') as stage:
+            soundings = raw_log.extract_uncertainty(
+                metadata, soundings, gnss_quality,
+                raw_profile if profile_exists else None, sensor)
+            stage['rows'] = len(soundings)
+        osplib.save_data(soundings, attrs=attrs)
+    
+    elif selection == 'lines':
+        print('-----------------------------------------')
+        print('Splitting the track with the limits of the configuration:')
+        print(metadata['Line_Segmentation'])
+        with profiler.stage('extract_lines') as stage:
+            track = raw_log.extract_lines(metadata, soundings)
+            stage['rows'] = len(soundings)
+        osplib.save_data(track)
+        osplib.save_data(soundings, attrs=attrs)
+    
+    elif selection == 'heave':
+        print('-----------------------------------------')
+        print('Motion faster than the filter period is removed as heave')
+        period = input('Enter filter period in seconds (leave empty for '+
+                       str(metadata['Heave_Filter'][1])+'): ')
+        heave_filter = osplib.Heave_Filter(float(period) if period else
+                                           metadata['Heave_Filter'][1],
+                                           metadata['Heave_Filter'][2])
+        with profiler.stage('heave') as stage:
+            soundings = heave_filter.apply(soundings)
+            stage['rows'] = len(soundings)
+        attrs['heave_filter'] = heave_filter.settings('zero_phase')
+        osplib.save_data(soundings, attrs=attrs)
+    
+    elif selection == 'quality':
+        if gnss_quality is False:
+            with profiler.stage('extract_gnss_quality') as stage:
+                gnss_quality = raw_log.extract_gnss_quality()
+                stage['rows'] = len(gnss_quality['time'])
+            osplib.save_data(gnss_quality)
+        print('-----------------------------------------')
+        print('Please enter the limits for the quality gate below')
+        print('Leave a limit empty to skip that check')
+        fixes = input('Accepted fix qualities separated by commas (4 is RTK fixed, 5 is RTK float): ')
+        limits = {}
+        for name in ('max_hdop', 'max_pdop', 'max_vdop', 'min_satellites',
+                     'max_horizontal_tpu', 'max_vertical_tpu'):
+            limit = input('Enter '+name+': ')
+            try:
+                limits[name] = float(limit)
+            except ValueError:
+                pass
+        if fixes:
+            limits['fix_qualities'] = [int(fix) for fix in fixes.split(',')]
+        gate = osplib.Quality_Gate(**limits)
+        with profiler.stage('quality_gate') as stage:
+            stage['rows'] = len(soundings)
+            soundings = gate.apply(soundings, gnss_quality)
+        osplib.save_data(soundings, attrs=attrs)
+    
+    elif selection == 'latency':
+        print('-----------------------------------------')
+        print('Select a latency calibration method:')
+        print('    - swell         (GNSS height against sonar range in swell over a flat bottom)')
+        print('    - lines         (Two survey lines run in opposite directions over a slope)')
+        method = input('Enter method: ')
+        calibrator = osplib.Latency_Calibrator()
+        result = None
+        if method == 'swell':
+            result = calibrator.from_swell(read_log)
+        elif method == 'lines':
+            if not soundings or 'survey_line' not in soundings:
+                print('Extract soundings and split them into lines first')
+            else:
+                lines = osplib.split_lines(soundings)
+                print('Survey lines: '+', '.join(str(line) for line in lines if line))
+                first = lines.get(int(input('Enter first line: ')))
+                second = lines.get(int(input('Enter reciprocal line: ')))
+                if first and second:
+                    result = calibrator.from_reciprocal_lines(first, second)
+                if result is not None:
+                    result['latency'] += metadata['Latency'][0]
+        if result is not None:
+            calibrator.report(result)
+            print('Applying the latency extracts the soundings again, so any')
+            print('correction, uncertainty or lines will need to be found again')
+            if input('Apply this latency? (yes/no): ') == 'yes':
+                metadata['Latency'] = [round(result['latency'], 3)]
+                soundings = raw_log.extract_soundings(metadata, sensor)
+                raw_soundings_exists = True
+                attrs['heave_filter'] = None
+                osplib.save_data(soundings, attrs=attrs)
+    
+    elif selection == 'echogram':
+        print('-----------------------------------------')
+        print('Please enter the name of the echo file saved with the raw log')
+        echo_file = input('Enter echo file name: ')
+        if osplib.file_check(echo_file, '.bin'):
+            echoes = osplib.read_echoes(echo_file)
+            if echoes is False:
+                continue
+            linked = raw_log.extract_echo_index(echoes)
+            print(f'{len(echoes)} echo profiles, {int((linked >= 0).sum())} matched to raw log pings')
+            print('Enter the first and last ping to view, or leave empty for all')
+            first_ping = input('First ping: ')
+            last_ping = input('Last ping: ')
+            first_ping = int(first_ping) if first_ping else 0
+            last_ping = int(last_ping)+1 if last_ping else None
+            osplib.plot_echogram(echoes, first_ping, last_ping)
+    
+    elif selection == 'grid':
+        print('-----------------------------------------')
+        print('Corrected depths are gridded where they exist, and soundings are')
+        print('weighted by their vertical uncertainty once it has been estimated')
+        cell_size = input('Enter grid cell size in metres (leave empty for 5): ')
+        line = input('Enter a survey line to grid (leave empty for all): ')
+        gridded = soundings
+        if line:
+            gridded = osplib.split_lines(soundings).get(int(line))
+        if not gridded:
+            print('No soundings to grid')
+            continue
+        grid = osplib.Coverage_Grid(float(cell_size) if cell_size else 5.0)
+        with profiler.stage('grid') as stage:
+            grid.add_soundings(gridded)
+            stage['rows'] = len(gridded)
+        grid_file = 'Output/'+metadata['Survey'][0]+'_grid_'+time.strftime('%H%M%S')+'.npz'
+        grid.save(grid_file)
+        summary = grid.summary()
+        print(f"{summary['cells']} cells ({summary['area']:.0f} m2), mean depth {summary['mean_depth']:.2f} m")
+        print('Grid saved to '+grid_file)
+    
+    elif selection == 'store':
+        print('-----------------------------------------')
+        print('Soundings are stored with their corrected depths if they have them')
+        database = input('Enter store name (leave empty for Output/soundings.sqlite): ')
+        survey_line = input('Enter survey line number (leave empty for none): ')
+        source = raw_file
+        if merger is not None:
+            # Merged logs are one source, named after the log they start with
+            source = merger.filenames[0]+'+'+str(len(merger.filenames)-1)
+        store = osplib.Sounding_Store(database or 'Output/soundings.sqlite')
+        with profiler.stage('store') as stage:
+            stage['rows'] = store.append(soundings, source,
+                                         int(survey_line) if survey_line else None)
+        store.close()
     
     elif selection == 'clean':
+        if 'corrected_depth' not in soundings:
+            print('Correct the soundings before cleaning them')
+            continue
         proceed = True
         print('-----------------------------------------')
         print('Proceeding to vizualization and cleaning')
     else:
         pass
     
+# The profile is reported before cleaning, which waits on the user
+profiler.report('Output/'+metadata['Survey'][0]+'_profile_'+time.strftime('%H%M%S')+'.txt')
 osplib.Clean_Soundings(soundings)
     
     
@@ -0,0 +1,95 @@
+##############################################################################
+##############################################################################
+# Open Sonar Startup Benchmark
+##############################################################################
+##############################################################################
+# Created for the Open Sonar Project by:
+# Graham Christie, Isaac Fuller, Kara Sanford
+# January 2022
+#############################################
+# Version 1.0
+##############################################################################
+##############################################################################
+
+# This program times how long each Open Sonar program takes to load the
+# library, so startup stays quick on low-power field computers. Each program
+# is started in a fresh Python interpreter that imports osplib and looks up
+# every osplib name the program uses, which imports the modules those names
+# are in without running the program itself. The whole library is timed the
+# same way for comparison. For each program the median import time, the
+# median time to start the interpreter and import, and the heavy libraries
+# that were loaded are listed.
+
+##############################################################################
+##############################################################################
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# Programs timed, and the number of fresh interpreters started for each
+PROGRAMS = ['configurator.py', 'catalog.py', 'merger.py', 'online.py', 'processor.py']
+REPEATS = 5
+
+# Libraries listed when a program loads them
+HEAVY_LIBRARIES = ['numpy', 'matplotlib', 'serial', 'brping', 'pynmea2']
+
+# Code run in each fresh interpreter with the names to look up
+STARTUP_CODE = '''
+import sys
+import time
+start = time.perf_counter()
+import osplib
+for name in sys.argv[1:]:
+    getattr(osplib, name)
+print(time.perf_counter() - start)
+print(' '.join(name for name in %r if name in sys.modules))
+''' % (HEAVY_LIBRARIES,)
+
+#-----------------------------------------------------------------------------
+def program_names(filename):
+    # Function to find the osplib names a program uses
+    with open(filename) as file:
+        return sorted(set(re.findall(r'osplib\.(\w+)', file.read())))
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def time_startup(folder, names):
+    # Function to start fresh interpreters that look up the names given,
+    # returning the median import and total times in milliseconds and the
+    # heavy libraries loaded
+    imports = []
+    totals = []
+    for repeat in range(REPEATS):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', STARTUP_CODE] + names,
+                                cwd=folder, capture_output=True, text=True)
+        totals.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            print(result.stderr)
+            return None
+        output = result.stdout.splitlines()
+        imports.append(float(output[-2]))
+        loaded = output[-1]
+    return statistics.median(imports)*1000, statistics.median(totals)*1000, loaded
+#-----------------------------------------------------------------------------
+
+folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, folder)
+import osplib
+
+print('Open Sonar startup times, median of '+str(REPEATS)+' fresh interpreters')
+print(f"{'program':<18}{'import ms':>11}{'total ms':>10}   heavy libraries loaded")
+programs = [(program, program_names(os.path.join(folder, program)))
+            for program in PROGRAMS]
+programs.append(('whole library', sorted(osplib.LIBRARY_NAMES)))
+for program, names in programs:
+    timed = time_startup(folder, names)
+    if timed is None:
+        print(f'{program:<18}failed to start')
+        continue
+    import_ms, total_ms, loaded = timed
+    print(f'{program:<18}{import_ms:>11.0f}{total_ms:>10.0f}   {loaded or "none"}')
@@ -0,0 +1,85 @@
+##############################################################################
+##############################################################################
+# Open Sonar Test Logs
+##############################################################################
+##############################################################################
+
+# Writes small synthetic raw logs for the tests, with checksummed NMEA
+# sentences and DEPTH records laid out the way Open Sonar Online logs them.
+
+import functools
+
+HEADER = '''['OSP_RAW_LOG']
+Header_Start
+Test_Survey,Test_Location,2022-01-01 00:00:00
+6378137,298.257223563
+Test_Vessel
+Test_GNSS,Generic_NMEA,0.5,0,0,0
+Test_Sonar,BR_Ping,-0.5,0,0,0
+Test_SVP,Valeport_SVS,1480
+Test_GNSS,COM7,460800
+Test_Sonar,COM3,115200
+Test_SVP,COM9,9600
+Header_End
+'''
+
+#-----------------------------------------------------------------------------
+def sentence(body):
+    # Function to add the checksum to an NMEA sentence
+    checksum = functools.reduce(lambda total, char: total ^ ord(char), body, 0)
+    return f'${body}*{checksum:02X}'
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def clock(seconds):
+    # Function to split seconds since the survey day began into the day and
+    # the hours, minutes and seconds of that day
+    day, seconds = divmod(seconds, 86400)
+    return int(day), int(seconds//3600), int(seconds%3600//60), seconds%60
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def raw_log_lines(epochs, start=36000, ping_mode='triggered', dops=False, sensor=None):
+    # Function to make the body of a raw log with one GNSS epoch a second
+    # from start seconds into 1 January 2022, with every other epoch an RTK
+    # fixed position and the rest autonomous. Triggered pings are logged
+    # straight after the GGA sentence, streamed pings half a second later.
+    # With dops, a GSA sentence with a PDOP of 1 on fixed epochs and 3 on
+    # the rest follows the GGA. A sensor name adds a ping of an additional
+    # sonar, tagged with the name, after each ping.
+    lines = []
+    for epoch in range(epochs):
+        day, hours, minutes, seconds = clock(start + epoch)
+        utc = f'{hours:02d}{minutes:02d}{seconds:05.2f}'
+        date = f'{day+1:02d}0122'
+        log_time = f'{hours:02d}:{minutes:02d}:{seconds:09.6f}'
+        quality = 4 if epoch % 2 == 0 else 1
+        latitude = f'4800.{epoch*140:05d}'
+        lines.append(log_time+','+sentence(
+            f'GNRMC,{utc},A,{latitude},N,01130.00000,W,5.000,0.00,{date},,,A'))
+        lines.append(log_time+','+sentence(
+            f'GNGGA,{utc},{latitude},N,01130.00000,W,{quality},12,0.9,20.0,M,-33.9,M,,0000'))
+        if dops:
+            pdop = 1.0 if quality == 4 else 3.0
+            lines.append(log_time+','+sentence(
+                f'GNGSA,A,3,01,02,03,04,05,06,,,,,,,{pdop:.1f},0.9,{pdop:.1f},1'))
+        if ping_mode != 'triggered':
+            log_time = log_time[:-6]+'500000'
+        lines.append(log_time+f',$DEPTH,{10+epoch/100:.3f},100,100,0,20000,2,1480.0')
+        if sensor:
+            lines.append(log_time+f',#{sensor},$DEPTH,{12+epoch/100:.3f},100,100,0,20000,2,1480.0')
+    return lines
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_raw_log(filename, epochs, start=36000, ping_mode='triggered', dops=False,
+                  sensor=None):
+    # Function to write a raw log of raw_log_lines, with the ping mode in the
+    # header when it is not the default
+    header = HEADER
+    if ping_mode != 'triggered':
+        header = header.replace('Header_End', f'Ping_Mode,{ping_mode},100,50\nHeader_End')
+    with open(filename, 'w', newline='') as file:
+        file.write(header.replace('\n', '\r\n')+'\r\n'.join(
+            raw_log_lines(epochs, start, ping_mode, dops, sensor))+'\r\n')
+#-----------------------------------------------------------------------------
@@ -0,0 +1,102 @@
+##############################################################################
+##############################################################################
+# Open Sonar File Tests
+##############################################################################
+##############################################################################
+
+# Checks the readers and writers of Open Sonar files on small synthetic raw
+# logs. Run with pytest from the OpenSonarSoftware folder.
+
+import os
+import sys
+
+FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FOLDER)
+
+import osp_io
+from raw_logs import HEADER, raw_log_lines, write_raw_log
+
+#-----------------------------------------------------------------------------
+def write_lines(filename, lines):
+    # Function to write a raw log with the test header and the lines given
+    with open(filename, 'w', newline='') as file:
+        file.write(HEADER.replace('\n', '\r\n')+''.join(line+'\r\n' for line in lines))
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def write_block_log(filename, header_filename, lines, block_size):
+    # Function to write a raw log compressed in blocks, with its block index
+    # and the header of another log
+    metadata = dict(osp_io.read_config_file(header_filename), filetype=['OSP_RAW_LOG'])
+    osp_io.write_meta_header(filename, metadata)
+    log = osp_io.Block_Log_Writer(filename, block_size)
+    for line in lines:
+        log.write(line+'\r\n')
+    log.close()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_block_index_reads_back(tmp_path):
+    # The index of a block compressed log covers every line, counts the
+    # main pings and positions of each block and reads back any time range
+    lines = raw_log_lines(30, sensor='port')
+    write_lines(tmp_path/'raw.csv', lines)
+    write_block_log(str(tmp_path/'raw.csv.gz'), str(tmp_path/'raw.csv'), lines, 1000)
+    blocks = osp_io.read_block_index(str(tmp_path/'raw.csv.gz'))
+    assert len(blocks) > 3
+    assert blocks[-1, 0] + blocks[-1, 1] == os.path.getsize(tmp_path/'raw.csv.gz')
+    assert blocks[:, 2].sum() == len(lines)
+    assert (blocks[:, 5].sum(), blocks[:, 6].sum()) == (30, 30)
+    assert osp_io.format_line_time(blocks[0, 3]) == '10:00:00.000000'
+    assert osp_io.format_line_time(blocks[-1, 4]) == '10:00:29.000000'
+    body = osp_io.read_log_body(str(tmp_path/'raw.csv.gz'))
+    assert body == osp_io.read_log_body(str(tmp_path/'raw.csv'))
+    
+    part = osp_io.read_log_range(str(tmp_path/'raw.csv.gz'), '10:00:10', '10:00:12')
+    assert len(part) < len(body)
+    assert b'10:00:10.000000,$GNGGA' in part and b'10:00:12.000000,$GNGGA' in part
+    assert b'10:00:29.000000' not in part
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_catalog_counts_main_sensor_records(tmp_path):
+    # Plain logs are counted from their body and compressed logs from their
+    # block index, both leaving out records of additional sensors
+    lines = raw_log_lines(30, sensor='port')
+    write_lines(tmp_path/'raw.csv', lines)
+    write_block_log(str(tmp_path/'raw_blocks.csv.gz'), str(tmp_path/'raw.csv'), lines, 1000)
+    os.mkdir(tmp_path/'other')
+    write_raw_log(str(tmp_path/'other'/'raw.csv'), 5, start=50000)
+    catalog = osp_io.Survey_Catalog(str(tmp_path/'catalog.sqlite'))
+    catalog.scan(str(tmp_path))
+    entries = {os.path.relpath(entry['path'], tmp_path): entry for entry in catalog.find()}
+    assert sorted(entries) == [os.path.join('other', 'raw.csv'), 'raw.csv',
+                               'raw_blocks.csv.gz']
+    for name in ('raw.csv', 'raw_blocks.csv.gz'):
+        entry = entries[name]
+        assert (entry['records'], entry['pings'], entry['positions']) == (120, 30, 30)
+        assert (entry['first_time'], entry['last_time']) == ('10:00:00.000000',
+                                                             '10:00:29.000000')
+        assert entry['vessel'] == 'Test_Vessel'
+    assert entries['raw_blocks.csv.gz']['compressed'] == 1
+    other = entries[os.path.join('other', 'raw.csv')]
+    assert (other['records'], other['pings'], other['first_time']) == (15, 5, '13:53:20.000000')
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_merger_orders_lines_and_leaves_out_repeats(tmp_path):
+    # Overlapping logs given out of order are merged in time order, with
+    # lines found in both logs kept once and repeats within a log kept
+    lines = raw_log_lines(15)
+    late = lines[15:]
+    early = lines[:24]
+    early.insert(3, early[2])
+    write_lines(tmp_path/'late.csv', late)
+    write_lines(tmp_path/'early.csv', early)
+    merger = osp_io.Log_Merger([str(tmp_path/'late.csv'), str(tmp_path/'early.csv')])
+    assert merger.check_headers()
+    assert merger.filenames[0] == str(tmp_path/'early.csv')
+    merged = [line.rstrip('\r\n') for line in merger.lines()]
+    assert merged == lines[:3] + [lines[2]] + lines[3:]
+    assert merger.repeats == 9
+#-----------------------------------------------------------------------------
@@ -0,0 +1,128 @@
+##############################################################################
+##############################################################################
+# Open Sonar Processing Tests
+##############################################################################
+##############################################################################
+
+# Checks the post-processing library on small synthetic raw logs. Run with
+# pytest from the OpenSonarSoftware folder.
+
+import os
+import sys
+
+import numpy as np
+
+FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FOLDER)
+
+import osp_processing
+from raw_logs import raw_log_lines, write_raw_log
+
+#-----------------------------------------------------------------------------
+def write_log(folder, name, epochs, **options):
+    # Function to write a raw log in a folder, returning its name
+    filename = str(folder/name)
+    write_raw_log(filename, epochs, **options)
+    return filename
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def read_soundings(filename):
+    # Function to read a raw log and extract its soundings
+    raw_log = osp_processing.Raw_Log(filename)
+    metadata, records = raw_log.read_raw_log()
+    return raw_log, metadata, raw_log.extract_soundings(metadata)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_quality_gate_dops_on_streamed_pings(tmp_path):
+    # Streamed pings fall between GNSS epochs, so their DOPs come from the
+    # epoch before them
+    raw_log, metadata, soundings = read_soundings(
+        write_log(tmp_path, 'raw.csv', 40, ping_mode='stream', dops=True))
+    quality = raw_log.extract_gnss_quality()
+    assert len(soundings) == 39
+    assert not np.isin(soundings['time'], quality['time']).any()
+    for limit in ('max_pdop', 'max_vdop'):
+        kept = osp_processing.Quality_Gate(**{limit: 2.0}).apply(soundings, quality)
+        assert len(kept) == 20
+        assert (kept['fix_quality'] == 4).all()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_decoder_rejects_corrupted_sentences():
+    # Sentences with a wrong or missing checksum are left out and counted by
+    # reason, and the rest are decoded
+    lines = raw_log_lines(4)
+    lines[1] = lines[1][:-2]+('00' if lines[1][-2:] != '00' else '01')
+    lines[3] = lines[3].split('*')[0]
+    decoder = osp_processing.NMEA_Decoder()
+    records = decoder.decode(('\r\n'.join(lines)+'\r\n').encode())
+    assert decoder.rejected == {'bad_checksum': 1, 'missing_checksum': 1}
+    assert records['GGA']['line'].tolist() == [4, 7, 10]
+    assert records['RMC']['line'].tolist() == [0, 6, 9]
+    assert len(records['DEPTH']['line']) == 4
+    assert np.allclose(records['GGA']['latitude'], 48 + np.array([140, 280, 420])/1e5/60)
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_times_run_on_past_midnight(tmp_path):
+    # A log recorded over midnight keeps counting up into the next day
+    raw_log, metadata, soundings = read_soundings(
+        write_log(tmp_path, 'raw.csv', 10, start=86395))
+    start = np.datetime64('2022-01-01T23:59:55', 'ns').astype(np.int64)
+    expected = start + np.arange(10)*1000000000
+    assert raw_log.records['GGA']['utc'].tolist() == expected.tolist()
+    assert raw_log.records['GGA']['log_time'].tolist() == expected.tolist()
+    assert soundings['time'].tolist() == expected.tolist()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_store_append_replaces_a_source_and_queries(tmp_path):
+    # Adding a log again replaces its soundings, and queries select by time
+    # from start up to stop, position and source with only the columns asked
+    # for
+    raw_log, metadata, soundings = read_soundings(write_log(tmp_path, 'raw.csv', 20))
+    store = osp_processing.Sounding_Store(str(tmp_path/'store.sqlite'))
+    assert store.append(soundings, 'first.csv', 1) == 20
+    assert store.append(soundings, 'first.csv', 1) == 20
+    assert store.append(soundings[:5], 'second.csv', 2) == 5
+    assert [row[:2] for row in store.sources()] == [('first.csv', 20), ('second.csv', 5)]
+    
+    times = soundings['time']
+    selected = store.read(['time', 'water_depth'], start=times[3], stop=times[7],
+                          source='first.csv')
+    assert list(selected) == ['time', 'water_depth']
+    assert selected['time'].tolist() == times[3:7].tolist()
+    assert np.allclose(selected['water_depth'], soundings['water_depth'][3:7])
+    
+    latitude = soundings['latitude']
+    bounds = (latitude[10], -180, latitude[12], 180)
+    selected = store.read(['source', 'latitude'], bounds=bounds)
+    assert selected['source'].tolist() == ['first.csv']*3
+    assert np.allclose(selected['latitude'], latitude[10:13])
+    assert len(store.read(survey_line=2)['time']) == 5
+    store.close()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_heave_filter_separates_waves_from_the_height(tmp_path):
+    # Waves faster than the period are removed from the antenna height and
+    # added to the depth, leaving the slow change in height and the bottom
+    seconds = np.arange(0, 300, 0.2)
+    slow = 20 + 0.002*seconds
+    waves = 0.5*np.sin(2*np.pi*seconds/5)
+    soundings = osp_processing.SoundingSet({
+        'time': (seconds*1e9).astype(np.int64),
+        'ant_elip_height': slow + waves,
+        'water_depth': np.full(len(seconds), -10.0) - waves,
+        'bottom_elip_height': slow - 10.5})
+    bottom = soundings['ant_elip_height'] + soundings['water_depth']
+    osp_processing.Heave_Filter(period=20).apply(soundings)
+    middle = slice(250, -250)
+    assert np.abs(soundings['heave'][middle] - waves[middle]).max() < 0.02
+    assert np.abs(soundings['ant_elip_height'][middle] - slow[middle]).max() < 0.02
+    assert np.abs(soundings['water_depth'][middle] + 10).max() < 0.02
+    assert np.allclose(soundings['ant_elip_height'] + soundings['water_depth'], bottom,
+                       atol=0.002)
+#-----------------------------------------------------------------------------
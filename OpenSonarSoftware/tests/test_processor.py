@@ -0,0 +1,151 @@
+##############################################################################
+##############################################################################
+# Open Sonar Processor Tests
+##############################################################################
+##############################################################################
+
+# Runs the processor on a small synthetic raw log, answering its questions
+# from a script, to check the soundings each stage leaves are the ones later
+# stages use. Run with pytest from the OpenSonarSoftware folder.
+
+import os
+import runpy
+import sqlite3
+import sys
+
+import numpy as np
+
+FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FOLDER)
+
+from raw_logs import write_raw_log
+
+#-----------------------------------------------------------------------------
+class Out_Of_Answers(Exception):
+# Class of the error raised to stop the processor when it asks a question
+# after the scripted answers have run out
+    pass
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def run_processor(monkeypatch, answers):
+    # Function to run the processor with its questions answered in order,
+    # returning what it printed and whether it was still asking questions
+    # when the answers ran out
+    answers = iter(answers)
+    printed = []
+    def answer(prompt=''):
+        try:
+            return next(answers)
+        except StopIteration:
+            raise Out_Of_Answers(prompt)
+    monkeypatch.setenv('MPLBACKEND', 'Agg')
+    monkeypatch.setattr('builtins.input', answer)
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    monkeypatch.setattr('builtins.print', lambda *values, **options:
+                        printed.append(' '.join(str(value) for value in values)))
+    monkeypatch.setattr(sys, 'argv', ['processor.py'])
+    try:
+        runpy.run_path(os.path.join(FOLDER, 'processor.py'), run_name='__main__')
+    except Out_Of_Answers:
+        return printed, True
+    return printed, False
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_quality_gate_applies_to_stored_and_cleaned_soundings(tmp_path, monkeypatch):
+    # Soundings removed by the quality gate after correction must not be
+    # stored or cleaned
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('Output')
+    write_raw_log('raw.csv', 40)
+    with open('svp.csv', 'w') as file:
+        file.write('1,1480\n5,1485\n20,1490\n')
+    cleaned = []
+    import osp_processing
+    monkeypatch.setattr(osp_processing.Clean_Soundings, 'clean_soundings',
+                        lambda self: cleaned.append(len(self.soundings)))
+    printed, asking = run_processor(monkeypatch, [
+        'raw.csv',
+        'soundings', 'no',
+        'profile', 'svp.csv', 'svp', 'no',
+        'correct', 'no',
+        'quality', 'no', '4', '', '', '', '', '', '', 'no',
+        'store', 'store.sqlite', '',
+        'clean'])
+    assert not asking
+    assert any('20 of 40 soundings passed the quality gate' in line for line in printed)
+    assert '20 soundings from raw.csv added to store.sqlite' in printed
+    with sqlite3.connect('store.sqlite') as connection:
+        stored = connection.execute('SELECT COUNT(*), MIN(fix_quality), '
+                                    'MAX(fix_quality) FROM soundings').fetchone()
+    assert stored == (20, 4, 4)
+    assert cleaned == [20]
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_clean_needs_corrected_soundings(tmp_path, monkeypatch):
+    # Cleaning plots corrected depths, so it waits for a correction
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('Output')
+    write_raw_log('raw.csv', 10)
+    printed, asking = run_processor(monkeypatch, ['raw.csv', 'soundings', 'no', 'clean'])
+    assert asking
+    assert 'Correct the soundings before cleaning them' in printed
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_grid_after_uncertainty_and_correction(tmp_path, monkeypatch):
+    # Correcting the depths after their uncertainty was found must leave an
+    # uncertainty to weight the grid by, not an empty grid
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('Output')
+    write_raw_log('raw.csv', 40)
+    with open('svp.csv', 'w') as file:
+        file.write('1,1480\n5,1485\n20,1490\n')
+    printed, asking = run_processor(monkeypatch, [
+        'raw.csv',
+        'soundings', 'no',
+        'uncertainty', 'no', 'no',
+        'profile', 'svp.csv', 'svp', 'no',
+        'correct', 'no',
+        'grid', '', ''])
+    assert asking
+    assert 'Estimating the uncertainty again for the corrected depths' in printed
+    saved = [line for line in printed if line.startswith('Grid saved to ')]
+    assert len(saved) == 1
+    grid = np.load(saved[0][len('Grid saved to '):])
+    assert grid['count'].sum() == 40
+    assert np.isfinite(grid['mean_uncertainty'][grid['count'] > 0]).all()
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_echo_stages_report_a_file_that_is_not_an_echo_file(tmp_path, monkeypatch):
+    # Re-picking the bottom and viewing an echogram go back to the menu
+    # when the file given is not an echo file
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('Output')
+    write_raw_log('raw.csv', 10)
+    with open('notecho.bin', 'wb') as file:
+        file.write(bytes(64))
+    printed, asking = run_processor(monkeypatch, [
+        'raw.csv', 'bottom', 'notecho.bin', 'echogram', 'notecho.bin'])
+    assert asking
+    assert printed.count('notecho.bin is not an echo file') == 2
+#-----------------------------------------------------------------------------
+
+#-----------------------------------------------------------------------------
+def test_merged_logs_are_stored_as_one_source(tmp_path, monkeypatch):
+    # Soundings of merged logs are stored under the log they start with
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('Output')
+    write_raw_log('late.csv', 10, start=36010)
+    write_raw_log('early.csv', 10)
+    printed, asking = run_processor(monkeypatch, [
+        'late.csv,early.csv', 'soundings', 'no', 'store', 'store.sqlite', ''])
+    assert asking
+    with sqlite3.connect('store.sqlite') as connection:
+        stored = connection.execute('SELECT source, COUNT(*) FROM soundings '
+                                    'GROUP BY source').fetchall()
+    assert stored == [('early.csv+1', 20)]
+#-----------------------------------------------------------------------------